@@ -1,2 +1,10 @@
 class IntegrityValidationException(Exception):
-    pass
\ No newline at end of file
+    pass
+
+
+class RconException(Exception):
+    pass
+
+
+class RconAuthenticationException(RconException):
+    pass
@@ -1,6 +1,15 @@
+import json
+import mmap
 import os
+import threading
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from stat import filemode
 
+# what scan_tree keeps of each entry, taken from the DirEntry so nothing is stat'ed twice
+StatEntry = namedtuple("StatEntry", ["size", "mtime_ns", "inode", "mode", "is_dir"])
+
 
 # noinspection PyBroadException
 class FileIO:
@@ -43,12 +52,8 @@ class FileIO:
 
     @staticmethod
     def verify_dir(new_dir: str) -> int:
-        try:
-            if os.listdir(new_dir) is not []:
-                return 1
-
-        except FileNotFoundError:
-            return -1
+        # 1 if the directory exists, -1 if not, without listing it
+        return 1 if os.path.isdir(str(new_dir)) else -1
 
     @staticmethod
     def path_join(directory: str, file: str) -> str:
@@ -57,25 +62,214 @@ class FileIO:
 
     @staticmethod
     def overwrite(file_name: str, data):
-        with open(file_name, 'w') as f:
+        # atomic, a crash leaves either the old contents or the new ones, never a truncated file
+        with FileIO.atomic_open(file_name, "w") as f:
             f.write(str(data))
 
-    @staticmethod  # not needed in this project, but good to have if we use this class elsewhere
+    @staticmethod
     def append(file_name: str, data):
-        with open(str(file_name)) as current:
-            data = current.read() + data
-            current.close()
-        with open(str(file_name), 'w') as f:
-            f.write(data)
-            f.close()
+        # append mode, only the new data is written (creates the file if needed)
+        with open(str(file_name), "a") as f:
+            f.write(str(data))
+
+    @staticmethod
+    def append_records(file_name: str, records, fsync: bool = False):
+        # one buffered open for a whole batch, one record per line
+        with open(str(file_name), "a", buffering=1024 * 1024) as f:
+            f.writelines(f"{each}\n" for each in records)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    @staticmethod
+    def write_records(file_name: str, records, fsync: bool = True):
+        # replaces the file atomically with one record per line, written in one buffered pass
+        with FileIO.atomic_open(file_name, "w", fsync=fsync) as f:
+            f.writelines(f"{each}\n" for each in records)
+
+    @staticmethod
+    @contextmanager
+    def atomic_open(file_name: str, mode: str = "w", fsync: bool = True):
+        """
+        Writes go to a temp file next to file_name, which replaces it only once the block finishes without an error.
+        :param file_name: file to replace
+        :param mode: "w" or "wb"
+        :param fsync: flush the data (and the rename) to disk before returning, False for rebuildable files
+        """
+        file_name = str(file_name)
+        # unique per writer so concurrent writers of one file don't share a temp file
+        temp_name = f"{file_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_name, mode.replace("w", "x")) as f:
+                yield f
+                if fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(temp_name, file_name)
+        except BaseException:
+            if os.path.exists(temp_name):
+                os.remove(temp_name)
+            raise
+        if fsync and hasattr(os, "O_DIRECTORY"):
+            # the rename itself lives in the directory
+            directory = os.open(os.path.dirname(os.path.abspath(file_name)), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+
+    @staticmethod
+    @contextmanager
+    def read_mmap(file_name: str):
+        # read only memory map of the whole file, pages come in as they are touched instead of one big read
+        with open(str(file_name), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # mmap refuses empty files
+                yield b""
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield mapped
+
+    @staticmethod
+    def iter_lines(file_name: str, encoding: str = "utf-8"):
+        # lines of a large file without the trailing newline, through read_mmap
+        with FileIO.read_mmap(file_name) as mapped:
+            start = 0
+            end = len(mapped)
+            while start < end:
+                stop = mapped.find(b"\n", start)
+                if stop == -1:
+                    stop = end
+                yield mapped[start:stop].decode(encoding)
+                start = stop + 1
 
     @staticmethod
     def long_list_files(target_dir: str = ".") -> list:
         # if no directory specified, should list files where calling file lives.
-        dir_list = os.listdir(target_dir)
         data_list = []
-        for each in dir_list:
-            stat = os.stat(os.path.join(target_dir, each)).st_mode
-            mode = filemode(stat)
-            data_list.append("\t".join([mode, each]))
+        with os.scandir(target_dir) as entries:
+            for each in sorted(entries, key=lambda entry: entry.name):
+                mode = filemode(each.stat().st_mode)
+                data_list.append("\t".join([mode, each.name]))
         return data_list
+
+    @staticmethod
+    def scan_tree(root: str, recursive: bool = True, workers: int = None) -> dict:
+        """
+        os.scandir walk of root, subdirectories are scanned in parallel (scandir releases the GIL while listing).
+        Symlinks are reported as themselves and never followed.
+        :param root: directory to scan
+        :param recursive: descend into subdirectories, otherwise only the top level
+        :param workers: scanning threads, defaults to 4 per cpu (listing is io bound)
+        :return: relative path ('/' separated) -> StatEntry, ordered like a depth first walk with sorted names
+        """
+        root = str(root)
+
+        def scan_one(relative: str) -> (list, list):
+            found, sub_dirs = [], []
+            with os.scandir(os.path.join(root, *relative.split("/")) if relative else root) as entries:
+                for entry in entries:
+                    stat = entry.stat(follow_symlinks=False)
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    name = f"{relative}/{entry.name}" if relative else entry.name
+                    found.append((name, StatEntry(stat.st_size, stat.st_mtime_ns, entry.inode(), stat.st_mode, is_dir)))
+                    if is_dir and recursive:
+                        sub_dirs.append(name)
+            return found, sub_dirs
+
+        scanned = {}
+        with ThreadPoolExecutor(max_workers=workers or 4 * (os.cpu_count() or 1)) as pool:
+            pending = {pool.submit(scan_one, "")}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    found, sub_dirs = future.result()
+                    scanned.update(found)
+                    pending.update(pool.submit(scan_one, each) for each in sub_dirs)
+        # comparing path parts puts a directory's contents right after it, before its next sibling
+        return {each: scanned[each] for each in sorted(scanned, key=lambda path: path.split("/"))}
+
+    @staticmethod
+    def refresh_scan(root: str, scan: dict) -> dict:
+        """
+        Brings an earlier scan_tree of root up to date with entries created or removed since, without a stat of
+        every file: only root and the directories whose mtime moved (something was created, removed or renamed in
+        them) are listed again. Files already in the scan keep the size and mtime they had.
+        :return: a new scan, ordered like scan_tree's
+        """
+        root = str(root)
+        refreshed = dict(scan)
+        children = {}
+        for relative in scan:
+            children.setdefault(relative.rpartition("/")[0], []).append(relative)
+
+        def drop(relative: str):
+            refreshed.pop(relative, None)
+            for child in children.get(relative, []):
+                drop(child)
+
+        for relative in [""] + [each for each, entry in scan.items() if entry.is_dir]:
+            if relative and relative not in refreshed:
+                # under a directory that went away
+                continue
+            path = os.path.join(root, *relative.split("/")) if relative else root
+            try:
+                # root isn't in the scan, it is always listed, one directory without descending
+                moved = not relative or os.stat(path, follow_symlinks=False).st_mtime_ns != scan[relative].mtime_ns
+                listed = FileIO.scan_tree(path, recursive=False) if moved else {}
+            except FileNotFoundError:
+                drop(relative)
+                continue
+            if not moved:
+                continue
+            prefix = f"{relative}/" if relative else ""
+            for child in children.get(relative, []):
+                if child[len(prefix):] not in listed:
+                    drop(child)
+            for name, entry in listed.items():
+                if prefix + name in scan and scan[prefix + name].is_dir == entry.is_dir:
+                    continue
+                drop(prefix + name)
+                refreshed[prefix + name] = entry
+                if entry.is_dir:
+                    below = FileIO.scan_tree(os.path.join(path, name))
+                    refreshed.update((f"{prefix}{name}/{each}", sub) for each, sub in below.items())
+        return {each: refreshed[each] for each in sorted(refreshed, key=lambda path: path.split("/"))}
+
+
+class StatIndex:
+    """
+    Persistent (path, size, mtime, inode) record of a scanned tree, so a later run can tell what changed
+    from a fresh scan alone, without reading any file contents. Stored as one json record per line.
+    """
+
+    def __init__(self, file_name: str):
+        self.file_name = str(file_name)
+        self.entries = {}
+        if os.path.exists(self.file_name):
+            for line in FileIO.iter_lines(self.file_name):
+                path, size, mtime_ns, inode = json.loads(line)
+                self.entries[path] = [size, mtime_ns, inode]
+
+    def diff(self, scan: dict) -> dict:
+        # regular files only, a file is changed when its size or mtime differs, a new inode alone is not a change
+        # (reflink or copy snapshots get new inodes for identical data)
+        result = {"added": [], "changed": [], "removed": [], "unchanged": 0}
+        current = {path: entry for path, entry in scan.items() if not entry.is_dir}
+        for path, entry in current.items():
+            old = self.entries.get(path)
+            if old is None:
+                result["added"].append(path)
+            elif old[0] != entry.size or old[1] != entry.mtime_ns:
+                result["changed"].append(path)
+            else:
+                result["unchanged"] += 1
+        result["removed"] = [path for path in self.entries if path not in current]
+        return result
+
+    def update(self, scan: dict) -> dict:
+        # diff against the stored index, then store the scan in its place
+        result = self.diff(scan)
+        self.entries = {path: [each.size, each.mtime_ns, each.inode] for path, each in scan.items() if not each.is_dir}
+        FileIO.write_records(self.file_name, (json.dumps([path] + entry) for path, entry in self.entries.items()))
+        return result
@@ -1,106 +1,212 @@
+import atexit
 import datetime
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import sys
+import threading
+import time
 
-__logging_config__ = None
-__logger__ = None
-__name__ = None
-__file_name__ = None
-__log_level_dict = None
+# built once, write() used to rebuild this on every call
+LEVELS = {
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "warn": logging.WARNING,
+    "debug": logging.DEBUG,
+    "critical": logging.CRITICAL,
+    "exception": logging.ERROR,
+    "error": logging.ERROR
+}
+# never rate limited, these are the lines someone will go looking for
+UNLIMITED = {"error", "exception", "critical"}
+
+# one background writer per log file, shared by every LogHandler pointed at it
+_listeners = {}
+_listeners_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    # one json object per line, times in UTC
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for each in ["site", "suppressed"]:
+            if hasattr(record, each):
+                entry[each] = getattr(record, each)
+        return json.dumps(entry)
+
+
+def text_formatter() -> logging.Formatter:
+    # same line layout the basicConfig based version wrote, timestamp now taken from the record in the writer thread
+    formatter = logging.Formatter("%(levelname)s:%(name)s:UTC: %(asctime)s\t%(message)s")
+    formatter.converter = time.gmtime
+    return formatter
+
+
+def _listener_queue(file_name: str, json_lines: bool, max_bytes: int, backup_count: int, when: str) -> queue.Queue:
+    # starts the writer thread for file_name on first use, later handlers on the same file reuse it
+    with _listeners_lock:
+        if file_name not in _listeners:
+            os.makedirs(os.path.dirname(file_name), exist_ok=True)
+            if when:
+                handler = logging.handlers.TimedRotatingFileHandler(
+                    file_name, when=when, backupCount=backup_count, utc=True
+                )
+            else:
+                handler = logging.handlers.RotatingFileHandler(
+                    file_name, mode="a", maxBytes=max_bytes, backupCount=backup_count
+                )
+            handler.setFormatter(JsonFormatter() if json_lines else text_formatter())
+            log_queue = queue.SimpleQueue()
+            listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=False)
+            listener.start()
+            _listeners[file_name] = (log_queue, listener)
+        return _listeners[file_name][0]
+
+
+@atexit.register
+def stop_listeners():
+    # drains whatever is still queued into the files
+    with _listeners_lock:
+        for log_queue, listener in _listeners.values():
+            listener.stop()
+            for handler in listener.handlers:
+                handler.close()
+        _listeners.clear()
+
+
+class RateLimiter:
+    """
+    At most limit messages per call site per period seconds, the rest are counted instead of written,
+    and the count rides along on the next message that site gets through.
+    """
+
+    def __init__(self, limit: int = 20, period: float = 1.0):
+        self.limit = int(limit)
+        self.period = float(period)
+        self.__sites = {}
+        self.__lock = threading.Lock()
+
+    def allow(self, site) -> (bool, int):
+        # (write it, messages suppressed since the last one written)
+        now = time.monotonic()
+        with self.__lock:
+            started, count, suppressed = self.__sites.get(site, (now, 0, 0))
+            if now - started >= self.period:
+                started, count = now, 0
+            if count < self.limit:
+                self.__sites[site] = (started, count + 1, 0)
+                return True, suppressed
+            self.__sites[site] = (started, count, suppressed + 1)
+            return False, 0
 
 
 class LogHandler:
+    """
+    write() only formats the level and puts the record on a queue, a QueueListener thread does the file io,
+    so logging never blocks the backup. Files rotate by size (or by time with when), messages are capped
+    at max_message characters, and each call site is rate limited.
+    Nothing touches the disk until the first message is written, the log directory is created then,
+    so a module level LogHandler costs nothing at import.
+    """
 
-    def __init__(self, file_name, name="", logging_level: str = "debug"):
+    def __init__(
+            self,
+            file_name,
+            name="",
+            logging_level: str = "debug",
+            json_lines: bool = False,
+            max_bytes: int = 10 * 1024 * 1024,
+            backup_count: int = 5,
+            when: str = None,
+            rate_limit: int = 20,
+            rate_period: float = 1.0,
+            max_message: int = 64 * 1024
+    ):
+        """
+        :param file_name: log file
+        :param name: logger name, "" is the root logger (so library logging lands in the same file)
+        :param logging_level: default level for write() and the logger's threshold, one of LEVELS
+        :param json_lines: write one json object per line instead of text
+        :param max_bytes: rotate the file past this size, 0 never rotates by size
+        :param backup_count: rotated files to keep
+        :param when: rotate by time instead of size, TimedRotatingFileHandler style ('midnight', 'h', 'd'...)
+        :param rate_limit: messages per call site per rate_period, 0 for no limit
+        :param max_message: characters kept of a single message, the rest is cut with a note of how much
+        """
         self.__logger = logging.getLogger(name=name)
         self.__level = str(logging_level)
+        self.__max_message = int(max_message)
+        self.__limiter = RateLimiter(rate_limit, rate_period) if rate_limit else None
+        self.__file_name__ = os.path.abspath(str(file_name))
+        self.__logger.setLevel(LEVELS.get(self.__level, logging.DEBUG))
+        self.__options = (json_lines, max_bytes, backup_count, when)
+        self.__attached = False
 
-        log_level_dict = {
-            "info": logging.INFO,
-            "warning": logging.WARNING,
-            "warn": logging.WARNING,
-            "debug": logging.DEBUG,
-            "critical": logging.CRITICAL,
-            "error": logging.ERROR
-        }
-        self.__log_level_dict = log_level_dict
-        # -# for how many levels up to step, -0 is effectively same directory.,
-        # holdover from the last project this class was used in.
-        directory = os.sep.join(os.path.abspath(__file__).split(os.sep)[:-0])
-        full_log_file = os.path.join(directory, file_name)
-        self.__file_name__ = full_log_file
-        if logging_level in log_level_dict.keys():
-
-            self.__logging_config = \
-                logging.basicConfig(level=log_level_dict[self.__level], filename=full_log_file, filemode="a")
-
-        else:
-            self.__logging_config = \
-                logging.basicConfig(level=logging.DEBUG, filename=full_log_file, filemode="a")
+    def __attach(self):
+        log_queue = _listener_queue(self.__file_name__, *self.__options)
+        with _listeners_lock:
+            # one queue handler per logger and file, however many LogHandlers are created for them
+            if not any(getattr(each, "queue", None) is log_queue for each in self.__logger.handlers):
+                self.__logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        self.__attached = True
 
     def write(self, data: str, level: str = "", file_name: str = None):
         """
-        :param data:
-        :param level:
-        :param file_name:
+        :param data: message
+        :param level: one of LEVELS, the handler's level if unset
+        :param file_name: noted alongside the message, logged at info
         :return:
         """
-        data = "{}\t{}".format(self.timestamp(), data)
-        if level:
-            write_level = str(level)
-        else:
-            write_level = str(self.__level)
+        write_level = str(level) if level else str(self.__level)
+        if file_name:
+            data = "\t{}\n\t{}".format(file_name, data)
+            write_level = "info"
+        if write_level not in LEVELS:
+            data = "log level not specified, adding message as info:\n\t{}".format(data)
+            write_level = "debug"
+        if not self.__logger.isEnabledFor(LEVELS[write_level]):
+            return
+        if not self.__attached:
+            self.__attach()
+
+        caller = sys._getframe(1)
+        site = f"{caller.f_code.co_filename}:{caller.f_lineno}"
+        extra = {"site": site}
+        if self.__limiter is not None and write_level not in UNLIMITED:
+            allowed, suppressed = self.__limiter.allow(site)
+            if not allowed:
+                return
+            if suppressed:
+                extra["suppressed"] = suppressed
+                data = f"{data}\n\t({suppressed} similar messages suppressed)"
 
+        data = str(data)
+        if len(data) > self.__max_message:
+            data = f"{data[:self.__max_message]}... ({len(data) - self.__max_message} more characters)"
         if write_level == "debug":
             print("values:\ndata: {}\nlevel: {}".format(data, level))
-
-        level_dict = {
-            "info": self.__logger.info,
-            "warning": self.__logger.warning,
-            "warn": self.__logger.warning,
-            "debug": self.__logger.debug,
-            "critical": self.__logger.critical,
-            "exception": self.__logger.exception,
-            "error": self.__logger.error
-        }
-
-        if file_name:
-
-            """
-            need to get new file name to write to,
-            temporarily set to new file name
-            write data to new file
-            revert back to old file name for future logging
-            currently can at least change data written to log if filename added
-            WIP, not fully functional
-            """
-            # old_dir = self.__file_name__
-            # directory = os.sep.join(os.path.abspath(__file__).split(os.sep)[:-4])
-            # full_log_file = os.path.join(directory, "logs", file_name)
-            # print("full file name:\t{}".format(full_log_file))
-            # self.__logging_config = logging.basicConfig(level=logging.DEBUG, filename=full_log_file, filemode="a")
-            # level_dict[write_level](data)
-            #
-            # if write_level in level_dict.keys():
-            #     level_dict[write_level](data)
-            # else:
-            #     message = "log level not specified, adding message as info:\n\t{}".format(data)
-            #     self.__logger.debug(message)
-            # self.__logging_config = logging.basicConfig(level=logging.DEBUG, filename=old_dir, filemode="a")
-            level_dict["info"]("\t{}\n\t{}".format(file_name, data))
-        else:
-            if write_level in level_dict.keys():
-                level_dict[write_level](data)
-            else:
-                message = "log level not specified, adding message as info:\n\t{}".format(data)
-                self.__logger.debug(message)
+        self.__logger.log(LEVELS[write_level], data, exc_info=write_level == "exception", extra=extra)
 
     def adjust_logging_level(self, level: str):
+        if level in LEVELS:
+            self.__level = level
+            self.__logger.setLevel(LEVELS[level])
 
-        if level in self.__log_level_dict:
-            self.__logging_config = \
-                logging.basicConfig(level=self.__log_level_dict[self.__level],filemode="a")
+    @staticmethod
+    def flush():
+        # blocks until everything queued so far is in the files, then the writers carry on
+        with _listeners_lock:
+            for log_queue, listener in _listeners.values():
+                listener.stop()
+                listener.start()
 
     @staticmethod
     def timestamp():
-        return "UTC: " + str(datetime.datetime.utcnow())
+        return "UTC: " + str(datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None))
@@ -0,0 +1,3 @@
+from app.core.Custom_Errors import IntegrityValidationException
+from app.core.FileIO import FileIO, StatIndex
+from app.core.LogIO import LogHandler
@@ -0,0 +1,305 @@
+import json
+import os
+import stat
+import time
+
+from app.core import compression
+from app.core.FileIO import FileIO
+
+# region files hold chunks that are usually zlib compressed already, but not their headers and sector padding
+REGION_SUFFIXES = (".mca", ".mcr", ".mcc")
+# minecraft's .dat and structure .nbt files are gzipped nbt, the rest are compressed formats outright
+COMPRESSED_SUFFIXES = (
+    ".dat", ".dat_old", ".nbt", ".gz", ".zip", ".jar", ".png", ".ogg", ".zst", ".lz4", ".xz", ".bz2", ".7z"
+)
+# stats and advancements json, uncompressed nbt, configs
+SMALL_FILE = 64 * 1024
+FILE_CLASSES = ["region", "compressed", "small", "other"]
+# a class that shrinks less than this at every level is stored instead of compressed
+STORE_RATIO = 0.97
+# per class, slices of the class's files compressed at every level the first time a codec is seen
+CALIBRATION_SLICE = 64 * 1024
+CALIBRATION_SLICES = 16
+# weight of the newest measurement in the learned ratio and throughput
+LEARNING_RATE = 0.3
+# measured blocks smaller than this say more about overhead than about the data
+MIN_LEARN_BYTES = 256 * 1024
+# the plan is revisited with what was measured so far after this much input
+REPLAN_BYTES = 64 * 1024 * 1024
+# bytes per cpu second assumed for a level nothing was measured for
+DEFAULT_THROUGHPUT = 50 * 1024 * 1024
+RUN_HISTORY = 50
+
+
+def classify(name: str, size: int) -> str:
+    lower = str(name).lower()
+    if lower.endswith(REGION_SUFFIXES):
+        return "region"
+    if lower.endswith(COMPRESSED_SUFFIXES):
+        return "compressed"
+    if size <= SMALL_FILE:
+        return "small"
+    return "other"
+
+
+def cpu_workers(cpu_budget: float = None) -> int:
+    # cpu_budget: fraction of the machine's cores compression may keep busy, None for all of them
+    cores = os.cpu_count() or 1
+    return max(1, int(cores * cpu_budget)) if cpu_budget else cores
+
+
+def class_sample(source: str, files: list) -> bytes:
+    # evenly spaced slices of the files read back to back, like app.core.estimate.sample_ratio takes them
+    total = sum(size for _, size in files)
+    count = min(CALIBRATION_SLICES, -(-total // CALIBRATION_SLICE))
+    wanted = {(2 * i + 1) * total // (2 * count) for i in range(count)}
+    sample = bytearray()
+    offset = 0
+    for path, size in files:
+        for position in sorted(each for each in wanted if offset <= each < offset + size):
+            try:
+                with open(os.path.join(str(source), *path.split("/")), "rb") as f:
+                    f.seek(position - offset)
+                    sample += f.read(CALIBRATION_SLICE)
+            except OSError:
+                pass
+        offset += size
+    return bytes(sample)
+
+
+class CodecController:
+    """
+    Picks the codec for an archive and the level for each class of file in it, to fit a time or cpu budget:
+    the smallest archive whose compression is predicted to finish within time_budget seconds, on as many workers
+    as cpu_budget (a fraction of the cores) allows. With only a cpu budget it's the best ratio those workers give.
+    Ratio and throughput per codec, level and class are learned from every run (and a quick calibration the first
+    time), the plan is revised while the archive is written if compression falls behind.
+    Decisions, outcomes and what was learned are kept in a json file per world.
+    """
+
+    def __init__(
+            self, file_name: str, time_budget: float = None, cpu_budget: float = None, codecs: list = None,
+            workers: int = None
+    ):
+        if not time_budget and not cpu_budget:
+            raise ValueError("a codec controller needs a time budget or a cpu budget")
+        self.file_name = str(file_name)
+        self.time_budget = time_budget
+        self.cpu_budget = cpu_budget
+        self.codecs = [compression.check_codec(each) for each in codecs] if codecs else [
+            each for each in compression.available_codecs() if each != "none"
+        ]
+        self.workers = min(cpu_workers(cpu_budget), int(workers)) if workers else cpu_workers(cpu_budget)
+        self.history = {"model": {}, "runs": []}
+        if os.path.exists(self.file_name):
+            with open(self.file_name) as f:
+                self.history.update(json.load(f))
+        self.plan = None
+        self.decisions = []
+        self.outcome = None
+        self.__remaining = {}
+        self.__stream = None
+        self.__started = None
+        self.__since_plan = 0
+
+    def __estimate(self, codec: str, level: int, file_class: str) -> dict:
+        return self.history["model"].get(f"{codec}:{level}:{file_class}")
+
+    def __learn(self, codec: str, level: int, file_class: str, ratio: float, throughput: float):
+        key = f"{codec}:{level}:{file_class}"
+        known = self.history["model"].get(key)
+        if known is None:
+            self.history["model"][key] = {"ratio": ratio, "throughput": throughput, "runs": 1}
+            return
+        known["ratio"] += LEARNING_RATE * (ratio - known["ratio"])
+        known["throughput"] += LEARNING_RATE * (throughput - known["throughput"])
+        known["runs"] += 1
+
+    def __levels(self, codec: str) -> list:
+        info = compression.CODECS[codec]
+        return [info["store_level"]] + [each for each in info["levels"] if each != info["store_level"]]
+
+    def calibrate(self, source: str, files: dict):
+        # files: class -> [(path, size)], only codec/level/class combinations nothing was learned for are measured
+        for file_class, members in files.items():
+            missing = [
+                (codec, level) for codec in self.codecs for level in self.__levels(codec)
+                if self.__estimate(codec, level, file_class) is None
+            ]
+            if not missing:
+                continue
+            sample = class_sample(source, members)
+            if not sample:
+                continue
+            for codec, level in missing:
+                compressed, seconds = compression.measure_block(codec, level, sample)
+                self.__learn(codec, level, file_class, len(compressed) / len(sample), len(sample) / max(seconds, 1e-6))
+
+    def options(self, codec: str, file_class: str) -> list:
+        """
+        :return: (level, ratio, cpu seconds per byte) worth choosing between, cheapest first, each one smaller
+            than the one before, only the store level for a class that won't compress
+        """
+        known = []
+        for level in self.__levels(codec):
+            estimate = self.__estimate(codec, level, file_class)
+            if estimate is not None:
+                known.append((level, estimate["ratio"], 1 / max(estimate["throughput"], 1.0)))
+        if not known:
+            level = compression.CODECS[codec]["default_level"]
+            return [(level, 1.0, 1 / DEFAULT_THROUGHPUT)]
+        if min(each[1] for each in known) >= STORE_RATIO:
+            store = compression.CODECS[codec]["store_level"]
+            return [next((each for each in known if each[0] == store), min(known, key=lambda each: each[2]))]
+        front = []
+        for option in sorted(known, key=lambda each: (each[2], each[1])):
+            if not front or option[1] < front[-1][1]:
+                front.append(option)
+        return front
+
+    def choose(self, class_bytes: dict, seconds: float, codecs: list = None) -> dict:
+        """
+        Greedy knapsack: every class starts at its cheapest level, then the upgrade saving the most bytes per extra
+        cpu second is taken, for as long as the cpu seconds stay within what the workers have in seconds.
+        :param class_bytes: class -> bytes still to compress
+        :param seconds: wall seconds compression may take
+        :return: dict of codec, levels (class -> level), predicted bytes and cpu seconds, and whether it fits
+        """
+        allowed = seconds * self.workers
+        candidates = []
+        for codec in codecs or self.codecs:
+            options = {each: self.options(codec, each) for each, size in class_bytes.items() if size > 0}
+            choice = {each: 0 for each in options}
+            cost = sum(class_bytes[each] * options[each][0][2] for each in options)
+            while True:
+                best = None
+                for each, index in choice.items():
+                    if index + 1 >= len(options[each]):
+                        continue
+                    current, upgrade = options[each][index], options[each][index + 1]
+                    extra = class_bytes[each] * (upgrade[2] - current[2])
+                    saved = class_bytes[each] * (current[1] - upgrade[1])
+                    if cost + extra <= allowed and (best is None or saved / max(extra, 1e-9) > best[0]):
+                        best = (saved / max(extra, 1e-9), each, extra)
+                if best is None:
+                    break
+                choice[best[1]] += 1
+                cost += best[2]
+            chosen = {each: options[each][index] for each, index in choice.items()}
+            candidates.append({
+                "codec": codec,
+                "levels": {each: option[0] for each, option in chosen.items()},
+                "predicted_bytes": int(sum(class_bytes[each] * option[1] for each, option in chosen.items())),
+                "cpu_seconds": cost,
+                "fits": cost <= allowed,
+            })
+        fitting = [each for each in candidates if each["fits"]]
+        if fitting:
+            return min(fitting, key=lambda each: each["predicted_bytes"])
+        # nothing makes it in time, the fastest there is comes closest
+        return min(candidates, key=lambda each: each["cpu_seconds"])
+
+    def prepare(self, source: str, scan: dict = None) -> dict:
+        """
+        :param source: world directory about to be archived
+        :param scan: FileIO.scan_tree of source, if the caller already has one
+        :return: the plan, dict of codec, levels per class, workers, budget seconds, bytes per class,
+            and the predicted archive bytes and compression wall seconds
+        """
+        if scan is None:
+            scan = FileIO.scan_tree(source) if os.path.isdir(source) else {}
+        files = {}
+        for path, entry in scan.items():
+            if stat.S_ISREG(entry.mode):
+                files.setdefault(classify(path, entry.size), []).append((path, entry.size))
+        self.calibrate(source, files)
+        class_bytes = {each: sum(size for _, size in members) for each, members in files.items()}
+        seconds = float(self.time_budget) if self.time_budget else float("inf")
+        chosen = self.choose(class_bytes, seconds)
+        self.plan = dict(
+            chosen, workers=self.workers, budget_seconds=seconds, class_bytes=class_bytes,
+            predicted_seconds=chosen["cpu_seconds"] / self.workers,
+            # the level most of the data goes through, for anything that needs a single one
+            level=chosen["levels"][max(class_bytes, key=class_bytes.get)] if class_bytes
+            else compression.CODECS[chosen["codec"]]["default_level"]
+        )
+        self.__remaining = dict(class_bytes)
+        self.decisions = [{"at_bytes": 0, "levels": dict(chosen["levels"])}]
+        self.save()
+        return self.plan
+
+    def attach(self, stream: compression.BlockCompressor):
+        # called by app.core.archive.write_archive with the compressor the plan is carried out on
+        self.__stream = stream
+        self.__started = time.monotonic()
+        self.__since_plan = 0
+
+    def member(self, tarinfo):
+        # called with every member before it is written, directories keep whatever level is current
+        if not tarinfo.isreg():
+            return
+        file_class = classify(tarinfo.name, tarinfo.size)
+        if file_class not in self.plan["levels"]:
+            # appeared since the scan
+            self.plan["levels"][file_class] = self.plan["level"]
+        self.__remaining[file_class] = max(0, self.__remaining.get(file_class, 0) - tarinfo.size)
+        self.__since_plan += tarinfo.size
+        if self.time_budget and self.__since_plan >= REPLAN_BYTES:
+            self.__revise()
+        level = self.plan["levels"][file_class]
+        self.__stream.set_level(level, f"{file_class}:{level}")
+
+    def __measured(self, classes: dict) -> list:
+        # (level, class, ratio, throughput) of every tag measured well enough to learn from
+        measured = []
+        for tag, totals in classes.items():
+            if not tag or totals["bytes_in"] < MIN_LEARN_BYTES or totals["cpu_seconds"] <= 0:
+                continue
+            file_class, level = tag.rsplit(":", 1)
+            measured.append((
+                int(level), file_class, totals["bytes_out"] / totals["bytes_in"],
+                totals["bytes_in"] / totals["cpu_seconds"]
+            ))
+        return measured
+
+    def __revise(self):
+        # what's left has to fit in what's left of the budget, at the throughput this run is actually getting
+        self.__since_plan = 0
+        for level, file_class, ratio, throughput in self.__measured(self.__stream.classes):
+            self.__learn(self.plan["codec"], level, file_class, ratio, throughput)
+        left = max(0.0, self.plan["budget_seconds"] - (time.monotonic() - self.__started))
+        revised = self.choose(self.__remaining, left, [self.plan["codec"]])
+        levels = dict(self.plan["levels"], **revised["levels"])
+        if levels != self.plan["levels"]:
+            self.plan["levels"] = levels
+            self.decisions.append({"at_bytes": self.__stream.bytes_in, "levels": dict(levels)})
+
+    def finish(self, result: dict) -> dict:
+        """
+        Called by app.core.archive.write_archive with its result once the archive is written.
+        :return: the outcome recorded for this run
+        """
+        for level, file_class, ratio, throughput in self.__measured(result["classes"]):
+            self.__learn(self.plan["codec"], level, file_class, ratio, throughput)
+        self.outcome = {
+            "at": time.time(),
+            "codec": self.plan["codec"],
+            "workers": self.workers,
+            "time_budget": self.time_budget,
+            "cpu_budget": self.cpu_budget,
+            "decisions": self.decisions,
+            "predicted_bytes": self.plan["predicted_bytes"],
+            "predicted_seconds": self.plan["predicted_seconds"],
+            "archive_bytes": result["archive_bytes"],
+            "bytes_read": result["bytes_read"],
+            "seconds": result["seconds"],
+            "within_budget": result["seconds"] <= self.plan["budget_seconds"],
+            "classes": result["classes"],
+        }
+        self.history["runs"] = (self.history["runs"] + [self.outcome])[-RUN_HISTORY:]
+        self.save()
+        return self.outcome
+
+    def save(self):
+        with FileIO.atomic_open(self.file_name, fsync=False) as f:
+            json.dump(self.history, f)
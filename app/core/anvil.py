@@ -0,0 +1,281 @@
+import datetime
+import gzip
+import json
+import mmap
+import os
+import struct
+import zlib
+
+from app.core.FileIO import FileIO
+
+# Anvil region (.mca) layout: https://minecraft.wiki/w/Region_file_format
+# 4 KiB of locations (3 byte sector offset, 1 byte sector count) for 32x32 chunk slots,
+# 4 KiB of big endian last-modified timestamps, then the chunk records padded to 4 KiB sectors.
+# a record is a 4 byte length, 1 byte compression type, then length - 1 bytes of compressed nbt.
+SECTOR = 4096
+SLOTS = 1024
+HEADER_SIZE = 2 * SECTOR
+# compression type byte of a chunk record, 4 (lz4, since 1.20.5) is lz4-java's own block format and not read here
+GZIP = 1
+ZLIB = 2
+UNCOMPRESSED = 3
+# set on the type when the chunk was too big for the region and lives in its own c.<x>.<z>.mcc file
+EXTERNAL = 0x80
+
+
+def region_files(source: str) -> list:
+    # relative paths of every region file under source, region/, entities/, poi/ and the other dimensions alike
+    found = []
+    for directory, dir_names, file_names in os.walk(source):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            if file_name.endswith(".mca"):
+                found.append(os.path.relpath(os.path.join(directory, file_name), source).replace(os.sep, "/"))
+    return found
+
+
+class RegionFile:
+    """
+    Read only, memory mapped view of a region file.
+    chunk_record() hands out memoryview slices of the map, so chunk bytes are never copied on read.
+    """
+
+    def __init__(self, file_name: str):
+        self.file_name = str(file_name)
+        self.size = os.path.getsize(self.file_name)
+        self.locations = [(0, 0)] * SLOTS
+        self.timestamps = [0] * SLOTS
+        self.__file = open(self.file_name, "rb")
+        # a freshly created region can be empty, and mmap refuses zero length files
+        self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+        self.__view = memoryview(self.__map) if self.__map is not None else memoryview(b"")
+        if self.size >= HEADER_SIZE:
+            locations = struct.unpack_from(">1024I", self.__view, 0)
+            self.locations = [(each >> 8, each & 0xFF) for each in locations]
+            self.timestamps = list(struct.unpack_from(">1024I", self.__view, SECTOR))
+
+    def chunk_record(self, slot: int):
+        # memoryview of the full on disk record (length, type, data) or None for an empty slot
+        offset, count = self.locations[slot]
+        start = offset * SECTOR
+        if offset < 2 or count == 0 or start + 5 > self.size:
+            return None
+        length = struct.unpack_from(">I", self.__view, start)[0]
+        # never trust the length past the sectors the header gave the chunk, or past the end of the file
+        end = min(start + 4 + length, start + count * SECTOR, self.size)
+        return self.__view[start:end]
+
+    def close(self):
+        self.__view.release()
+        if self.__map is not None:
+            self.__map.close()
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def chunk_data(record) -> bytes:
+    """
+    :param record: full chunk record (length, type, data), see RegionFile.chunk_record
+    :return: the chunk's uncompressed nbt
+    """
+    if len(record) < 5:
+        raise ValueError("chunk record shorter than its header")
+    kind = record[4]
+    data = record[5:]
+    if kind & EXTERNAL:
+        raise ValueError("chunk is stored outside the region file")
+    if kind == GZIP:
+        return gzip.decompress(data)
+    if kind == ZLIB:
+        return zlib.decompress(data)
+    if kind == UNCOMPRESSED:
+        return bytes(data)
+    raise ValueError(f"unsupported chunk compression type {kind}")
+
+
+def region_bytes(records: dict, timestamps: list):
+    """
+    A whole region file, records laid out in slot order from the first sector after the header.
+    :param records: slot -> full chunk record bytes (length, type, data)
+    :param timestamps: the 1024 header timestamps
+    :return: list of byte strings to write one after the other
+    """
+    locations = [0] * SLOTS
+    sector = 2
+    body = []
+    for slot in sorted(records):
+        record = bytes(records[slot])
+        count = -(-len(record) // SECTOR)
+        locations[slot] = (sector << 8) | count
+        body.append(record + b"\x00" * (count * SECTOR - len(record)))
+        sector += count
+    return [struct.pack(">1024I", *locations), struct.pack(">1024I", *timestamps)] + body
+
+
+def write_region(file_name: str, records: dict, timestamps: list):
+    """
+    :param file_name: region file to (re)create
+    :param records: slot -> full chunk record bytes (length, type, data)
+    :param timestamps: the 1024 header timestamps to write back
+    """
+    with FileIO.atomic_open(file_name, "wb") as f:
+        for each in region_bytes(records, timestamps):
+            f.write(each)
+
+
+class RegionDeltaStore:
+    """
+    Chunk level delta snapshots of region files.
+    root/<snapshot>/chunks.pack holds the records of chunks whose header timestamp changed since the previous
+    snapshot, root/<snapshot>/regions.json maps every slot of every region to the pack that holds its record,
+    so any single snapshot restores on its own without replaying the ones before it.
+    """
+
+    INDEX = "regions.json"
+    PACK = "chunks.pack"
+
+    def __init__(self, root: str):
+        self.root = str(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def snapshot_names(self) -> list:
+        return sorted(
+            each for each in os.listdir(self.root) if os.path.exists(os.path.join(self.root, each, self.INDEX))
+        )
+
+    def snapshot_dir(self, name: str) -> str:
+        if name == "latest":
+            names = self.snapshot_names()
+            if not names:
+                raise FileNotFoundError(f"no region snapshots in {self.root}")
+            name = names[-1]
+        return os.path.join(self.root, name)
+
+    def load_index(self, name: str) -> dict:
+        with open(os.path.join(self.snapshot_dir(name), self.INDEX)) as f:
+            return json.load(f)
+
+    def delete_snapshot(self, name: str) -> int:
+        """
+        Removes a snapshot's index and non region files, then every pack no remaining index points into.
+        A pack outlives its own snapshot while later snapshots still map unchanged chunks to it.
+        :return: bytes freed
+        """
+        snapshot_dir = os.path.join(self.root, name)
+        os.remove(os.path.join(snapshot_dir, self.INDEX))
+        freed = 0
+        for each in os.listdir(snapshot_dir):
+            if each != self.PACK:
+                freed += os.path.getsize(os.path.join(snapshot_dir, each))
+                os.remove(os.path.join(snapshot_dir, each))
+        return freed + self.collect_garbage()
+
+    def collect_garbage(self) -> int:
+        referenced = set()
+        for name in self.snapshot_names():
+            for entry in self.load_index(name)["regions"].values():
+                referenced.update(pack_name for pack_name, offset, length in entry["slots"].values())
+        freed = 0
+        for each in os.listdir(self.root):
+            snapshot_dir = os.path.join(self.root, each)
+            if each in referenced or os.path.exists(os.path.join(snapshot_dir, self.INDEX)):
+                continue
+            pack = os.path.join(snapshot_dir, self.PACK)
+            if os.path.exists(pack):
+                freed += os.path.getsize(pack)
+                os.remove(pack)
+            if os.path.isdir(snapshot_dir) and not os.listdir(snapshot_dir):
+                os.rmdir(snapshot_dir)
+        return freed
+
+    def backup(self, source: str, name: str = None) -> dict:
+        """
+        :param source: world directory, region paths are stored relative to it
+        :param name: snapshot name, defaults to the current UTC time
+        :return: the region index, with a stats dict of the chunks read and stored
+        :raises FileExistsError: a snapshot of that name exists, or a backup is writing it right now
+        """
+        names = self.snapshot_names()
+        previous = self.load_index(names[-1])["regions"] if names else {}
+        name = name or datetime.datetime.utcnow().strftime('%Y-%m-%d-%H.%M.%S')
+        snapshot_dir = os.path.join(self.root, name)
+        # never into an existing snapshot, later ones may map chunks into its pack
+        os.mkdir(snapshot_dir)
+        index = {"name": name, "regions": {}}
+        stats = {"regions": 0, "regions_unchanged": 0, "chunks": 0, "chunks_changed": 0, "bytes_written": 0}
+
+        with open(os.path.join(snapshot_dir, self.PACK), "xb") as pack:
+            for relative in region_files(source):
+                full_path = os.path.join(source, *relative.split("/"))
+                stat = os.stat(full_path)
+                old = previous.get(relative)
+                stats["regions"] += 1
+                if old and old["size"] == stat.st_size and old["mtime_ns"] == stat.st_mtime_ns:
+                    # untouched region file, the whole previous mapping still holds
+                    index["regions"][relative] = old
+                    stats["regions_unchanged"] += 1
+                    stats["chunks"] += len(old["slots"])
+                    continue
+                index["regions"][relative] = self.__delta_region(full_path, stat, old, name, pack, stats)
+            # the index must never point at records that aren't on disk yet
+            pack.flush()
+            os.fsync(pack.fileno())
+
+        # the index lands last, a snapshot without one is ignored by snapshot_names
+        with FileIO.atomic_open(os.path.join(snapshot_dir, self.INDEX)) as f:
+            json.dump(index, f)
+        index["stats"] = stats
+        return index
+
+    @staticmethod
+    def __delta_region(full_path: str, stat: os.stat_result, old: dict, name: str, pack, stats: dict) -> dict:
+        old_slots = old["slots"] if old else {}
+        old_timestamps = old["timestamps"] if old else [0] * SLOTS
+        entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "timestamps": [], "slots": {}}
+        with RegionFile(full_path) as region:
+            entry["timestamps"] = region.timestamps
+            for slot in range(SLOTS):
+                record = region.chunk_record(slot)
+                if record is None:
+                    continue
+                stats["chunks"] += 1
+                key = str(slot)
+                if key in old_slots and old_timestamps[slot] == region.timestamps[slot]:
+                    entry["slots"][key] = old_slots[key]
+                else:
+                    # changed or new chunk, the mmap slice goes straight into the pack without a copy
+                    entry["slots"][key] = [name, pack.tell(), len(record)]
+                    pack.write(record)
+                    stats["chunks_changed"] += 1
+                    stats["bytes_written"] += len(record)
+                record.release()
+        return entry
+
+    def restore(self, name: str, target: str) -> int:
+        """
+        :param name: snapshot name, or "latest"
+        :param target: world directory to write the rebuilt region files into
+        :return: count of region files rebuilt
+        """
+        index = self.load_index(name)
+        packs = {}
+        try:
+            for relative, entry in index["regions"].items():
+                records = {}
+                for slot, (pack_name, offset, length) in entry["slots"].items():
+                    if pack_name not in packs:
+                        packs[pack_name] = open(os.path.join(self.root, pack_name, self.PACK), "rb")
+                    packs[pack_name].seek(offset)
+                    records[int(slot)] = packs[pack_name].read(length)
+                full_path = os.path.join(target, *relative.split("/"))
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                write_region(full_path, records, entry["timestamps"])
+        finally:
+            for each in packs.values():
+                each.close()
+        return len(index["regions"])
@@ -0,0 +1,341 @@
+import hashlib
+import io
+import json
+import os
+import tarfile
+import time
+
+from app.core import compression, estimate
+from app.core.FileIO import FileIO
+
+
+def normalize_arcname(name: str) -> str:
+    # same normalization tarfile.gettarinfo applies, so index and archive names compare directly
+    drive, name = os.path.splitdrive(str(name))
+    return name.replace(os.sep, "/").lstrip("/")
+
+
+def source_index(source: str, arcname: str = None, recursive: bool = True, scan: dict = None) -> set:
+    # set of every archive name the source tree should produce, from one FileIO.scan_tree pass
+    root = str(source) if arcname is None else str(arcname)
+    index = {normalize_arcname(root)}
+    if not recursive or not os.path.isdir(source):
+        return index
+    if scan is None:
+        scan = FileIO.scan_tree(source)
+    index.update(normalize_arcname(os.path.join(root, *relative.split("/"))) for relative in scan)
+    return index
+
+
+class HashingReader:
+    """
+    Read-only file wrapper that hashes and counts the bytes as tarfile pulls them in,
+    so the checksum costs no second read of the file or of the archive.
+    """
+
+    def __init__(self, fileobj, limiter=None):
+        self.__fileobj = fileobj
+        self.__limiter = limiter
+        self.hash = hashlib.sha256()
+        self.bytes_read = 0
+        self.seconds = 0.0
+
+    def read(self, size: int = -1) -> bytes:
+        started = time.perf_counter()
+        data = self.__fileobj.read(size)
+        self.seconds += time.perf_counter() - started
+        if self.__limiter is not None:
+            # shared disk bandwidth budget, see app.core.throttle
+            self.__limiter.consume(len(data))
+        self.hash.update(data)
+        self.bytes_read += len(data)
+        return data
+
+
+class HashingWriter:
+    """
+    Write-only wrapper around the archive file itself, the archive's own checksum and size fall out of writing it.
+    A mirror (an offsite upload) gets every byte as it is written, instead of reading the finished archive back.
+    """
+
+    def __init__(self, fileobj, limiter=None, mirror=None):
+        self.__fileobj = fileobj
+        self.__limiter = limiter
+        self.__mirror = mirror
+        self.hash = hashlib.sha256()
+        self.bytes_written = 0
+        self.seconds = 0.0
+
+    def write(self, data) -> int:
+        if self.__limiter is not None:
+            self.__limiter.consume(len(data))
+        started = time.perf_counter()
+        self.__fileobj.write(data)
+        self.seconds += time.perf_counter() - started
+        if self.__mirror is not None:
+            self.__mirror.write(data)
+        self.hash.update(data)
+        self.bytes_written += len(data)
+        return len(data)
+
+    def flush(self):
+        self.__fileobj.flush()
+
+
+def write_manifest(file_name: str, checksums: dict):
+    # sha256sum compatible, one "<hash>  <name>" line per archived file
+    FileIO.write_records(file_name, (f"{digest}  {name}" for name, digest in checksums.items()))
+
+
+def manifest_name(archive_name: str) -> str:
+    return f"{archive_name}.sha256"
+
+
+def member_index_name(archive_name: str) -> str:
+    return f"{archive_name}.idx"
+
+
+def write_member_index(file_name: str, result: dict, blocks: list):
+    """
+    Sidecar that makes an archive randomly accessible, see app.core.restore.
+    blocks: (uncompressed, compressed) start offset of each independently compressed block, empty for one stream
+    entries: each member's tar offsets and metadata, keyed by archive name
+    """
+    index = {
+        "archive": os.path.basename(result["name"]),
+        "codec": result["codec"],
+        "root": result["root"],
+        "blocks": blocks,
+        "entries": result["entries"],
+    }
+    with FileIO.atomic_open(file_name) as f:
+        json.dump(index, f)
+
+
+def _add_member(
+        archive: tarfile.TarFile, path: str, arcname: str, filter, result: dict, limiter, controller=None, pruner=None
+) -> tarfile.TarInfo:
+    # tarfile.add for one path, except regular files stream through a HashingReader, None if it was left out
+    tarinfo = archive.gettarinfo(path, arcname)
+    if tarinfo is None:
+        # sockets and the like, tarfile skips them too
+        result["excluded"].add(normalize_arcname(arcname))
+        return None
+    if filter is not None:
+        tarinfo = filter(tarinfo)
+        if tarinfo is None:
+            result["excluded"].add(normalize_arcname(arcname))
+            return None
+
+    size = tarinfo.size
+    pruned = None
+    if pruner is not None and tarinfo.isreg():
+        # a region file without its unvisited chunks, see app.core.prune.ChunkPruner
+        pruned = pruner.prune(path)
+        if pruned is not None:
+            tarinfo.size = len(pruned)
+    if controller is not None:
+        # picks the level this member is compressed at before any of it reaches the compressor
+        controller.member(tarinfo)
+    header_offset = archive.offset
+    if tarinfo.isreg():
+        with open(path, "rb") as f:
+            reader = HashingReader(f if pruned is None else io.BytesIO(pruned), limiter)
+            archive.addfile(tarinfo, reader)
+            after = os.fstat(f.fileno())
+        if after.st_size != size or after.st_mtime != tarinfo.mtime:
+            # written to while it was being read (logs, or saving wasn't paused), the archived copy may be torn
+            result["changed"].append(tarinfo.name)
+        result["checksums"][tarinfo.name] = reader.hash.hexdigest()
+        result["bytes_read"] += reader.bytes_read
+        result["timings"]["read"] += reader.seconds
+    else:
+        archive.addfile(tarinfo)
+    index_member(archive, tarinfo, header_offset, result)
+    return tarinfo
+
+
+def index_member(archive: tarfile.TarFile, tarinfo: tarfile.TarInfo, header_offset: int, result: dict):
+    # member index entry of the member just added, see write_member_index
+    # the data sits right before the new end of the tar stream, padded out to whole 512 byte records
+    padded = -(-tarinfo.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE if tarinfo.isreg() else 0
+    result["entries"][tarinfo.name] = {
+        "type": tarinfo.type.decode(),
+        "offset": header_offset,
+        "offset_data": archive.offset - padded,
+        "size": tarinfo.size if tarinfo.isreg() else 0,
+        "mode": tarinfo.mode,
+        "mtime": tarinfo.mtime,
+        "linkname": tarinfo.linkname,
+        "sha256": result["checksums"].get(tarinfo.name),
+    }
+
+
+def _add_tree(
+        archive: tarfile.TarFile, source: str, arcname: str, scan: dict, filter, result: dict, limiter, controller=None,
+        pruner=None
+):
+    # the scan is already in depth first order, so members come out in the order a recursive tarfile.add gives
+    tarinfo = _add_member(archive, source, arcname, filter, result, limiter, controller, pruner)
+    if tarinfo is None or not tarinfo.isdir():
+        return
+    skipped = set()
+    for relative, entry in scan.items():
+        parts = relative.split("/")
+        if any("/".join(parts[:depth]) in skipped for depth in range(1, len(parts))):
+            # below a directory the filter left out
+            continue
+        added = _add_member(
+            archive, os.path.join(source, *parts), os.path.join(arcname, *parts), filter, result, limiter, controller,
+            pruner
+        )
+        if added is None and entry.is_dir:
+            skipped.add(relative)
+
+
+def write_archive(
+        name: str,
+        mode: str,
+        source: str,
+        recursive: bool = True,
+        codec: str = None,
+        level: int = None,
+        workers: int = None,
+        arcname: str = None,
+        filter=None,
+        manifest: bool = True,
+        limiter=None,
+        member_index: bool = True,
+        block_size: int = compression.DEFAULT_BLOCK_SIZE,
+        write_limiter=None,
+        mirror=None,
+        reserve: int = 0,
+        controller=None,
+        pruner=None,
+        scan: dict = None
+) -> dict:
+    """
+    :param name: archive file to create
+    :param mode: tarfile mode for the single core path ('w:gz', 'x:gz'), only w/x matters with a codec
+    :param source: file or directory to archive
+    :param recursive: descend into source if it is a directory
+    :param codec: block compression codec (see app.core.compression), None for tarfile's own compression
+    :param level: compression level for codec
+    :param workers: compression processes for codec
+    :param arcname: name of source inside the archive, defaults to the source path like tarfile.add
+    :param filter: tarfile.add style filter, return None to leave a member out
+    :param manifest: write <name>.sha256 next to the archive
+    :param limiter: optional TokenBucket the source reads are charged against
+    :param member_index: write <name>.idx next to the archive for random access restores
+    :param block_size: uncompressed bytes per block for codec, the granularity of random access
+    :param write_limiter: optional TokenBucket the archive writes are charged against
+    :param mirror: optional write-only file object that gets a copy of the archive bytes, the caller closes it
+    :param reserve: bytes to preallocate for the archive (see app.core.estimate.reserve), 0 for none
+    :param controller: picks the level per member for codec, see app.core.adaptive.CodecController
+    :param pruner: leaves unvisited chunks out of region files, see app.core.prune.ChunkPruner
+    :param scan: an earlier FileIO.scan_tree of source the caller already has, only the directories that changed
+        since are listed again (FileIO.refresh_scan)
+    :return: dict of members, checksums, source scan and index, paths excluded or changed while archiving,
+        and the codec, size, sha256, seconds taken, per phase timings and per class compression of the archive file,
+        plus the pruner's summary under pruned when there is one
+    """
+    if controller is not None and codec is None:
+        raise ValueError("a codec controller needs a block codec, tarfile compresses the stream itself")
+    started = time.monotonic()
+    arcname = str(source) if arcname is None else str(arcname)
+    file_mode, _, tar_compression = str(mode).partition(":")
+    # one parallel scan feeds the archiver, the validation index and the caller's stat index
+    if not recursive or not os.path.isdir(source):
+        scan = {}
+    elif scan is None:
+        scan = FileIO.scan_tree(source)
+    else:
+        scan = FileIO.refresh_scan(source, scan)
+    if pruner is not None:
+        # after the scan, so the chunks are read from the same (paused) world that gets archived
+        pruner.prepare(source, scan)
+    scanned = time.monotonic()
+    result = {
+        "name": name,
+        "members": [],
+        "checksums": {},
+        "scan": scan,
+        "index": source_index(source, arcname, recursive, scan),
+        "excluded": set(),
+        "changed": [],
+        "bytes_read": 0,
+        "manifest": manifest_name(name) if manifest else None,
+        "codec": codec or {"gz": "gzip", "": "none"}.get(tar_compression, tar_compression),
+        "root": normalize_arcname(arcname),
+        "entries": {},
+        "member_index": member_index_name(name) if member_index else None,
+        # seconds, read and write are the file io itself, what's left of archive is tar and compression
+        "timings": {
+            "scan": scanned - started - (pruner.seconds if pruner is not None else 0.0),
+            "prune": pruner.seconds if pruner is not None else 0.0, "read": 0.0, "write": 0.0, "archive": 0.0
+        },
+        "classes": {},
+    }
+    blocks = []
+
+    # x refuses to overwrite an existing archive, w overwrites
+    with open(name, "xb" if file_mode.startswith("x") else "wb") as raw:
+        result["reserved"] = estimate.reserve(raw, reserve)
+        writer = HashingWriter(raw, write_limiter, mirror)
+        try:
+            if codec is None:
+                # single core path, tarfile compresses the stream itself
+                with tarfile.open(name=name, mode=f"w:{tar_compression}", fileobj=writer) as archive:
+                    _add_tree(archive, source, arcname, scan, filter, result, limiter, pruner=pruner)
+                    result["members"] = archive.getmembers()
+            else:
+                # multi core path, tar writes an uncompressed stream and the block compressor spreads it over a pool
+                with compression.BlockCompressor(
+                        writer, codec=codec, level=level, workers=workers, block_size=block_size
+                ) as stream:
+                    if controller is not None:
+                        controller.attach(stream)
+                    with tarfile.open(fileobj=stream, mode="w|") as archive:
+                        _add_tree(archive, source, arcname, scan, filter, result, limiter, controller, pruner)
+                        result["members"] = archive.getmembers()
+                blocks = stream.blocks
+                result["classes"] = stream.classes
+        finally:
+            if result["reserved"]:
+                # whatever of the reservation wasn't written goes back
+                raw.truncate(writer.bytes_written)
+    result["archive_bytes"] = writer.bytes_written
+    result["archive_sha256"] = writer.hash.hexdigest()
+    result["seconds"] = time.monotonic() - started
+    result["timings"]["write"] = writer.seconds
+    result["timings"]["archive"] = time.monotonic() - scanned
+    if controller is not None:
+        result["adaptive"] = controller.finish(result)
+    if pruner is not None:
+        result["pruned"] = pruner.summary()
+
+    if manifest:
+        write_manifest(result["manifest"], result["checksums"])
+    if member_index:
+        write_member_index(result["member_index"], result, blocks)
+    return result
+
+
+def verify(result: dict) -> list:
+    """
+    :param result: dict returned by write_archive
+    :return: problems found, empty when every path of the source tree made it into the archive with a checksum
+    """
+    archived = {normalize_arcname(each.name) for each in result["members"]}
+    excluded = result["excluded"]
+    problems = []
+    for each in result["index"] - archived:
+        # anything under an excluded (filtered) directory was left out on purpose
+        parts = each.split("/")
+        if any("/".join(parts[:depth]) in excluded for depth in range(1, len(parts) + 1)):
+            continue
+        problems.append(f"missing from archive: {each}")
+    for member in result["members"]:
+        if member.isreg() and member.name not in result["checksums"]:
+            problems.append(f"no checksum: {member.name}")
+    return problems
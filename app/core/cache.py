@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class TTLCache:
+    """
+    Thread safe LRU cache whose entries expire ttl seconds after they were stored, a caller can ask for something
+    fresher with max_age.
+    get_or_load coalesces concurrent misses on one key into a single call of the loader, every other caller
+    waits for that result (or exception) instead of making its own request.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 256):
+        self.ttl = float(ttl)
+        self.max_entries = int(max_entries)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.__entries = OrderedDict()
+        self.__loading = {}
+        self.__lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def __lookup(self, key, max_age: float = None):
+        # caller holds the lock, returns (found, value), an entry older than max_age is a miss but stays
+        entry = self.__entries.get(key)
+        if entry is None:
+            return False, None
+        expires, stored, value = entry
+        now = time.monotonic()
+        if expires <= now:
+            del self.__entries[key]
+            return False, None
+        if max_age is not None and now - stored > max_age:
+            return False, None
+        self.__entries.move_to_end(key)
+        return True, value
+
+    def __store(self, key, value, ttl: float = None):
+        # caller holds the lock
+        now = time.monotonic()
+        self.__entries[key] = (now + (self.ttl if ttl is None else ttl), now, value)
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.max_entries:
+            self.__entries.popitem(last=False)
+
+    def get(self, key, default=None):
+        with self.__lock:
+            found, value = self.__lookup(key)
+        return value if found else default
+
+    def put(self, key, value, ttl: float = None):
+        with self.__lock:
+            self.__store(key, value, ttl)
+
+    def invalidate(self, key=None):
+        # one key, or everything if key is None
+        with self.__lock:
+            if key is None:
+                self.__entries.clear()
+            else:
+                self.__entries.pop(key, None)
+
+    def get_or_load(self, key, loader, ttl: float = None, max_age: float = None):
+        """
+        :param key: cache key
+        :param loader: called without arguments on a miss, its result is cached, exceptions are not
+        :param ttl: seconds to keep this value, the cache default if None
+        :param max_age: seconds since it was stored a cached value may be, loaded again if older, any if None
+        :return: the cached or freshly loaded value
+        """
+        with self.__lock:
+            found, value = self.__lookup(key, max_age)
+            if found:
+                self.hits += 1
+                return value
+            future = self.__loading.get(key)
+            if future is None:
+                future = self.__loading[key] = Future()
+                self.misses += 1
+                owner = True
+            else:
+                self.coalesced += 1
+                owner = False
+        if not owner:
+            return future.result()
+
+        try:
+            value = loader()
+        except BaseException as e:
+            with self.__lock:
+                del self.__loading[key]
+            future.set_exception(e)
+            raise
+        with self.__lock:
+            self.__store(key, value, ttl)
+            del self.__loading[key]
+        future.set_result(value)
+        return value
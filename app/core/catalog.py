@@ -0,0 +1,144 @@
+import os
+import sqlite3
+import time
+
+from app.core import compression
+
+CATALOG_FILE = "catalog.sqlite3"
+COLUMNS = [
+    "name", "path", "created", "size", "members", "source", "container",
+    "codec", "checksum", "duration", "bytes_read", "ratio"
+]
+
+
+class Catalog:
+    """
+    SQLite record of every archive written, filled in at creation time from what the archiver already measured.
+    List, lookup and size questions are answered from here without listing or stat'ing the backup directory.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS archives (
+            name TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            created REAL NOT NULL,
+            size INTEGER NOT NULL,
+            members INTEGER,
+            source TEXT,
+            container TEXT,
+            codec TEXT,
+            checksum TEXT,
+            duration REAL,
+            bytes_read INTEGER,
+            ratio REAL
+        );
+        CREATE INDEX IF NOT EXISTS archives_source_created ON archives (source, created);
+        CREATE INDEX IF NOT EXISTS archives_container_created ON archives (container, created);
+    """
+
+    def __init__(self, file_name: str):
+        self.file_name = str(file_name)
+        # one catalog per save_dir may be shared by orchestrator threads
+        self.__connection = sqlite3.connect(self.file_name, timeout=30, check_same_thread=False)
+        self.__connection.row_factory = sqlite3.Row
+        self.__connection.executescript(self.SCHEMA)
+
+    def close(self):
+        self.__connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def record(self, **fields):
+        """
+        :param fields: any of COLUMNS, name, path, created and size are required
+        """
+        unknown = set(fields) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"unknown catalog columns: {', '.join(sorted(unknown))}")
+        names = ", ".join(fields)
+        marks = ", ".join("?" for _ in fields)
+        with self.__connection:
+            self.__connection.execute(
+                f"INSERT OR REPLACE INTO archives ({names}) VALUES ({marks})", list(fields.values())
+            )
+
+    def record_archive(self, result: dict, source: str = None, container: str = None, created: float = None):
+        # from the dict app.core.archive.write_archive returns, created defaults to now
+        self.record(
+            name=os.path.basename(result["name"]),
+            path=os.path.abspath(result["name"]),
+            created=time.time() if created is None else created,
+            size=result["archive_bytes"],
+            members=len(result["members"]),
+            source=os.path.abspath(source) if source else None,
+            container=container,
+            codec=result["codec"],
+            checksum=result["archive_sha256"],
+            duration=result["seconds"],
+            bytes_read=result["bytes_read"],
+            ratio=result["archive_bytes"] / result["bytes_read"] if result["bytes_read"] else None
+        )
+
+    def get(self, name: str) -> dict:
+        row = self.__connection.execute("SELECT * FROM archives WHERE name = ?", [name]).fetchone()
+        return dict(row) if row else None
+
+    def remove(self, names: list):
+        with self.__connection:
+            self.__connection.executemany("DELETE FROM archives WHERE name = ?", [(each,) for each in names])
+
+    def list(self, world: str = None, limit: int = None) -> list:
+        # newest first, world matches either the container name or the source path
+        query = "SELECT * FROM archives"
+        params = []
+        if world:
+            query += " WHERE container = ? OR source = ?"
+            params += [world, os.path.abspath(world)]
+        query += " ORDER BY created DESC"
+        if limit:
+            query += " LIMIT ?"
+            params.append(int(limit))
+        return [dict(each) for each in self.__connection.execute(query, params)]
+
+    def lookup(self, world: str, at: float) -> dict:
+        # the newest archive of world created at or before at (epoch seconds), None if there isn't one
+        row = self.__connection.execute(
+            "SELECT * FROM archives WHERE (container = ? OR source = ?) AND created <= ? ORDER BY created DESC LIMIT 1",
+            [world, os.path.abspath(world), at]
+        ).fetchone()
+        return dict(row) if row else None
+
+    def total_size(self) -> int:
+        return self.__connection.execute("SELECT COALESCE(SUM(size), 0) FROM archives").fetchone()[0]
+
+    def max_size(self) -> int:
+        return self.__connection.execute("SELECT COALESCE(MAX(size), 0) FROM archives").fetchone()[0]
+
+    def count(self) -> int:
+        return self.__connection.execute("SELECT COUNT(*) FROM archives").fetchone()[0]
+
+    def import_directory(self, save_dir: str) -> int:
+        # one time backfill for archives written before the catalog existed, only what the filesystem knows
+        known = {each["name"] for each in self.list()}
+        added = 0
+        for entry in os.scandir(save_dir):
+            if entry.name in known or not entry.is_file():
+                continue
+            try:
+                codec = compression.codec_from_name(entry.name)
+            except ValueError:
+                continue
+            stat = entry.stat()
+            self.record(
+                name=entry.name, path=os.path.abspath(entry.path), created=stat.st_mtime, size=stat.st_size, codec=codec
+            )
+            added += 1
+        return added
+
+
+def catalog_file(save_dir: str) -> str:
+    return os.path.join(str(save_dir), CATALOG_FILE)
@@ -0,0 +1,291 @@
+import datetime
+import hashlib
+import json
+import os
+import zlib
+from fnmatch import fnmatch
+
+from app.core import anvil
+from app.core.FileIO import FileIO
+
+# content defined chunking (gear hash, FastCDC style): boundaries follow the content rather than fixed offsets,
+# so an edit only changes the chunks around it and everything else dedups against the previous snapshot
+MIN_CHUNK = 16 * 1024
+AVG_CHUNK = 64 * 1024
+MAX_CHUNK = 256 * 1024
+READ_SIZE = 4 * 1024 * 1024
+# region files are the bulk of a world and hashing them byte by byte in python runs at a few MB/s. they are laid out
+# in 4 KiB sectors and a chunk the game rewrites moves to other sectors instead of shifting the rest of the file,
+# so fixed, sector aligned pieces dedup them as well at the speed of a plain read. the header (offsets and
+# timestamps) changes on every save, it is a piece of its own
+REGION_SUFFIXES = (".mca", ".mcr")
+REGION_CHUNK = 16 * anvil.SECTOR
+
+# derived from sha256 rather than random so boundaries (and so chunk ids) are stable between runs and versions
+GEAR = [int.from_bytes(hashlib.sha256(bytes([each])).digest()[:8], "big") for each in range(256)]
+MASK_64 = (1 << 64) - 1
+
+
+def boundary_mask(avg_size: int = AVG_CHUNK) -> int:
+    # test the high bits of the hash, the low bits only depend on the last few bytes shifted in
+    bits = max(1, avg_size.bit_length() - 1)
+    return ((1 << bits) - 1) << (64 - bits)
+
+
+def find_boundary(data, start: int, end: int, min_size: int, max_size: int, mask: int) -> int:
+    # returns the end offset of the chunk starting at start, never past end
+    limit = min(end, start + max_size)
+    position = start + min_size
+    if position >= limit:
+        return limit
+    gear = GEAR
+    value = 0
+    # bytes below min_size can never end a chunk, so they are skipped rather than hashed
+    for position in range(position, limit):
+        value = ((value << 1) + gear[data[position]]) & MASK_64
+        if not value & mask:
+            return position + 1
+    return limit
+
+
+def iter_chunks(fileobj, min_size: int = MIN_CHUNK, avg_size: int = AVG_CHUNK, max_size: int = MAX_CHUNK):
+    # streams a binary file object and yields its chunks, memory stays around READ_SIZE + max_size
+    mask = boundary_mask(avg_size)
+    buffer = b""
+    eof = False
+    while not eof or buffer:
+        if not eof and len(buffer) < max_size:
+            data = fileobj.read(READ_SIZE)
+            eof = not data
+            buffer += data
+            continue
+        start = 0
+        # only cut where a full max_size window is available, unless the file is done
+        while len(buffer) - start >= max_size or (eof and start < len(buffer)):
+            end = find_boundary(buffer, start, len(buffer), min_size, max_size, mask)
+            yield buffer[start:end]
+            start = end
+        buffer = buffer[start:]
+
+
+def iter_region_chunks(fileobj, chunk_size: int = REGION_CHUNK):
+    # the header, then fixed chunk_size pieces, all of them sector aligned
+    piece = fileobj.read(anvil.HEADER_SIZE)
+    while piece:
+        yield piece
+        piece = fileobj.read(chunk_size)
+
+
+def is_region(path: str) -> bool:
+    return path.endswith(REGION_SUFFIXES)
+
+
+def snapshot_name() -> str:
+    # sorts chronologically as a plain string, matches the archive date format otherwise
+    return datetime.datetime.utcnow().strftime('%Y-%m-%d-%H.%M.%S')
+
+
+class ChunkStore:
+    """
+    Deduplicated, content addressed store of world snapshots.
+    root/chunks/ab/<sha256> holds each unique chunk once (zlib compressed),
+    root/snapshots/<name>.json is the manifest of one backup (path, size, mtime, hash, chunk list).
+    """
+
+    def __init__(self, root: str, level: int = 6):
+        self.root = str(root)
+        self.level = int(level)
+        self.chunk_dir = os.path.join(self.root, "chunks")
+        self.snapshot_dir = os.path.join(self.root, "snapshots")
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+
+    def chunk_path(self, digest: str) -> str:
+        return os.path.join(self.chunk_dir, digest[:2], digest)
+
+    def has_chunk(self, digest: str) -> bool:
+        return os.path.exists(self.chunk_path(digest))
+
+    def put_chunk(self, data: bytes) -> (str, int):
+        # returns the chunk id and the bytes actually written, 0 if it was already stored
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressed = zlib.compress(data, self.level)
+        # a chunk file is either complete or absent, never half written. not fsync'd one by one,
+        # restore checks every file's sha256, and the snapshot manifest written after them is
+        with FileIO.atomic_open(path, "wb", fsync=False) as f:
+            f.write(compressed)
+        return digest, len(compressed)
+
+    def get_chunk(self, digest: str) -> bytes:
+        with open(self.chunk_path(digest), "rb") as f:
+            return zlib.decompress(f.read())
+
+    def snapshot_names(self) -> list:
+        return sorted(each[:-5] for each in os.listdir(self.snapshot_dir) if each.endswith(".json"))
+
+    def load_snapshot(self, name: str) -> dict:
+        if name == "latest":
+            names = self.snapshot_names()
+            if not names:
+                raise FileNotFoundError(f"no snapshots in {self.snapshot_dir}")
+            name = names[-1]
+        with open(os.path.join(self.snapshot_dir, f"{name}.json")) as f:
+            return json.load(f)
+
+    def save_snapshot(self, snapshot: dict):
+        with FileIO.atomic_open(os.path.join(self.snapshot_dir, f"{snapshot['name']}.json")) as f:
+            json.dump(snapshot, f)
+
+    def delete_snapshot(self, name: str):
+        # only the manifest, the chunks may be shared with other snapshots, collect_garbage frees the rest
+        os.remove(os.path.join(self.snapshot_dir, f"{name}.json"))
+
+    def collect_garbage(self) -> int:
+        """
+        Mark and sweep: every chunk no remaining snapshot references is deleted.
+        :return: bytes freed
+        """
+        referenced = set()
+        for name in self.snapshot_names():
+            for entry in self.load_snapshot(name)["files"].values():
+                referenced.update(entry["chunks"])
+        freed = 0
+        for prefix in os.listdir(self.chunk_dir):
+            prefix_dir = os.path.join(self.chunk_dir, prefix)
+            for each in os.listdir(prefix_dir):
+                if each not in referenced:
+                    path = os.path.join(prefix_dir, each)
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+        return freed
+
+    def backup(self, source: str, name: str = None, changed=None, root: str = None) -> dict:
+        """
+        :param source: directory to snapshot, paths are stored relative to it
+        :param name: snapshot name, defaults to the current UTC time
+        :param changed: relative paths (files or directories) changed since the last snapshot, e.g. from an
+            inotify ChangeTracker, everything else is carried over without a stat. None walks all of source
+        :param root: world directory recorded as the snapshot's source when source is a copy of it, defaults to source
+        :return: the snapshot manifest, with a stats dict of what was read and written
+        """
+        names = self.snapshot_names()
+        previous_snapshot = self.load_snapshot(names[-1]) if names else {"dirs": [], "files": {}}
+        previous = previous_snapshot["files"]
+        snapshot = {"name": name or snapshot_name(), "source": os.path.abspath(root or source), "dirs": [], "files": {}}
+        stats = {"files": 0, "unchanged": 0, "bytes_read": 0, "chunks_new": 0, "bytes_written": 0}
+
+        if changed is None or not names:
+            walked = self.__walk(source, "", previous, snapshot, stats)
+        else:
+            # carry the last snapshot over, minus whatever sits at or under a changed path, then look at those again
+            stale = set(changed)
+
+            def is_stale(relative: str) -> bool:
+                # the path itself or any of its parent directories
+                parts = relative.split("/")
+                return any("/".join(parts[:depth]) in stale for depth in range(1, len(parts) + 1))
+            snapshot["dirs"] = [each for each in previous_snapshot["dirs"] if not is_stale(each)]
+            for relative, entry in previous.items():
+                if not is_stale(relative):
+                    snapshot["files"][relative] = entry
+            stats["files"] = stats["unchanged"] = len(snapshot["files"])
+            walked = 0
+            for relative in sorted(stale):
+                if is_stale(relative.rpartition("/")[0]):
+                    # its parent directory is walked anyway
+                    continue
+                walked += self.__walk(source, relative, previous, snapshot, stats)
+            snapshot["dirs"].sort()
+            snapshot["files"] = dict(sorted(snapshot["files"].items()))
+        stats["walked"] = walked
+
+        self.save_snapshot(snapshot)
+        snapshot["stats"] = stats
+        return snapshot
+
+    def __walk(self, source: str, relative: str, previous: dict, snapshot: dict, stats: dict) -> int:
+        # adds the file or directory tree at relative (all of source for "") to snapshot, returns the files looked at
+        top = os.path.join(source, *relative.split("/")) if relative else source
+        if os.path.isfile(top) and not os.path.islink(top):
+            self.__add_file(top, relative, previous, snapshot, stats)
+            return 1
+        if not os.path.isdir(top) or os.path.islink(top):
+            # removed since, or something os.walk wouldn't have followed either
+            return 0
+        looked_at = 0
+        for directory, dir_names, file_names in os.walk(top):
+            dir_names.sort()
+            relative_dir = os.path.relpath(directory, source)
+            if relative_dir != ".":
+                snapshot["dirs"].append(relative_dir.replace(os.sep, "/"))
+            for file_name in sorted(file_names):
+                full_path = os.path.join(directory, file_name)
+                self.__add_file(
+                    full_path, os.path.relpath(full_path, source).replace(os.sep, "/"), previous, snapshot, stats
+                )
+                looked_at += 1
+        return looked_at
+
+    def __add_file(self, full_path: str, relative: str, previous: dict, snapshot: dict, stats: dict):
+        stat = os.stat(full_path)
+        stats["files"] += 1
+        entry = previous.get(relative)
+        # same size and mtime as last time, reuse the old entry without reading a byte
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            snapshot["files"][relative] = entry
+            stats["unchanged"] += 1
+            return
+        snapshot["files"][relative] = self.__store_file(full_path, stat, stats)
+
+    def __store_file(self, full_path: str, stat: os.stat_result, stats: dict) -> dict:
+        file_hash = hashlib.sha256()
+        chunks = []
+        with open(full_path, "rb") as f:
+            for chunk in iter_region_chunks(f) if is_region(full_path) else iter_chunks(f):
+                file_hash.update(chunk)
+                digest, written = self.put_chunk(chunk)
+                chunks.append(digest)
+                stats["bytes_read"] += len(chunk)
+                if written:
+                    stats["chunks_new"] += 1
+                    stats["bytes_written"] += written
+        return {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "mode": stat.st_mode & 0o7777,
+            "sha256": file_hash.hexdigest(),
+            "chunks": chunks
+        }
+
+    def restore(self, name: str, target: str, patterns: list = None) -> int:
+        """
+        :param name: snapshot name, or "latest"
+        :param target: directory to rebuild the snapshot into
+        :param patterns: optional fnmatch globs on the relative path, everything if unset
+        :return: count of files restored
+        """
+        snapshot = self.load_snapshot(name)
+        for directory in snapshot["dirs"]:
+            os.makedirs(os.path.join(target, directory), exist_ok=True)
+        restored = 0
+        for relative, entry in snapshot["files"].items():
+            if patterns and not any(fnmatch(relative, pattern) for pattern in patterns):
+                continue
+            full_path = os.path.join(target, *relative.split("/"))
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            file_hash = hashlib.sha256()
+            with open(full_path, "wb") as f:
+                for digest in entry["chunks"]:
+                    chunk = self.get_chunk(digest)
+                    file_hash.update(chunk)
+                    f.write(chunk)
+            if file_hash.hexdigest() != entry["sha256"]:
+                raise ValueError(f"checksum mismatch restoring {relative} from snapshot {snapshot['name']}")
+            os.chmod(full_path, entry["mode"])
+            os.utime(full_path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+            restored += 1
+        return restored
@@ -0,0 +1,245 @@
+import gzip
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# special libraries, both optional (pip install zstandard lz4)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# blocks are compressed independently (one gzip member / zstd frame / lz4 frame each),
+# so bigger blocks lose less ratio to the missing shared dictionary, smaller ones spread better across cores
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+
+# store_level: the cheapest level, for data that won't compress (deflate stored blocks, zstd's fastest negative level)
+CODECS = {
+    "gzip": {"suffix": ".tar.gz", "default_level": 6, "levels": [1, 3, 6, 9], "store_level": 0},
+    "zstd": {"suffix": ".tar.zst", "default_level": 3, "levels": [1, 3, 9, 19], "store_level": -5},
+    "lz4": {"suffix": ".tar.lz4", "default_level": 0, "levels": [0, 3, 9], "store_level": 0},
+    "none": {"suffix": ".tar", "default_level": 0, "levels": [0], "store_level": 0},
+}
+
+
+def available_codecs() -> list:
+    # gzip and none only need the standard library, the rest depend on what is installed
+    available = ["gzip", "none"]
+    if zstandard is not None:
+        available.append("zstd")
+    if lz4_frame is not None:
+        available.append("lz4")
+    return available
+
+
+def check_codec(codec: str) -> str:
+    if codec not in CODECS:
+        raise ValueError(f"unknown codec: {codec}, expected one of {', '.join(CODECS)}")
+    if codec not in available_codecs():
+        package = "zstandard" if codec == "zstd" else codec
+        raise ValueError(f"codec {codec} is not installed, try: pip install {package}")
+    return codec
+
+
+def archive_suffix(codec: str = "gzip") -> str:
+    return CODECS[codec]["suffix"]
+
+
+def codec_from_name(file_name: str) -> str:
+    # infer the codec from an archive name, longest suffix first so .tar doesn't shadow .tar.gz
+    for codec, info in sorted(CODECS.items(), key=lambda item: -len(item[1]["suffix"])):
+        if str(file_name).endswith(info["suffix"]):
+            return codec
+    raise ValueError(f"cannot infer codec from file name: {file_name}")
+
+
+def compress_block(codec: str, level: int, data: bytes) -> bytes:
+    # module level (not a method) so it can be pickled over to the worker processes
+    if codec == "gzip":
+        # mtime=0 keeps output reproducible, each block becomes a complete gzip member
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    elif codec == "zstd":
+        return zstandard.ZstdCompressor(level=level, write_content_size=True).compress(data)
+    elif codec == "lz4":
+        return lz4_frame.compress(data, compression_level=level, content_checksum=True)
+    else:
+        return bytes(data)
+
+
+def measure_block(codec: str, level: int, data: bytes) -> (bytes, float):
+    # compress_block plus the cpu seconds it took, thread time so other threads of the process don't count
+    started = time.thread_time()
+    compressed = compress_block(codec, level, data)
+    return compressed, time.thread_time() - started
+
+
+def decompress_block(codec: str, data: bytes) -> bytes:
+    # inverse of compress_block, one block on its own, which is what makes the output seekable
+    if codec == "gzip":
+        return gzip.decompress(data)
+    elif codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    elif codec == "lz4":
+        return lz4_frame.decompress(data)
+    else:
+        return bytes(data)
+
+
+class BlockCompressor:
+    """
+    Write-only file object that splits the stream into blocks and compresses them across a process pool.
+    Output is the concatenation of independently compressed blocks (pigz style multi-member gzip),
+    which gzip, zcat, tarfile, zstd and lz4 all read back as one continuous stream.
+    blocks lists the (uncompressed offset, compressed offset) each block starts at, so a reader can seek.
+    The level can change between blocks (see set_level), classes totals the bytes in, bytes out and cpu seconds
+    of the blocks compressed under each tag.
+    """
+
+    def __init__(
+            self,
+            fileobj,
+            codec: str = "gzip",
+            level: int = None,
+            workers: int = None,
+            block_size: int = DEFAULT_BLOCK_SIZE,
+            close_fileobj: bool = False
+    ):
+        self.codec = check_codec(codec)
+        self.level = CODECS[codec]["default_level"] if level is None else int(level)
+        self.workers = max(1, int(workers) if workers else (os.cpu_count() or 1))
+        self.block_size = int(block_size)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.blocks = []
+        self.classes = {}
+        self.tag = None
+        self.closed = False
+        self.__fileobj = fileobj
+        self.__close_fileobj = close_fileobj
+        self.__buffer = bytearray()
+        self.__pending = deque()
+        # a single worker, or no compression at all, is cheaper inline than pickling blocks to a pool
+        if self.workers > 1 and codec != "none":
+            self.__pool = ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            self.__pool = None
+
+    def write(self, data) -> int:
+        self.__buffer += data
+        while len(self.__buffer) >= self.block_size:
+            block = bytes(self.__buffer[:self.block_size])
+            del self.__buffer[:self.block_size]
+            self.__submit(block)
+        return len(data)
+
+    def set_level(self, level: int, tag: str = None):
+        """
+        Compresses what follows at level, what was written before ends its block at the old one.
+        :param level: compression level of the codec
+        :param tag: name the following blocks are totalled under in classes
+        """
+        level = int(level)
+        if (level, tag) == (self.level, self.tag):
+            return
+        if self.__buffer:
+            block = bytes(self.__buffer)
+            self.__buffer.clear()
+            self.__submit(block)
+        self.level, self.tag = level, tag
+
+    def __submit(self, block: bytes):
+        offset = self.bytes_in
+        self.bytes_in += len(block)
+        if self.__pool is None:
+            self.__write_out(offset, self.tag, len(block), *measure_block(self.codec, self.level, block))
+            return
+        future = self.__pool.submit(measure_block, self.codec, self.level, block)
+        self.__pending.append((offset, self.tag, len(block), future))
+        # bound the blocks in flight so memory stays at roughly workers * 2 * block_size
+        self.__drain(self.workers * 2)
+
+    def __drain(self, keep: int = 0):
+        # blocks are written strictly in submission order, regardless of which worker finishes first
+        while len(self.__pending) > keep:
+            offset, tag, size, future = self.__pending.popleft()
+            self.__write_out(offset, tag, size, *future.result())
+
+    def __write_out(self, offset: int, tag: str, size: int, compressed: bytes, seconds: float):
+        self.blocks.append((offset, self.bytes_out))
+        self.__fileobj.write(compressed)
+        self.bytes_out += len(compressed)
+        totals = self.classes.setdefault(tag, {"bytes_in": 0, "bytes_out": 0, "cpu_seconds": 0.0, "blocks": 0})
+        totals["bytes_in"] += size
+        totals["bytes_out"] += len(compressed)
+        totals["cpu_seconds"] += seconds
+        totals["blocks"] += 1
+
+    def flush(self):
+        # ends the current block early, everything written so far is on its way to the file
+        if self.__buffer:
+            block = bytes(self.__buffer)
+            self.__buffer.clear()
+            self.__submit(block)
+        self.__drain()
+        self.__fileobj.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self.closed = True
+            if self.__pool is not None:
+                self.__pool.shutdown()
+            if self.__close_fileobj:
+                self.__fileobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def open_writer(
+        name: str,
+        mode: str = "w",
+        codec: str = "gzip",
+        level: int = None,
+        workers: int = None,
+        block_size: int = DEFAULT_BLOCK_SIZE
+) -> BlockCompressor:
+    """
+    :param name: archive file to create
+    :param mode: tarfile style mode, 'x...' refuses to overwrite an existing file, anything else overwrites
+    :param codec: one of CODECS
+    :param level: compression level, codec default if None
+    :param workers: compression processes, defaults to cpu count
+    :param block_size: uncompressed bytes per independently compressed block
+    :return: BlockCompressor that owns (and closes) the file
+    """
+    file_mode = "xb" if str(mode).startswith("x") else "wb"
+    return BlockCompressor(
+        open(name, file_mode),
+        codec=codec, level=level, workers=workers, block_size=block_size, close_fileobj=True
+    )
+
+
+def open_reader(name: str, codec: str = None):
+    # returns a binary file object of the decompressed stream, concatenated blocks read as one
+    codec = check_codec(codec or codec_from_name(name))
+    if codec == "gzip":
+        return gzip.open(name, "rb")
+    elif codec == "zstd":
+        return zstandard.ZstdDecompressor().stream_reader(open(name, "rb"), read_across_frames=True, closefd=True)
+    elif codec == "lz4":
+        return lz4_frame.open(name, "rb")
+    else:
+        return open(name, "rb")
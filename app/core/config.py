@@ -1,2 +1,45 @@
-# todo: generate config file if not existing
+import json
+import os
+
+# generate config file if not existing
 # then load and set configs in file
+
+# written out by generate_config, every key is optional in a hand written file
+DEFAULT_CONFIG = {
+    # compression processes shared by every backup running at once
+    "max_workers": os.cpu_count() or 1,
+    # combined read bandwidth of every backup running at once, 0 for unlimited
+    "disk_bandwidth_mb": 0,
+    # look for running minecraft containers in addition to the worlds listed below
+    "discover": False,
+    "discover_image": "minecraft-server",
+    # applied to every world, any backup setting (codec, workers, incremental, snapshot_dir...) can go here
+    # the daemon (app/daemon.py) also reads full_every_minutes, incremental_every_minutes,
+    # hot_every_seconds, hot_keep_versions and hot_keep_hours from here
+    "defaults": {
+        "save_dir": "world_backups",
+    },
+    # {"container": "...", "source": "...", plus any of the defaults to override them for this world}
+    "worlds": [],
+}
+
+
+def generate_config(file_name: str) -> bool:
+    # returns True if a new config was written, an existing one is never touched
+    if os.path.exists(file_name):
+        return False
+    with open(file_name, "w") as f:
+        json.dump(DEFAULT_CONFIG, f, indent=4)
+    return True
+
+
+def load_config(file_name: str) -> dict:
+    with open(file_name) as f:
+        loaded = json.load(f)
+    config = dict(DEFAULT_CONFIG)
+    config.update(loaded)
+    config["defaults"] = {**DEFAULT_CONFIG["defaults"], **loaded.get("defaults", {})}
+    for each in config["worlds"]:
+        if "container" not in each:
+            raise ValueError(f"world without a container in {file_name}: {each}")
+    return config
@@ -0,0 +1,230 @@
+import bisect
+import errno
+import json
+import os
+import stat
+import tarfile
+import time
+
+from app.core import compression
+from app.core.FileIO import FileIO, StatEntry
+
+# tar stores every member as a header (512 bytes, more with pax records) plus its data padded to 512,
+# and ends on two zero blocks padded out to a 10 KiB record
+TAR_BLOCK = tarfile.BLOCKSIZE
+TAR_RECORD = tarfile.RECORDSIZE
+SAMPLE_SIZE = 256 * 1024
+SAMPLE_COUNT = 64
+# headers compress far better than region data, enough of them are compressed on their own to tell how well
+SAMPLE_HEADERS = 1024
+# a cached sample ratio is reused while the source stays within this fraction of the size it was sampled at
+RESAMPLE_GROWTH = 0.05
+RESAMPLE_AGE = 24 * 60 * 60
+# measured / predicted of past runs, the newest HISTORY are averaged into the correction
+HISTORY = 8
+# filesystems that can't preallocate, the archive is written without a reservation
+NO_FALLOCATE = {errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS}
+
+
+def tar_header(name: str, entry) -> bytes:
+    # the header tarfile writes for a scanned entry, pax records for long names and float mtimes included
+    info = tarfile.TarInfo(name)
+    info.mtime = entry.mtime_ns / 1e9
+    info.mode = stat.S_IMODE(entry.mode)
+    if entry.is_dir:
+        info.type = tarfile.DIRTYPE
+    elif stat.S_ISLNK(entry.mode):
+        info.type = tarfile.SYMTYPE
+    elif stat.S_ISREG(entry.mode):
+        info.size = entry.size
+    return info.tobuf(tarfile.DEFAULT_FORMAT, tarfile.ENCODING, "surrogateescape")
+
+
+def tar_layout(scan: dict, arcname: str) -> dict:
+    """
+    Sizes of the uncompressed tar stream of a FileIO.scan_tree result, without reading a byte of the files.
+    :param scan: the tree under arcname
+    :param arcname: name of the scanned root inside the archive
+    :return: dict of size (the whole stream), data (file contents padded to 512), headers (header bytes),
+        and header_sample, up to SAMPLE_HEADERS headers evenly spread over the tree
+    """
+    root = arcname.replace(os.sep, "/").lstrip("/")
+    # the source directory itself comes first, only its name and type matter for the header size
+    layout = {"size": 0, "data": 0, "headers": 0, "header_sample": []}
+    layout["headers"] = len(tar_header(root, StatEntry(0, time.time_ns(), 0, stat.S_IFDIR | 0o755, True)))
+    step = max(1, len(scan) // SAMPLE_HEADERS)
+    for position, (relative, entry) in enumerate(scan.items()):
+        header = tar_header(f"{root}/{relative}" if root else relative, entry)
+        layout["headers"] += len(header)
+        if stat.S_ISREG(entry.mode):
+            layout["data"] += -(-entry.size // TAR_BLOCK) * TAR_BLOCK
+        if position % step == 0:
+            layout["header_sample"].append(header)
+    size = layout["headers"] + layout["data"] + 2 * TAR_BLOCK
+    layout["size"] = -(-size // TAR_RECORD) * TAR_RECORD
+    return layout
+
+
+def archive_codec(codec: str = None, mode: str = "w:gz", level: int = None) -> (str, int):
+    # the codec and level write_archive will actually use, tarfile's own gzip compresses at 9
+    if codec is None:
+        tar_compression = str(mode).partition(":")[2]
+        codec = {"gz": "gzip", "": "none"}.get(tar_compression, tar_compression)
+        if codec == "gzip" and level is None:
+            level = 9
+    if codec in compression.CODECS and level is None:
+        level = compression.CODECS[codec]["default_level"]
+    return codec, level
+
+
+def sample_ratio(
+        source: str, scan: dict, codec: str, level: int, headers: list = None,
+        count: int = SAMPLE_COUNT, size: int = SAMPLE_SIZE
+) -> dict:
+    """
+    Compresses count slices of size bytes spread evenly over the files of scan read back to back, the way tar
+    streams them, so a slice landing on small files (playerdata, stats) takes in as many of them as fit.
+    Evenly spaced rather than random, so the same world always gives the same answer.
+    :param headers: tar headers to compress on their own, see tar_layout
+    :return: dict of ratio (compressed / raw of the sample), header_ratio, bytes sampled and seconds taken
+    """
+    started = time.monotonic()
+    if codec == "none" or codec not in compression.available_codecs():
+        # nothing to measure, or a tarfile codec (bz2, xz) this can't run: assume it doesn't shrink anything
+        return {"ratio": 1.0, "header_ratio": 1.0, "sampled": 0, "seconds": 0.0}
+    files = sorted((path, entry.size) for path, entry in scan.items() if stat.S_ISREG(entry.mode) and entry.size)
+    offsets = []
+    total = 0
+    for _, file_size in files:
+        offsets.append(total)
+        total += file_size
+    count = min(count, -(-total // size)) if total else 0
+    raw = compressed = 0
+    for i in range(count):
+        # the middle of the i-th of count equal stretches of the stream
+        position = max(0, min((2 * i + 1) * total // (2 * count) - size // 2, total - size))
+        index = bisect.bisect_right(offsets, position) - 1
+        data = bytearray()
+        while len(data) < size and index < len(files):
+            path, file_size = files[index]
+            try:
+                with open(os.path.join(str(source), *path.split("/")), "rb") as f:
+                    f.seek(position - offsets[index])
+                    data += f.read(size - len(data))
+            except OSError:
+                # deleted or unreadable since the scan, the archiver will say so
+                pass
+            index += 1
+            position = offsets[index] if index < len(files) else total
+        raw += len(data)
+        compressed += len(compression.compress_block(codec, level, bytes(data)))
+    header_bytes = b"".join(headers or [])
+    return {
+        "ratio": compressed / raw if raw else 1.0,
+        "header_ratio": len(compression.compress_block(codec, level, header_bytes)) / len(header_bytes)
+        if header_bytes else 1.0,
+        "sampled": raw,
+        "seconds": time.monotonic() - started,
+    }
+
+
+class SpaceEstimator:
+    """
+    Predicts the size of the next archive of one world: the file and header bytes of a fresh scan, each times
+    the compression ratio of a sample of them, times a correction learned from how far off past predictions were.
+    The sample and the history are kept in a json file per world.
+    """
+
+    def __init__(self, file_name: str, codec: str = None, mode: str = "w:gz", level: int = None):
+        self.file_name = str(file_name)
+        self.codec, self.level = archive_codec(codec, mode, level)
+        self.state = {"samples": {}, "history": []}
+        if os.path.exists(self.file_name):
+            with open(self.file_name) as f:
+                self.state.update(json.load(f))
+        self.prediction = None
+
+    @property
+    def key(self) -> str:
+        return f"{self.codec}:{self.level}"
+
+    @property
+    def correction(self) -> float:
+        # mean measured / predicted of the newest runs with this codec and level, 1 until there are any
+        runs = [each["measured"] / each["predicted"] for each in self.state["history"]
+                if each["key"] == self.key and each["predicted"] and each["measured"]]
+        return sum(runs) / len(runs) if runs else 1.0
+
+    def predict(self, source: str, margin: float = 0.1, arcname: str = None, scan: dict = None) -> dict:
+        """
+        :param source: world directory
+        :param margin: fraction of the prediction reserved on top of it
+        :param arcname: name of source inside the archive, like write_archive's
+        :param scan: FileIO.scan_tree of source, if the caller already has one
+        :return: dict of source and tar bytes, ratio, correction, predicted archive bytes, reserve (with the margin)
+            and whether the ratio was sampled or cached
+        """
+        if scan is None:
+            scan = FileIO.scan_tree(source) if os.path.isdir(source) else {}
+        layout = tar_layout(scan, str(source) if arcname is None else str(arcname))
+        source_bytes = sum(entry.size for entry in scan.values() if stat.S_ISREG(entry.mode))
+        cached = self.state["samples"].get(self.key)
+        fresh = (
+            cached is not None
+            and abs(source_bytes - cached["source_bytes"]) <= RESAMPLE_GROWTH * max(1, cached["source_bytes"])
+            and time.time() - cached["at"] < RESAMPLE_AGE
+        )
+        if not fresh:
+            sampled = sample_ratio(source, scan, self.codec, self.level, layout["header_sample"])
+            cached = {
+                "ratio": sampled["ratio"], "header_ratio": sampled["header_ratio"],
+                "source_bytes": source_bytes, "at": time.time()
+            }
+            self.state["samples"][self.key] = cached
+            self.save()
+        correction = self.correction
+        # padding is zeros and compresses to next to nothing, the end of archive padding isn't compressed at all
+        compressed = source_bytes * cached["ratio"] + layout["headers"] * cached["header_ratio"]
+        if self.codec == "none":
+            compressed = layout["size"]
+        predicted = int(compressed * correction)
+        self.prediction = {
+            "source_bytes": source_bytes,
+            "tar_bytes": layout["size"],
+            "ratio": cached["ratio"],
+            "correction": correction,
+            "predicted": predicted,
+            "reserve": int(predicted * (1 + margin)),
+            "sampled": not fresh,
+        }
+        return self.prediction
+
+    def learn(self, archive_bytes: int):
+        # the measured size of the archive the last predict() was for
+        if self.prediction is None:
+            return
+        uncorrected = self.prediction["predicted"] / self.prediction["correction"]
+        self.state["history"].append({"key": self.key, "predicted": uncorrected, "measured": int(archive_bytes)})
+        self.state["history"] = self.state["history"][-HISTORY:]
+        self.save()
+
+    def save(self):
+        with FileIO.atomic_open(self.file_name, fsync=False) as f:
+            json.dump(self.state, f)
+
+
+def reserve(fileobj, size: int) -> bool:
+    """
+    Allocates size bytes for fileobj up front, so a full disk fails here instead of halfway through the archive.
+    The file grows to size, the writer truncates it to what it actually wrote.
+    :return: True if reserved, False if the platform or filesystem can't preallocate
+    """
+    if size <= 0 or not hasattr(os, "posix_fallocate"):
+        return False
+    try:
+        os.posix_fallocate(fileobj.fileno(), 0, int(size))
+    except OSError as e:
+        if e.errno in NO_FALLOCATE:
+            return False
+        raise
+    return True
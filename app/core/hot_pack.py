@@ -0,0 +1,364 @@
+import datetime
+import gzip
+import os
+import struct
+import time
+import zlib
+from contextlib import contextmanager
+from fnmatch import fnmatch
+
+from app.core.FileIO import FileIO
+
+# fcntl is unix only, without it two writers of one pack (the daemon and a cron run) aren't kept apart
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MAGIC = b"HOTPACK1"
+# kind, path length, pass time (ns), mtime (ns), size, stored length, crc32 of the file, then path and data
+RECORD = struct.Struct(">BHqqIII")
+KIND_FILE = 1
+# closes a pass, size holds its file count: records after the last commit never happened
+KIND_COMMIT = 2
+COMPRESSED = 0x80
+# relative to every world directory (one holding a level.dat) in or directly under the source
+HOT_FILES = ["level.dat", "playerdata/*.dat", "advancements/*.json", "stats/*.json"]
+# compaction keeps the newest versions of each file, and every version of the last day
+KEEP_VERSIONS = 60
+KEEP_SECONDS = 24 * 60 * 60
+TEMP_SUFFIX = ".compact"
+
+
+def world_dirs(source: str) -> list:
+    # "" for the source itself, the overworld of a server's /data sits one level down
+    found = [""] if os.path.isfile(os.path.join(source, "level.dat")) else []
+    with os.scandir(source) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False) and os.path.isfile(os.path.join(entry.path, "level.dat")):
+                found.append(entry.name)
+    return sorted(found)
+
+
+def hot_files(source: str, worlds: list = None) -> dict:
+    """
+    Lists only the directories hot files can be in, never the region folders.
+    :param source: server data or world directory
+    :param worlds: world_dirs(source), if the caller keeps them
+    :return: relative path ('/' separated) -> os.stat_result of every hot file
+    """
+    found = {}
+    for world in world_dirs(source) if worlds is None else worlds:
+        for pattern in HOT_FILES:
+            directory, _, name_pattern = pattern.rpartition("/")
+            relative_dir = "/".join(each for each in (world, directory) if each)
+            path = os.path.join(source, *relative_dir.split("/")) if relative_dir else source
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if fnmatch(entry.name, name_pattern) and entry.is_file(follow_symlinks=False):
+                            found[f"{relative_dir}/{entry.name}" if relative_dir else entry.name] = entry.stat()
+            except FileNotFoundError:
+                continue
+    return found
+
+
+def read_settled(path: str, stat: os.stat_result):
+    # the file's bytes if it is whole: unchanged while it was read, and a complete gzip stream if it is nbt
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+            after = os.fstat(f.fileno())
+    except OSError:
+        return None
+    if (after.st_size, after.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns) or len(data) != stat.st_size:
+        return None
+    if path.endswith(".dat"):
+        try:
+            gzip.decompress(data)
+        except (OSError, EOFError, zlib.error):
+            # caught halfway through a write that doesn't go through a rename
+            return None
+    return data
+
+
+class HotPack:
+    """
+    Append-only pack of versions of a world's small critical files (level.dat, playerdata, advancements, stats),
+    for backups every minute or so without pausing saving and without docker.
+    A pass appends every changed file and a commit record in one write, the index of every version lives in memory
+    and is rebuilt by reading only the record headers when the pack is opened.
+    compact() drops old versions by writing the ones kept to a new file renamed over the pack, any other HotPack
+    open on it reopens the new file before its next pass or restore.
+    """
+
+    def __init__(self, file_name: str, writable: bool = True):
+        self.file_name = str(file_name)
+        self.writable = writable
+        # relative path -> [(pass time ns, record offset, mtime ns, size, crc32)], oldest first
+        self.index = {}
+        # relative path -> (mtime ns, size) last looked at, a file that matches isn't read again
+        self.__seen = {}
+        self.passes = 0
+        self.__end = 0
+        if writable and not os.path.exists(self.file_name):
+            os.makedirs(os.path.dirname(os.path.abspath(self.file_name)), exist_ok=True)
+            with open(self.file_name, "xb") as f:
+                f.write(MAGIC)
+        self.__open()
+
+    def __open(self):
+        # (re)reads the pack from the start, the file open before is the caller's to close
+        self.__file = open(self.file_name, "r+b" if self.writable else "rb")
+        if self.__file.read(len(MAGIC)) != MAGIC:
+            self.__file.close()
+            raise ValueError(f"not a hot file pack: {self.file_name}")
+        self.index = {}
+        self.passes = 0
+        self.__end = len(MAGIC)
+        self.__catch_up()
+
+    def __replaced(self) -> bool:
+        # compacted by another process since this one opened it
+        try:
+            return os.stat(self.file_name).st_ino != os.fstat(self.__file.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
+    def __catch_up(self):
+        # indexes the passes appended since __end, by this or another process
+        self.__file.seek(0, os.SEEK_END)
+        size = self.__file.tell()
+        offset = self.__end
+        pending = []
+        while offset + RECORD.size <= size:
+            self.__file.seek(offset)
+            kind, path_length, at, mtime_ns, file_size, stored, crc = RECORD.unpack(self.__file.read(RECORD.size))
+            end = offset + RECORD.size + path_length + stored
+            if end > size:
+                break
+            if kind == KIND_COMMIT:
+                for path, version in pending:
+                    self.index.setdefault(path, []).append(version)
+                    self.__seen[path] = (version[2], version[3])
+                pending = []
+                self.passes += 1
+                self.__end = end
+            else:
+                path = self.__file.read(path_length).decode()
+                pending.append((path, (at, offset, mtime_ns, file_size, crc)))
+            offset = end
+
+    def snapshot(self, source: str, worlds: list = None) -> dict:
+        """
+        One pass: every hot file whose content changed since its last version is appended.
+        :param source: server data or world directory, paths are stored relative to it
+        :param worlds: world_dirs(source), if the caller keeps them
+        :return: dict of files seen, appended, unchanged and unsettled (being written, picked up next pass),
+            bytes appended and seconds taken
+        """
+        if not self.writable:
+            raise ValueError(f"{self.file_name} was opened read only")
+        started = time.monotonic()
+        at = time.time_ns()
+        stats = {"files": 0, "appended": 0, "unchanged": 0, "unsettled": 0, "bytes": 0}
+        with self.__lock():
+            self.__catch_up()
+            buffer = bytearray()
+            appended = []
+            for relative, stat in hot_files(source, worlds).items():
+                stats["files"] += 1
+                if self.__seen.get(relative) == (stat.st_mtime_ns, stat.st_size):
+                    stats["unchanged"] += 1
+                    continue
+                data = read_settled(os.path.join(source, *relative.split("/")), stat)
+                if data is None:
+                    stats["unsettled"] += 1
+                    continue
+                crc = zlib.crc32(data)
+                latest = self.version(relative)
+                if latest is not None and (latest[3], latest[4]) == (len(data), crc):
+                    # touched, not changed
+                    self.__seen[relative] = (stat.st_mtime_ns, stat.st_size)
+                    stats["unchanged"] += 1
+                    continue
+                kind = KIND_FILE
+                stored = zlib.compress(data, 6)
+                if len(stored) < len(data):
+                    kind |= COMPRESSED
+                else:
+                    # nbt .dat files are gzipped already
+                    stored = data
+                path = relative.encode()
+                offset = self.__end + len(buffer)
+                buffer += RECORD.pack(kind, len(path), at, stat.st_mtime_ns, len(data), len(stored), crc)
+                buffer += path + stored
+                appended.append((relative, (at, offset, stat.st_mtime_ns, len(data), crc)))
+            if appended:
+                buffer += RECORD.pack(KIND_COMMIT, 0, at, 0, len(appended), 0, 0)
+                self.__file.seek(self.__end)
+                self.__file.write(buffer)
+                # anything past the commit would be a pass torn by a crash, cut before it can confuse a reader
+                self.__file.truncate()
+                self.__file.flush()
+                os.fsync(self.__file.fileno())
+                self.__end += len(buffer)
+                self.passes += 1
+                for relative, version in appended:
+                    self.index.setdefault(relative, []).append(version)
+                    self.__seen[relative] = (version[2], version[3])
+            stats["appended"] = len(appended)
+            stats["bytes"] = len(buffer)
+        stats["seconds"] = time.monotonic() - started
+        return stats
+
+    @contextmanager
+    def __lock(self):
+        # exclusive for the length of a pass, the daemon and a cron run may share a pack
+        if fcntl is None:
+            yield
+            return
+        while True:
+            locked = self.__file
+            fcntl.flock(locked.fileno(), fcntl.LOCK_EX)
+            if not self.__replaced():
+                break
+            # the lock was on the file compaction renamed away, appending to it would be lost
+            fcntl.flock(locked.fileno(), fcntl.LOCK_UN)
+            self.__open()
+            locked.close()
+        try:
+            yield
+        finally:
+            fcntl.flock(locked.fileno(), fcntl.LOCK_UN)
+            if locked is not self.__file:
+                # compacted under this lock
+                locked.close()
+
+    def compact(self, keep_versions: int = KEEP_VERSIONS, keep_seconds: float = KEEP_SECONDS,
+                now: float = None) -> dict:
+        """
+        Drops old versions, cheap enough to call after every pass: the pack is only rewritten once at least as many
+        versions would go as stay. Pass times are kept, so version(at) finds the same file for any at still covered.
+        :param keep_versions: newest versions kept of each file, at least the latest always is
+        :param keep_seconds: every version stored within this many seconds is kept too
+        :param now: epoch seconds, for tests
+        :return: dict of versions kept and dropped, bytes before and after, and whether the pack was rewritten
+        """
+        if not self.writable:
+            raise ValueError(f"{self.file_name} was opened read only")
+        cutoff = ((time.time() if now is None else now) - keep_seconds) * 1e9
+        with self.__lock():
+            self.__catch_up()
+            # pass time -> record offsets kept from that pass
+            kept = {}
+            dropped = 0
+            for versions in self.index.values():
+                newest = len(versions) - max(1, int(keep_versions))
+                for position, version in enumerate(versions):
+                    if position >= newest or version[0] >= cutoff:
+                        kept.setdefault(version[0], []).append(version[1])
+                    else:
+                        dropped += 1
+            stats = {
+                "kept": sum(len(each) for each in kept.values()), "dropped": dropped,
+                "before": self.__end, "after": self.__end, "rewritten": False,
+            }
+            if not dropped or dropped < stats["kept"]:
+                return stats
+            temp = self.file_name + TEMP_SUFFIX
+            with open(temp, "wb") as f:
+                f.write(MAGIC)
+                for at in sorted(kept):
+                    for offset in sorted(kept[at]):
+                        f.write(self.__record(offset))
+                    f.write(RECORD.pack(KIND_COMMIT, 0, at, 0, len(kept[at]), 0, 0))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, self.file_name)
+            if hasattr(os, "O_DIRECTORY"):
+                # the rename is only durable once the directory holding it is
+                directory = os.open(os.path.dirname(os.path.abspath(self.file_name)), os.O_RDONLY | os.O_DIRECTORY)
+                try:
+                    os.fsync(directory)
+                finally:
+                    os.close(directory)
+            if fcntl is None:
+                self.__file.close()
+            self.__open()
+            stats.update(after=self.__end, rewritten=True)
+        return stats
+
+    def __record(self, offset: int) -> bytes:
+        # one whole file record, header, path and data as stored
+        self.__file.seek(offset)
+        header = self.__file.read(RECORD.size)
+        _, path_length, _, _, _, stored, _ = RECORD.unpack(header)
+        return header + self.__file.read(path_length + stored)
+
+    def version(self, relative: str, at: float = None):
+        # the newest version of relative stored at or before at (epoch seconds), None if there isn't one
+        versions = self.index.get(relative, [])
+        if at is not None:
+            versions = [each for each in versions if each[0] <= at * 1e9]
+        return versions[-1] if versions else None
+
+    def read(self, version) -> bytes:
+        self.__file.seek(version[1])
+        kind, path_length, _, _, _, stored, crc = RECORD.unpack(self.__file.read(RECORD.size))
+        self.__file.seek(path_length, os.SEEK_CUR)
+        data = self.__file.read(stored)
+        if kind & COMPRESSED:
+            data = zlib.decompress(data)
+        if zlib.crc32(data) != crc:
+            raise ValueError(f"crc mismatch in {self.file_name} at {version[1]}")
+        return data
+
+    def player_files(self, uuid: str) -> list:
+        # every path stored for one player: playerdata, advancements and stats of each world
+        uuid = str(uuid).lower()
+        return sorted(
+            each for each in self.index
+            if each.rpartition("/")[2].lower().split(".")[0] == uuid
+        )
+
+    def restore(self, target: str, paths: list, at: float = None) -> list:
+        """
+        :param target: directory paths are written under (the world directory the pack was taken of, or staging)
+        :param paths: relative paths to restore, see player_files
+        :param at: epoch seconds, the newest versions at or before it, None for the latest
+        :return: the paths restored
+        """
+        if self.__replaced():
+            old = self.__file
+            self.__open()
+            old.close()
+        self.__catch_up()
+        restored = []
+        for relative in paths:
+            version = self.version(relative, at)
+            if version is None:
+                continue
+            path = os.path.join(str(target), *relative.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with FileIO.atomic_open(path, "wb") as f:
+                f.write(self.read(version))
+            os.utime(path, ns=(version[2], version[2]))
+            restored.append(relative)
+        return restored
+
+    def describe(self, version) -> str:
+        return datetime.datetime.utcfromtimestamp(version[0] / 1e9).strftime('%Y-%b-%d-%H.%M.%S')
+
+    @property
+    def size(self) -> int:
+        return self.__end
+
+    def close(self):
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,167 @@
+import ctypes
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+
+# linux/inotify.h
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+# struct inotify_event: wd, mask, cookie, len, then len bytes of nul padded name
+EVENT = struct.Struct("iIII")
+READ_SIZE = 64 * 1024
+
+
+def available() -> bool:
+    return sys.platform.startswith("linux") and hasattr(ctypes.CDLL(None), "inotify_init1")
+
+
+class ChangeTracker:
+    """
+    Paths under root changed since the last drain(), kept current by inotify watches on every directory,
+    so an incremental backup only has to look at what actually changed instead of stat'ing the whole world.
+    When the kernel queue overflows or the watch limit (fs.inotify.max_user_watches) is hit,
+    drain() answers None once, meaning: scan everything.
+    """
+
+    def __init__(self, root: str):
+        if not available():
+            raise OSError(errno.ENOSYS, "inotify needs linux")
+        self.root = os.path.abspath(str(root))
+        self.events = 0
+        self.__libc = ctypes.CDLL(None, use_errno=True)
+        self.__fd = self.__libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.__fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        # watch descriptor -> directory relative to root, "" for root itself
+        self.__watches = {}
+        self.__changed = set()
+        self.__overflowed = False
+        self.__lock = threading.RLock()
+        self.__stop = threading.Event()
+        self.__thread = None
+        self.__add_tree("")
+
+    def __add_watch(self, relative: str):
+        path = os.path.join(self.root, *relative.split("/")) if relative else self.root
+        wd = self.__libc.inotify_add_watch(self.__fd, os.fsencode(path), WATCH_MASK)
+        if wd >= 0:
+            self.__watches[wd] = relative
+        elif ctypes.get_errno() == errno.ENOSPC:
+            # out of watches, whatever happens under this directory goes unseen, so nothing can be trusted
+            self.__overflowed = True
+
+    def __add_tree(self, relative: str):
+        # a directory created or moved in, watched along with everything already inside it
+        top = os.path.join(self.root, *relative.split("/")) if relative else self.root
+        for directory, dir_names, file_names in os.walk(top):
+            found = os.path.relpath(directory, self.root)
+            self.__add_watch("" if found == "." else found.replace(os.sep, "/"))
+
+    def poll(self, timeout: float = 0.0) -> int:
+        """
+        :param timeout: seconds to wait for events, 0 only takes what the kernel already has
+        :return: events processed
+        """
+        readable, _, _ = select.select([self.__fd], [], [], timeout)
+        if not readable:
+            return 0
+        processed = 0
+        with self.__lock:
+            while True:
+                try:
+                    data = os.read(self.__fd, READ_SIZE)
+                except BlockingIOError:
+                    break
+                processed += self.__process(data)
+            self.events += processed
+        return processed
+
+    def __process(self, data: bytes) -> int:
+        offset = 0
+        count = 0
+        while offset + EVENT.size <= len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b"\0"))
+            offset += EVENT.size + length
+            count += 1
+            if mask & IN_Q_OVERFLOW:
+                self.__overflowed = True
+                continue
+            if mask & IN_IGNORED:
+                self.__watches.pop(wd, None)
+                continue
+            directory = self.__watches.get(wd)
+            if directory is None or not name:
+                # events on the watched directory itself, its parent reports the same change by name
+                continue
+            relative = f"{directory}/{name}" if directory else name
+            self.__changed.add(relative)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self.__add_tree(relative)
+        return count
+
+    def drain(self):
+        # changed relative paths (files and directories) since the last drain, None if everything has to be scanned
+        self.poll(0)
+        with self.__lock:
+            if self.__overflowed:
+                self.__overflowed = False
+                self.__changed.clear()
+                return None
+            changed = self.__changed
+            self.__changed = set()
+        return changed
+
+    def restore(self, changed):
+        # a backup that drained and then failed hands its changes back, None for a full scan next time
+        with self.__lock:
+            if changed is None:
+                self.__overflowed = True
+            else:
+                self.__changed.update(changed)
+
+    @property
+    def watches(self) -> int:
+        return len(self.__watches)
+
+    def __run(self):
+        while not self.__stop.is_set():
+            self.poll(1.0)
+
+    def start(self) -> "ChangeTracker":
+        # keeps the kernel queue drained in the background, so bursts of writes don't overflow it
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__run, name=f"inotify {self.root}", daemon=True)
+            self.__thread.start()
+        return self
+
+    def close(self):
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        os.close(self.__fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,162 @@
+import cProfile
+import datetime
+import io
+import json
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from app.core.FileIO import FileIO
+
+# resource is unix only, peak rss is reported as 0 elsewhere
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PROFILERS = ["cprofile", "tracemalloc"]
+METRIC_PREFIX = "pycraft_backup"
+
+
+def peak_rss() -> int:
+    # bytes, highest resident set size of this process and of its (compression) children so far
+    if resource is None:
+        return 0
+    # linux reports KiB, macOS bytes
+    scale = 1 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) * scale
+
+
+class RunMetrics:
+    """
+    Durations, bytes and throughput of each phase of one backup run (save-pause, scan, read, compress, write,
+    validate, resume...), exported as a json report and a prometheus node_exporter textfile.
+    """
+
+    def __init__(self, container: str, labels: dict = None):
+        self.container = str(container)
+        self.labels = dict(labels or {})
+        self.started = time.time()
+        self.__started = time.perf_counter()
+        self.phases = []
+        self.fields = {}
+
+    def add(self, name: str, seconds: float, bytes_processed: int = None, **fields) -> dict:
+        # a phase measured elsewhere, like the read and write time the archiver keeps track of itself
+        record = {"phase": name, "seconds": round(float(seconds), 6), "peak_rss_bytes": peak_rss()}
+        if bytes_processed is not None:
+            record["bytes"] = int(bytes_processed)
+            record["throughput_bytes_per_second"] = bytes_processed / seconds if seconds > 0 else 0.0
+        record.update(fields)
+        self.phases.append(record)
+        return record
+
+    @contextmanager
+    def phase(self, name: str, **fields):
+        # times the block, the yielded dict takes "bytes" and any other fields the block wants to add
+        record = dict(fields)
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            bytes_processed = record.pop("bytes", None)
+            self.add(name, time.perf_counter() - started, bytes_processed, **record)
+
+    def report(self) -> dict:
+        return {
+            "container": self.container,
+            "labels": self.labels,
+            "started": datetime.datetime.fromtimestamp(self.started, datetime.timezone.utc).isoformat(),
+            "seconds": round(time.perf_counter() - self.__started, 6),
+            "peak_rss_bytes": peak_rss(),
+            "phases": self.phases,
+            **self.fields,
+        }
+
+    def write_json(self, file_name: str) -> dict:
+        report = self.report()
+        with FileIO.atomic_open(file_name, fsync=False) as f:
+            json.dump(report, f, indent=2)
+        return report
+
+    def prometheus_lines(self) -> list:
+        labels = {"container": self.container, **self.labels}
+
+        def metric(name: str, value, **extra) -> str:
+            pairs = ",".join(f'{key}="{str(each).replace(chr(34), "")}"' for key, each in {**labels, **extra}.items())
+            return f"{METRIC_PREFIX}_{name}{{{pairs}}} {float(value)}"
+
+        report = self.report()
+        lines = [
+            f"# HELP {METRIC_PREFIX}_phase_seconds wall clock seconds spent in each phase of the last backup",
+            f"# TYPE {METRIC_PREFIX}_phase_seconds gauge",
+        ]
+        lines += [metric("phase_seconds", each["seconds"], phase=each["phase"]) for each in self.phases]
+        lines += [f"# TYPE {METRIC_PREFIX}_phase_bytes gauge"]
+        lines += [metric("phase_bytes", each["bytes"], phase=each["phase"]) for each in self.phases if "bytes" in each]
+        lines += [f"# TYPE {METRIC_PREFIX}_phase_throughput_bytes_per_second gauge"]
+        lines += [
+            metric("phase_throughput_bytes_per_second", each["throughput_bytes_per_second"], phase=each["phase"])
+            for each in self.phases if "bytes" in each
+        ]
+        lines += [
+            f"# TYPE {METRIC_PREFIX}_seconds gauge", metric("seconds", report["seconds"]),
+            f"# TYPE {METRIC_PREFIX}_peak_rss_bytes gauge", metric("peak_rss_bytes", report["peak_rss_bytes"]),
+            f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge",
+            metric("last_run_timestamp_seconds", self.started),
+        ]
+        for key, value in self.fields.items():
+            if isinstance(value, (bool, int, float)):
+                lines += [f"# TYPE {METRIC_PREFIX}_{key} gauge", metric(key, value)]
+        return lines
+
+    def write_prometheus(self, file_name: str):
+        # the textfile collector may read at any moment, so the file is replaced atomically
+        FileIO.write_records(file_name, self.prometheus_lines(), fsync=False)
+
+
+@contextmanager
+def profiling(kind: str, output_prefix: str):
+    """
+    :param kind: None (no profiling), "cprofile" (<prefix>.prof plus a text summary) or "tracemalloc"
+    :param output_prefix: path the results are written to, suffixes are added per kind
+    """
+    if not kind:
+        yield
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(output_prefix)), exist_ok=True)
+    if kind == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(f"{output_prefix}.prof")
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(40)
+            FileIO.overwrite(f"{output_prefix}.cprofile.txt", summary.getvalue())
+    elif kind == "tracemalloc":
+        tracemalloc.start(10)
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            top = [str(each) for each in snapshot.statistics("lineno")[:40]]
+            FileIO.write_records(
+                f"{output_prefix}.tracemalloc.txt", [f"current: {current} peak: {peak}"] + top, fsync=False
+            )
+    else:
+        raise ValueError(f"unknown profiler: {kind}, expected one of {', '.join(PROFILERS)}")
+
+
+def report_name(metrics_dir: str, container: str) -> str:
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d-%H.%M.%S')
+    return os.path.join(str(metrics_dir), f"{container}-{stamp}")
@@ -0,0 +1,107 @@
+import struct
+
+# Named Binary Tag: https://minecraft.wiki/w/NBT_format
+# only reading, and only as far as finding a few named values, everything else is skipped over without decoding
+TAG_END = 0
+TAG_BYTE = 1
+TAG_SHORT = 2
+TAG_INT = 3
+TAG_LONG = 4
+TAG_FLOAT = 5
+TAG_DOUBLE = 6
+TAG_BYTE_ARRAY = 7
+TAG_STRING = 8
+TAG_LIST = 9
+TAG_COMPOUND = 10
+TAG_INT_ARRAY = 11
+TAG_LONG_ARRAY = 12
+
+# big endian payloads of the fixed size tags
+SCALARS = {
+    TAG_BYTE: struct.Struct(">b"),
+    TAG_SHORT: struct.Struct(">h"),
+    TAG_INT: struct.Struct(">i"),
+    TAG_LONG: struct.Struct(">q"),
+    TAG_FLOAT: struct.Struct(">f"),
+    TAG_DOUBLE: struct.Struct(">d"),
+}
+# element size of the array tags
+ARRAYS = {TAG_BYTE_ARRAY: 1, TAG_INT_ARRAY: 4, TAG_LONG_ARRAY: 8}
+LENGTH = struct.Struct(">i")
+NAME_LENGTH = struct.Struct(">H")
+
+
+class NBTError(ValueError):
+    pass
+
+
+def _skip(data, position: int, tag: int) -> int:
+    # offset just past the payload of a tag starting at position
+    if tag in SCALARS:
+        return position + SCALARS[tag].size
+    if tag in ARRAYS:
+        return position + 4 + LENGTH.unpack_from(data, position)[0] * ARRAYS[tag]
+    if tag == TAG_STRING:
+        return position + 2 + NAME_LENGTH.unpack_from(data, position)[0]
+    if tag == TAG_LIST:
+        item = data[position]
+        count = LENGTH.unpack_from(data, position + 1)[0]
+        position += 5
+        if item in SCALARS:
+            return position + max(0, count) * SCALARS[item].size
+        for _ in range(count):
+            position = _skip(data, position, item)
+        return position
+    if tag == TAG_COMPOUND:
+        while True:
+            child = data[position]
+            position += 1
+            if child == TAG_END:
+                return position
+            position += 2 + NAME_LENGTH.unpack_from(data, position)[0]
+            position = _skip(data, position, child)
+    raise NBTError(f"unknown tag {tag} at {position}")
+
+
+def _find(data, position: int, names: set, within: set, found: dict) -> int:
+    # walks one compound's payload, collecting the scalars and strings named in names
+    while True:
+        tag = data[position]
+        position += 1
+        if tag == TAG_END:
+            return position
+        length = NAME_LENGTH.unpack_from(data, position)[0]
+        name = bytes(data[position + 2:position + 2 + length]).decode("utf-8", "replace")
+        position += 2 + length
+        if tag == TAG_COMPOUND and name in within:
+            position = _find(data, position, names, within, found)
+        elif name in names and tag in SCALARS:
+            found[name] = SCALARS[tag].unpack_from(data, position)[0]
+            position += SCALARS[tag].size
+        elif name in names and tag == TAG_STRING:
+            end = position + 2 + NAME_LENGTH.unpack_from(data, position)[0]
+            found[name] = bytes(data[position + 2:end]).decode("utf-8", "replace")
+            position = end
+        else:
+            position = _skip(data, position, tag)
+
+
+def find_values(data, names, within=()) -> dict:
+    """
+    Reads named numbers and strings out of an uncompressed NBT document whose root is a compound.
+    :param data: the document, bytes or a memoryview
+    :param names: tag names to read, numbers and strings only
+    :param within: names of nested compounds to look into as well (chunks before 1.18 keep theirs under Level)
+    :return: name -> value of the ones found, a name found twice keeps the last
+    """
+    found = {}
+    try:
+        if data[0] != TAG_COMPOUND:
+            raise NBTError(f"root tag is {data[0]}, not a compound")
+        position = 3 + NAME_LENGTH.unpack_from(data, 1)[0]
+        end = _find(data, position, set(names), set(within), found)
+    except (IndexError, struct.error, RecursionError) as e:
+        raise NBTError(f"truncated or malformed nbt: {e!r}") from None
+    if end > len(data):
+        raise NBTError("nbt runs past the end of the data")
+    return found
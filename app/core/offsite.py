@@ -0,0 +1,330 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core.FileIO import FileIO
+
+# special library, optional (pip install boto3), only needed when an offsite target is configured
+try:
+    import boto3
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import BotoCoreError, ClientError
+    TRANSFER_ERRORS = (BotoCoreError, ClientError, OSError)
+except ImportError:
+    boto3 = None
+    TRANSFER_ERRORS = (OSError,)
+
+# S3 wants at least 5 MiB for every part but the last, and at most 10000 parts
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+UPLOAD_STATE_SUFFIX = ".upload.json"
+# uploaded after the archive, small enough for a single put
+SIDECAR_SUFFIXES = [".sha256", ".idx"]
+RETRIES = 3
+
+
+class OffsiteUploadError(Exception):
+    pass
+
+
+def make_client(endpoint_url: str = None, region: str = None, pool_size: int = 16):
+    # credentials the usual boto3 way, environment, ~/.aws or an instance role, endpoint_url for MinIO and friends
+    if boto3 is None:
+        raise ValueError("offsite uploads need boto3, try: pip install boto3")
+    return boto3.client(
+        "s3", endpoint_url=endpoint_url, region_name=region,
+        config=BotoConfig(max_pool_connections=pool_size, retries={"max_attempts": RETRIES})
+    )
+
+
+def upload_state_file(file_name: str) -> str:
+    return f"{file_name}{UPLOAD_STATE_SUFFIX}"
+
+
+def multipart_etag(digests: list) -> str:
+    # what S3 reports for a multipart object: md5 of the concatenated part md5s, dash, part count
+    return f'"{hashlib.md5(b"".join(digests)).hexdigest()}-{len(digests)}"'
+
+
+class MultipartUpload:
+    """
+    Write-only file object streaming into an S3 multipart upload: every part_size bytes become a part,
+    uploaded on a thread pool with its Content-MD5 while the writer carries on.
+    Completed parts are recorded in a state file, so an interrupted upload continues with resume()
+    from the local copy, reading only the parts that never made it.
+    A failed part never fails the writer, the remaining parts are only counted and close() raises.
+    """
+
+    def __init__(
+            self,
+            client,
+            bucket: str,
+            key: str,
+            state_file: str,
+            part_size: int = DEFAULT_PART_SIZE,
+            workers: int = 4
+    ):
+        """
+        :param client: boto3 s3 client, see make_client
+        :param bucket: target bucket
+        :param key: object key of the archive
+        :param state_file: local json of the upload id and finished parts
+        :param part_size: bytes per part, at least MIN_PART_SIZE
+        :param workers: parts in flight at once, memory use is about twice this many parts
+        """
+        if part_size < MIN_PART_SIZE:
+            raise ValueError(f"part size {part_size} is below the S3 minimum of {MIN_PART_SIZE}")
+        self.client = client
+        self.bucket = str(bucket)
+        self.key = str(key)
+        self.state_file = str(state_file)
+        self.part_size = int(part_size)
+        self.workers = max(1, int(workers))
+        self.bytes_written = 0
+        self.error = None
+        self.closed = False
+        self.parts = {}
+        self.upload_id = None
+        self.__buffer = bytearray()
+        self.__pending = deque()
+        self.__lock = threading.Lock()
+        self.__pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="offsite")
+
+    def start(self) -> "MultipartUpload":
+        response = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key)
+        self.upload_id = response["UploadId"]
+        self.__save_state()
+        return self
+
+    def __save_state(self):
+        with self.__lock:
+            state = {
+                "bucket": self.bucket,
+                "key": self.key,
+                "upload_id": self.upload_id,
+                "part_size": self.part_size,
+                "parts": {str(number): part for number, part in sorted(self.parts.items())},
+            }
+        with FileIO.atomic_open(self.state_file, fsync=False) as f:
+            json.dump(state, f)
+
+    def write(self, data) -> int:
+        self.__buffer += data
+        self.bytes_written += len(data)
+        while len(self.__buffer) >= self.part_size:
+            part = bytes(self.__buffer[:self.part_size])
+            del self.__buffer[:self.part_size]
+            self.__submit(part)
+        return len(data)
+
+    def flush(self):
+        # parts have a fixed size so they line up with the local file on resume, only close() sends a short one
+        pass
+
+    def __submit(self, data: bytes):
+        number = (self.bytes_written - len(self.__buffer) - len(data)) // self.part_size + 1
+        if number > MAX_PARTS:
+            raise OffsiteUploadError(f"{self.key}: more than {MAX_PARTS} parts, raise the part size")
+        if self.error is not None:
+            # already broken, resume() picks the rest up from the local file
+            return
+        self.__pending.append(self.__pool.submit(self.upload_part, number, data))
+        # bound the parts held in memory, this is where a slow uplink pushes back on the archiver
+        while len(self.__pending) > self.workers * 2:
+            self.__pending.popleft().result()
+
+    def upload_part(self, number: int, data: bytes):
+        digest = hashlib.md5(data).digest()
+        for attempt in range(RETRIES):
+            try:
+                response = self.client.upload_part(
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=data,
+                    ContentMD5=base64.b64encode(digest).decode()
+                )
+                if response["ETag"].strip('"') != digest.hex():
+                    raise OffsiteUploadError(f"{self.key} part {number}: etag {response['ETag']} is not its md5")
+                with self.__lock:
+                    self.parts[number] = {"etag": response["ETag"], "md5": digest.hex(), "size": len(data)}
+                self.__save_state()
+                return
+            except TRANSFER_ERRORS + (OffsiteUploadError,) as e:
+                if attempt == RETRIES - 1:
+                    self.error = e
+                    return
+                time.sleep(2 ** attempt)
+
+    def close(self) -> dict:
+        """
+        Sends the last part, waits for the rest and completes the upload.
+        :return: dict of key, size, etag and parts, see complete()
+        """
+        if self.closed:
+            return {}
+        self.closed = True
+        try:
+            if self.__buffer or not self.bytes_written:
+                # the short tail part, or the single empty part of an empty file
+                number = (self.bytes_written - len(self.__buffer)) // self.part_size + 1
+                if self.error is None:
+                    self.__pending.append(self.__pool.submit(self.upload_part, number, bytes(self.__buffer)))
+                self.__buffer.clear()
+            while self.__pending:
+                self.__pending.popleft().result()
+        finally:
+            self.__pool.shutdown()
+        if self.error is not None:
+            raise OffsiteUploadError(f"{self.key}: upload interrupted ({self.error!r}), resume from the local copy")
+        return complete(self.client, self.bucket, self.key, self.upload_id, self.parts, self.bytes_written,
+                        self.state_file)
+
+    def close_pool(self):
+        self.__pool.shutdown()
+
+    def abort(self):
+        # for when the archive itself failed, nothing worth keeping offsite, a failed upload keeps its state instead
+        self.closed = True
+        self.__pool.shutdown(cancel_futures=True)
+        if self.upload_id is not None:
+            try:
+                self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            except TRANSFER_ERRORS:
+                pass
+        if os.path.exists(self.state_file):
+            os.remove(self.state_file)
+
+
+def complete(client, bucket: str, key: str, upload_id: str, parts: dict, size: int, state_file: str) -> dict:
+    """
+    Completes a multipart upload and checks the object S3 assembled against the parts sent.
+    :param parts: part number -> {"etag", "md5", "size"}
+    :param size: bytes the object has to have
+    :return: dict of key, size, etag and parts
+    """
+    numbers = sorted(parts)
+    if numbers != list(range(1, len(numbers) + 1)):
+        raise OffsiteUploadError(f"{key}: parts {numbers} have gaps, resume the upload")
+    response = client.complete_multipart_upload(
+        Bucket=bucket, Key=key, UploadId=upload_id,
+        MultipartUpload={"Parts": [{"PartNumber": number, "ETag": parts[number]["etag"]} for number in numbers]}
+    )
+    expected = multipart_etag([bytes.fromhex(parts[number]["md5"]) for number in numbers])
+    head = client.head_object(Bucket=bucket, Key=key)
+    if response["ETag"] != expected or head["ContentLength"] != size:
+        raise OffsiteUploadError(
+            f"{key}: uploaded object ({response['ETag']}, {head['ContentLength']} bytes) "
+            f"does not match the archive ({expected}, {size} bytes)"
+        )
+    if os.path.exists(state_file):
+        os.remove(state_file)
+    return {"key": key, "size": size, "etag": response["ETag"], "parts": len(numbers)}
+
+
+def resume(client, file_name: str, workers: int = 4) -> dict:
+    """
+    Finishes an interrupted upload of file_name from its state file, re-sending only the parts S3 doesn't have.
+    :param client: boto3 s3 client
+    :param file_name: the local archive
+    :param workers: parts uploaded at once
+    :return: see complete()
+    """
+    state = json.loads(FileIO.read_as_string(upload_state_file(file_name)))
+    upload = MultipartUpload(
+        client, state["bucket"], state["key"], upload_state_file(file_name), state["part_size"], workers
+    )
+    upload.upload_id = state["upload_id"]
+    # S3's list of parts is the truth, the state file can be behind it by the parts in flight when it stopped
+    listed = {}
+    for page in client.get_paginator("list_parts").paginate(
+            Bucket=upload.bucket, Key=upload.key, UploadId=upload.upload_id
+    ):
+        for part in page.get("Parts", []):
+            listed[part["PartNumber"]] = part
+    size = os.path.getsize(file_name)
+    count = max(1, -(-size // upload.part_size))
+    missing = []
+    with open(file_name, "rb") as f:
+        for number in range(1, count + 1):
+            offset = (number - 1) * upload.part_size
+            known = state["parts"].get(str(number))
+            if known and number in listed and listed[number]["ETag"] == known["etag"] \
+                    and known["size"] == min(upload.part_size, size - offset):
+                upload.parts[number] = known
+                continue
+            missing.append(number)
+        with ThreadPoolExecutor(max_workers=upload.workers) as pool:
+            for number in missing:
+                f.seek((number - 1) * upload.part_size)
+                pool.submit(upload.upload_part, number, f.read(upload.part_size))
+    upload.close_pool()
+    if upload.error is not None:
+        raise OffsiteUploadError(f"{upload.key}: resume failed ({upload.error!r}), try again later")
+    return complete(client, upload.bucket, upload.key, upload.upload_id, upload.parts, size, upload.state_file)
+
+
+class S3Target:
+    """
+    Where archives are replicated to: bucket, key prefix and upload tuning.
+    The client is only created on first use, so configuring a target costs nothing until a backup runs.
+    """
+
+    def __init__(
+            self,
+            bucket: str,
+            prefix: str = "",
+            endpoint_url: str = None,
+            region: str = None,
+            part_size: int = DEFAULT_PART_SIZE,
+            workers: int = 4,
+            client=None
+    ):
+        self.bucket = str(bucket)
+        self.prefix = str(prefix or "").strip("/")
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.part_size = int(part_size)
+        self.workers = int(workers)
+        self.__client = client
+
+    @property
+    def client(self):
+        if self.__client is None:
+            self.__client = make_client(self.endpoint_url, self.region, max(16, self.workers * 2))
+        return self.__client
+
+    def key(self, file_name: str) -> str:
+        name = os.path.basename(str(file_name))
+        return f"{self.prefix}/{name}" if self.prefix else name
+
+    def start_upload(self, file_name: str) -> MultipartUpload:
+        # the returned upload is written to alongside the local archive, see archive.write_archive's mirror
+        return MultipartUpload(
+            self.client, self.bucket, self.key(file_name), upload_state_file(file_name), self.part_size, self.workers
+        ).start()
+
+    def upload_sidecars(self, file_name: str) -> list:
+        uploaded = []
+        for suffix in SIDECAR_SUFFIXES:
+            if os.path.exists(f"{file_name}{suffix}"):
+                with open(f"{file_name}{suffix}", "rb") as f:
+                    self.client.put_object(Bucket=self.bucket, Key=self.key(f"{file_name}{suffix}"), Body=f.read())
+                uploaded.append(self.key(f"{file_name}{suffix}"))
+        return uploaded
+
+    def upload_file(self, file_name: str) -> dict:
+        # an archive written before the target was configured, or one whose streamed upload broke off
+        if os.path.exists(upload_state_file(file_name)):
+            result = resume(self.client, file_name, self.workers)
+        else:
+            upload = self.start_upload(file_name)
+            with open(file_name, "rb") as f:
+                for block in iter(lambda: f.read(upload.part_size), b""):
+                    upload.write(block)
+            result = upload.close()
+        result["sidecars"] = self.upload_sidecars(file_name)
+        return result
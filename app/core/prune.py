@@ -0,0 +1,174 @@
+import os
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from app.core import anvil, nbt
+from app.core.FileIO import FileIO
+
+# region folders of a dimension whose chunks go with the terrain chunk of the same slot,
+# a regenerated chunk spawns its own entities and points of interest, the old ones would be duplicates
+COMPANIONS = ("entities", "poi")
+# 20 ticks a second, the game adds one per tick per player within range of the chunk
+TICKS_PER_SECOND = 20
+
+
+def inhabited_time(record):
+    # InhabitedTime of a chunk record, None if it can't be read (then the chunk is always kept)
+    try:
+        values = nbt.find_values(anvil.chunk_data(record), {"InhabitedTime"}, within={"Level"})
+    except (ValueError, OSError, EOFError, zlib.error):
+        return None
+    value = values.get("InhabitedTime")
+    return value if isinstance(value, int) else None
+
+
+def scan_region(file_name: str, threshold: int) -> dict:
+    """
+    Runs in a worker process, one terrain region file at a time.
+    :return: dict of size, chunks, unreadable (kept whatever they hold), and prune: slot -> header timestamp of
+        each chunk whose InhabitedTime is below threshold, the timestamp tells if it was saved again since
+    """
+    found = {"size": 0, "chunks": 0, "unreadable": 0, "prune": {}}
+    try:
+        region = anvil.RegionFile(file_name)
+    except OSError:
+        # deleted since the scan, the archiver will say so
+        return found
+    with region:
+        found["size"] = region.size
+        for slot in range(anvil.SLOTS):
+            record = region.chunk_record(slot)
+            if record is None:
+                continue
+            found["chunks"] += 1
+            inhabited = inhabited_time(record)
+            record.release()
+            if inhabited is None:
+                found["unreadable"] += 1
+            elif inhabited < threshold:
+                found["prune"][slot] = region.timestamps[slot]
+    return found
+
+
+def report_name(archive_name: str) -> str:
+    # per region report of an archive made with a pruner, next to it like the manifest
+    return f"{archive_name}.prune.json"
+
+
+def is_terrain(relative: str) -> bool:
+    # region/r.x.z.mca of any dimension, entities/ and poi/ are decided by their terrain region
+    parts = relative.split("/")
+    return len(parts) >= 2 and parts[-2] == "region" and parts[-1].endswith(".mca")
+
+
+class ChunkPruner:
+    """
+    Leaves chunks nobody spent time in out of a full archive: terrain chunks whose InhabitedTime is below
+    threshold ticks, with the entities and poi chunks at the same slot. The game generates them again from the
+    seed when they are next loaded, so only what was generated and never visited is lost.
+    prepare() reads every terrain region in parallel before archiving, prune() rebuilds a region file without those
+    chunks as the archiver reaches it. A chunk saved again in between, or one that can't be read, is always kept.
+    report holds bytes before and after per region file.
+    """
+
+    def __init__(self, threshold: int = 1, workers: int = None):
+        """
+        :param threshold: InhabitedTime in ticks a chunk needs to be kept, 1 only leaves out chunks never visited
+        :param workers: parsing processes, defaults to cpu count
+        """
+        if int(threshold) < 1:
+            raise ValueError("a threshold below 1 tick would never leave a chunk out")
+        self.threshold = int(threshold)
+        self.workers = max(1, int(workers) if workers else (os.cpu_count() or 1))
+        # absolute path -> {slot: header timestamp, None for entities and poi}
+        self.plan = {}
+        # relative path -> chunks, pruned, unreadable, bytes before and after
+        self.report = {}
+        self.seconds = 0.0
+        self.__source = None
+
+    def prepare(self, source: str, scan: dict = None) -> dict:
+        """
+        :param source: world directory
+        :param scan: FileIO.scan_tree of source, if the caller already has one
+        :return: the plan
+        """
+        started = time.monotonic()
+        self.__source = os.path.abspath(source)
+        if scan is None:
+            scan = FileIO.scan_tree(source) if os.path.isdir(source) else {}
+        terrain = [relative for relative, entry in scan.items() if not entry.is_dir and is_terrain(relative)]
+        paths = [os.path.join(self.__source, *relative.split("/")) for relative in terrain]
+        if self.workers > 1 and len(paths) > 1:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(paths))) as pool:
+                found = list(pool.map(scan_region, paths, [self.threshold] * len(paths), chunksize=4))
+        else:
+            found = [scan_region(path, self.threshold) for path in paths]
+        self.plan = {}
+        self.report = {}
+        for relative, path, each in zip(terrain, paths, found):
+            self.report[relative] = {
+                "chunks": each["chunks"], "pruned": 0, "unreadable": each["unreadable"],
+                "bytes_before": each["size"], "bytes_after": each["size"],
+            }
+            if not each["prune"]:
+                continue
+            self.plan[path] = each["prune"]
+            parts = relative.split("/")
+            for companion in COMPANIONS:
+                companion_relative = "/".join(parts[:-2] + [companion, parts[-1]])
+                if companion_relative in scan:
+                    self.plan[os.path.join(self.__source, *companion_relative.split("/"))] = dict.fromkeys(
+                        each["prune"]
+                    )
+        self.seconds = time.monotonic() - started
+        return self.plan
+
+    def prune(self, path: str):
+        """
+        Called by the archiver for every regular file.
+        :return: the bytes to archive in place of the file, None to archive it as it is
+        """
+        planned = self.plan.get(os.path.abspath(path))
+        if not planned:
+            return None
+        records = {}
+        pruned = 0
+        with anvil.RegionFile(path) as region:
+            timestamps = list(region.timestamps)
+            for slot in range(anvil.SLOTS):
+                record = region.chunk_record(slot)
+                if record is None:
+                    continue
+                expected = planned.get(slot, -1)
+                if slot in planned and (expected is None or expected == timestamps[slot]):
+                    pruned += 1
+                    timestamps[slot] = 0
+                else:
+                    records[slot] = bytes(record)
+                record.release()
+            size = region.size
+        data = b"".join(anvil.region_bytes(records, timestamps))
+        relative = os.path.relpath(os.path.abspath(path), self.__source).replace(os.sep, "/")
+        entry = self.report.setdefault(relative, {"chunks": len(records) + pruned, "unreadable": 0})
+        entry.update(pruned=pruned, bytes_before=size, bytes_after=len(data))
+        return data
+
+    def summary(self) -> dict:
+        # chunk counts are of terrain regions, bytes of every region rewritten, per region only the ones that shrank
+        terrain = [each for relative, each in self.report.items() if is_terrain(relative)]
+        before = sum(each["bytes_before"] for each in self.report.values())
+        after = sum(each["bytes_after"] for each in self.report.values())
+        return {
+            "threshold": self.threshold,
+            "regions": len(terrain),
+            "chunks": sum(each["chunks"] for each in terrain),
+            "pruned": sum(each["pruned"] for each in terrain),
+            "unreadable": sum(each["unreadable"] for each in terrain),
+            "bytes_before": before,
+            "bytes_after": after,
+            "bytes_saved": before - after,
+            "seconds": self.seconds,
+            "per_region": {relative: each for relative, each in self.report.items() if each["pruned"]},
+        }
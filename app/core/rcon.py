@@ -0,0 +1,205 @@
+import itertools
+import socket
+import struct
+import threading
+
+from app.core.Custom_Errors import RconAuthenticationException, RconException
+
+# Source RCON protocol, as implemented by the minecraft server (enable-rcon in server.properties)
+# https://developer.valvesoftware.com/wiki/Source_RCON_Protocol
+# packet: int32 length, int32 request id, int32 type, ascii body, two null bytes, all little endian
+SERVERDATA_AUTH = 3
+SERVERDATA_AUTH_RESPONSE = 2
+SERVERDATA_EXECCOMMAND = 2
+SERVERDATA_RESPONSE_VALUE = 0
+
+DEFAULT_PORT = 25575
+MAX_PACKET = 4096 + 14
+
+
+def encode_packet(request_id: int, packet_type: int, body: str) -> bytes:
+    payload = struct.pack("<ii", request_id, packet_type) + body.encode("utf-8") + b"\x00\x00"
+    return struct.pack("<i", len(payload)) + payload
+
+
+class RconClient:
+    """
+    One persistent, authenticated RCON connection.
+    commands() runs a whole batch over it, one command at a time: each packet is sent on its own once the previous
+    response is in, and a response ends at the reply to a sentinel packet sent after its first part arrived.
+    """
+
+    def __init__(self, host: str, port: int = DEFAULT_PORT, password: str = "", timeout: float = 5.0):
+        self.host = str(host)
+        self.port = int(port)
+        self.timeout = float(timeout)
+        self.__password = str(password)
+        self.__socket = None
+        self.__buffer = b""
+        self.__ids = itertools.count(1)
+        self.__lock = threading.Lock()
+
+    @property
+    def connected(self) -> bool:
+        return self.__socket is not None
+
+    def connect(self):
+        self.__socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.__buffer = b""
+        auth_id = self.__next_id()
+        self.__socket.sendall(encode_packet(auth_id, SERVERDATA_AUTH, self.__password))
+        while True:
+            request_id, packet_type, body = self.__read_packet()
+            # some servers send an empty response value ahead of the auth response
+            if packet_type != SERVERDATA_AUTH_RESPONSE:
+                continue
+            if request_id == -1:
+                self.close()
+                raise RconAuthenticationException(f"rcon authentication refused by {self.host}:{self.port}")
+            return
+
+    def close(self):
+        if self.__socket is not None:
+            try:
+                self.__socket.close()
+            finally:
+                self.__socket = None
+
+    def __next_id(self) -> int:
+        # ids stay positive, -1 is the server's auth failure marker
+        return next(self.__ids)
+
+    def __read_exact(self, size: int) -> bytes:
+        while len(self.__buffer) < size:
+            data = self.__socket.recv(max(MAX_PACKET, size - len(self.__buffer)))
+            if not data:
+                self.close()
+                raise RconException(f"rcon connection to {self.host}:{self.port} closed by server")
+            self.__buffer += data
+        data, self.__buffer = self.__buffer[:size], self.__buffer[size:]
+        return data
+
+    def __read_packet(self) -> (int, int, str):
+        length = struct.unpack("<i", self.__read_exact(4))[0]
+        if length < 10:
+            raise RconException(f"malformed rcon packet of length {length}")
+        payload = self.__read_exact(length)
+        request_id, packet_type = struct.unpack_from("<ii", payload)
+        return request_id, packet_type, payload[8:-2].decode("utf-8", errors="replace")
+
+    def commands(self, commands: list, timeout: float = None) -> list:
+        """
+        :param commands: console commands, without the leading slash
+        :param timeout: seconds to wait for each response when a command takes longer than the connection's timeout
+            (save-all flush on a large world), never less than that
+        :return: the server's response text for each command, in order
+        """
+        commands = [str(each) for each in commands]
+        if not commands:
+            return []
+        with self.__lock:
+            reused = self.__socket is not None
+            if not reused:
+                self.connect()
+            try:
+                return self.__run(commands, timeout)
+            except (OSError, RconException) as e:
+                # a kept connection can go stale (server restart), which shows before any response comes back.
+                # only then is the batch retried on a fresh connection, so no command runs twice. a timeout isn't
+                # staleness, the server got the command and may still be running it
+                if not reused or isinstance(e, (RconAuthenticationException, socket.timeout)) \
+                        or getattr(e, "answered", False):
+                    self.close()
+                    raise
+                self.close()
+                self.connect()
+                return self.__run(commands, timeout)
+
+    def __run(self, commands: list, timeout: float = None) -> list:
+        responses = []
+        answered = False
+        self.__socket.settimeout(max(float(timeout), self.timeout) if timeout else self.timeout)
+        try:
+            for command in commands:
+                responses.append(self.__exchange(command))
+                answered = True
+        except (OSError, RconException) as e:
+            e.answered = answered or getattr(e, "answered", False)
+            raise
+        finally:
+            if self.__socket is not None:
+                self.__socket.settimeout(self.timeout)
+        return responses
+
+    def __exchange(self, command: str) -> str:
+        # one packet per write: the server reads a single packet at a time and drops whatever else came along
+        request_id = self.__next_id()
+        self.__socket.sendall(encode_packet(request_id, SERVERDATA_EXECCOMMAND, command))
+        sentinel = None
+        parts = []
+        try:
+            while True:
+                reply_id, packet_type, body = self.__read_packet()
+                if reply_id == sentinel:
+                    return "".join(parts)
+                # long responses are split across several packets with the same id
+                if reply_id != request_id:
+                    continue
+                parts.append(body)
+                if sentinel is None:
+                    # an unknown request type gets a reply too, once the response before it is all out.
+                    # sent only now that the command has been answered, so the two never share a read
+                    sentinel = self.__next_id()
+                    self.__socket.sendall(encode_packet(sentinel, SERVERDATA_RESPONSE_VALUE, ""))
+        except (OSError, RconException) as e:
+            e.answered = sentinel is not None
+            raise
+
+    def command(self, command: str, timeout: float = None) -> str:
+        return self.commands([command], timeout)[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class RconPool:
+    """
+    Keeps one persistent connection per server, so repeated calls skip the connect and auth round trips.
+    """
+
+    def __init__(self, timeout: float = 5.0):
+        self.timeout = timeout
+        self.__clients = {}
+        self.__lock = threading.Lock()
+
+    def get(self, host: str, port: int = DEFAULT_PORT, password: str = "") -> RconClient:
+        key = (str(host), int(port), str(password))
+        with self.__lock:
+            if key not in self.__clients:
+                self.__clients[key] = RconClient(host, port, password, self.timeout)
+            return self.__clients[key]
+
+    def close_all(self):
+        with self.__lock:
+            for each in self.__clients.values():
+                each.close()
+            self.__clients.clear()
+
+
+# shared by everything in the process
+pool = RconPool()
+
+
+def parse_address(address: str, default_port: int = DEFAULT_PORT) -> (str, int):
+    # host, host:port, [v6]:port, or a bare v6 address
+    address = str(address)
+    if address.startswith("["):
+        host, _, port = address[1:].partition("]")
+        return host, int(port.lstrip(":") or default_port)
+    if address.count(":") == 1:
+        host, port = address.split(":")
+        return host, int(port)
+    return address, default_port
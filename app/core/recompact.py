@@ -0,0 +1,430 @@
+import datetime
+import hashlib
+import json
+import os
+import tarfile
+import time
+
+from app.core import archive, catalog, compression, prune, retention, snapshot as world_snapshot
+from app.core.FileIO import FileIO
+
+READ_SIZE = 4 * 1024 * 1024
+# an archive or merged snapshot is only rewritten once it is this old, fresh ones are the likeliest to be restored
+DEFAULT_MIN_AGE_DAYS = 7
+# where a rewrite is written until it replaces the original, not an archive suffix so nothing lists it
+TEMP_SUFFIX = ".recompact"
+STATE_FILE = ".recompacted.json"
+SNAPSHOT_FORMAT = "%Y-%m-%d-%H.%M.%S"
+
+
+def target_codec(codec: str = None, level: int = None) -> (str, int):
+    # the best ratio installed: zstd at its highest level, else gzip at 9
+    if codec is None:
+        codec = "zstd" if "zstd" in compression.available_codecs() else "gzip"
+    compression.check_codec(codec)
+    if codec == "none":
+        raise ValueError("recompacting to an uncompressed tar would only grow archives")
+    return codec, max(compression.CODECS[codec]["levels"]) if level is None else int(level)
+
+
+def fsync_dir(path: str):
+    # a rename is only durable once the directory holding it is
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+def stream_sha256(name: str, codec: str) -> str:
+    # sha256 of the uncompressed tar stream of an archive
+    stream_hash = hashlib.sha256()
+    with compression.open_reader(name, codec) as reader:
+        for data in iter(lambda: reader.read(READ_SIZE), b""):
+            stream_hash.update(data)
+    return stream_hash.hexdigest()
+
+
+def reencode(
+        archive_name: str, codec: str, level: int, workers: int = None,
+        block_size: int = compression.DEFAULT_BLOCK_SIZE, limiter=None, source: str = None
+) -> dict:
+    """
+    Rewrites an archive with another codec or level. The tar stream inside stays byte for byte the same,
+    so the member offsets of the sidecar index and the manifest's checksums still hold, only the blocks change.
+    The copy is written next to the original, read back and compared by the sha256 of its tar stream, and fsync'd
+    before it replaces anything: at every point either the original or the verified copy is in place.
+    When the codec changes so does the name, the original is left for the caller to remove.
+    :param limiter: optional TokenBucket the archive writes are charged against
+    :return: dict of name, replaced (the original), codec, level, bytes before and after, the new archive sha256,
+        and shrunk, False if the copy wasn't smaller and was thrown away
+    """
+    started = time.monotonic()
+    old_codec = compression.codec_from_name(archive_name)
+    new_name = archive_name[:-len(compression.archive_suffix(old_codec))] + compression.archive_suffix(codec)
+    temp_name = new_name + TEMP_SUFFIX
+    stat = os.stat(archive_name)
+    stream_hash = hashlib.sha256()
+    try:
+        with open(temp_name, "xb") as raw:
+            writer = archive.HashingWriter(raw, limiter)
+            with compression.open_reader(archive_name, old_codec) as reader, compression.BlockCompressor(
+                    writer, codec=codec, level=level, workers=workers, block_size=block_size
+            ) as stream:
+                for data in iter(lambda: reader.read(READ_SIZE), b""):
+                    stream_hash.update(data)
+                    stream.write(data)
+            raw.flush()
+            os.fsync(raw.fileno())
+        if stream_sha256(temp_name, codec) != stream_hash.hexdigest():
+            raise ValueError(f"recompacted copy of {archive_name} doesn't read back the same")
+        # same creation time as the original, retention goes by it
+        os.utime(temp_name, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+    result = {
+        "name": new_name, "replaced": archive_name, "codec": codec, "level": level, "before": stat.st_size,
+        "after": writer.bytes_written, "sha256": writer.hash.hexdigest(), "shrunk": writer.bytes_written < stat.st_size,
+    }
+    if not result["shrunk"]:
+        os.remove(temp_name)
+        result.update(name=archive_name, after=stat.st_size)
+        result["seconds"] = time.monotonic() - started
+        return result
+
+    member_index = archive.member_index_name(archive_name)
+    index = None
+    if os.path.exists(member_index):
+        with open(member_index) as f:
+            index = json.load(f)
+        index.update(archive=os.path.basename(new_name), codec=codec, blocks=stream.blocks)
+    if new_name == archive_name:
+        # between the rename and the new index, a restore reads the stream rather than blocks that aren't there
+        if index is not None:
+            os.remove(member_index)
+        # an offsite copy keeps the bytes it was uploaded with, a resumed upload would mix the two
+        if os.path.exists(f"{archive_name}.upload.json"):
+            os.remove(f"{archive_name}.upload.json")
+    else:
+        # sidecars that describe the content, not the bytes, go with the copy
+        for name_of in (archive.manifest_name, prune.report_name):
+            if os.path.exists(name_of(archive_name)):
+                with open(name_of(archive_name)) as source, FileIO.atomic_open(name_of(new_name)) as f:
+                    f.write(source.read())
+    os.replace(temp_name, new_name)
+    fsync_dir(new_name)
+    if index is not None:
+        with FileIO.atomic_open(archive.member_index_name(new_name)) as f:
+            json.dump(index, f)
+    result["seconds"] = time.monotonic() - started
+    return result
+
+
+class SnapshotFile:
+    """
+    Read-only file object over one file of a chunk store snapshot, for tarfile.addfile.
+    The chunks are hashed as they are read, check() compares them with the sha256 the snapshot recorded.
+    """
+
+    def __init__(self, store, entry: dict):
+        self.__store = store
+        self.__chunks = iter(entry["chunks"])
+        self.__buffer = bytearray()
+        self.sha256 = entry["sha256"]
+        self.hash = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self.__buffer) < size:
+            digest = next(self.__chunks, None)
+            if digest is None:
+                break
+            chunk = self.__store.get_chunk(digest)
+            self.hash.update(chunk)
+            self.__buffer += chunk
+        size = len(self.__buffer) if size < 0 else size
+        data = bytes(self.__buffer[:size])
+        del self.__buffer[:size]
+        return data
+
+    def check(self, name: str):
+        if self.hash.hexdigest() != self.sha256:
+            raise ValueError(f"checksum mismatch reading {name} from the chunk store")
+
+
+def snapshot_created(name: str) -> float:
+    # chunk store snapshot names are their UTC creation time
+    return datetime.datetime.strptime(name, SNAPSHOT_FORMAT).replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def synthesize(
+        store, name: str, archive_name: str, codec: str, level: int, workers: int = None,
+        block_size: int = compression.DEFAULT_BLOCK_SIZE, limiter=None, source: str = None
+) -> dict:
+    """
+    Writes a chunk store snapshot out as a full archive, the same tar, manifest and member index a full backup of
+    the world would have made at that time, without the world. Written under a temp name and renamed into place.
+    :param store: app.core.chunk_store.ChunkStore
+    :param name: snapshot name
+    :param archive_name: archive file to create, refuses to overwrite one
+    :param source: world directory the snapshot is of, used when it recorded a scratch copy instead
+    :return: the write_archive style result, for app.core.catalog.Catalog.record_archive
+    """
+    started = time.monotonic()
+    snapshot = store.load_snapshot(name)
+    created = snapshot_created(snapshot["name"])
+    world = snapshot["source"]
+    if world.endswith(world_snapshot.SCRATCH_SUFFIX):
+        # made with --snapshot-dir before the live world was recorded, the copy is long gone
+        if source is None:
+            raise ValueError(f"snapshot {name} recorded the scratch copy {world}, not a world directory")
+        world = os.path.abspath(source)
+    root = archive.normalize_arcname(world)
+    result = {
+        "name": archive_name, "members": [], "checksums": {}, "entries": {}, "root": root, "codec": codec,
+        "bytes_read": 0, "manifest": archive.manifest_name(archive_name),
+        "member_index": archive.member_index_name(archive_name), "source": world, "created": created,
+    }
+    # directories and files in one depth first order, like the scan a backup archives in
+    members = sorted(
+        [(each, None) for each in snapshot["dirs"]] + list(snapshot["files"].items()),
+        key=lambda item: item[0].split("/")
+    )
+    if os.path.exists(archive_name):
+        raise FileExistsError(archive_name)
+    temp_name = archive_name + TEMP_SUFFIX
+    try:
+        with open(temp_name, "xb") as raw:
+            writer = archive.HashingWriter(raw, limiter)
+            with compression.BlockCompressor(
+                    writer, codec=codec, level=level, workers=workers, block_size=block_size
+            ) as stream:
+                with tarfile.open(fileobj=stream, mode="w|") as tar:
+                    for relative, entry in [("", None)] + members:
+                        tarinfo = tarfile.TarInfo(f"{root}/{relative}" if relative else root)
+                        header_offset = tar.offset
+                        if entry is None:
+                            # the snapshot doesn't keep directory modes or times
+                            tarinfo.type, tarinfo.mode, tarinfo.mtime = tarfile.DIRTYPE, 0o755, created
+                            tar.addfile(tarinfo)
+                        else:
+                            tarinfo.size, tarinfo.mode, tarinfo.mtime = \
+                                entry["size"], entry["mode"], entry["mtime_ns"] / 1e9
+                            reader = SnapshotFile(store, entry)
+                            tar.addfile(tarinfo, reader)
+                            reader.check(relative)
+                            result["checksums"][tarinfo.name] = entry["sha256"]
+                            result["bytes_read"] += entry["size"]
+                        archive.index_member(tar, tarinfo, header_offset, result)
+                    result["members"] = tar.getmembers()
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.utime(temp_name, (created, created))
+        os.replace(temp_name, archive_name)
+        fsync_dir(archive_name)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+    archive.write_manifest(result["manifest"], result["checksums"])
+    archive.write_member_index(result["member_index"], result, stream.blocks)
+    result.update(archive_bytes=writer.bytes_written, archive_sha256=writer.hash.hexdigest())
+    result["seconds"] = time.monotonic() - started
+    return result
+
+
+class Recompactor:
+    """
+    Background pass over a backup directory, for archives kept for weeks rather than restored tomorrow:
+    archives older than min_age_days are re-encoded at a high ratio codec and level (see reencode), and each day's
+    run of aged incremental snapshots is merged into one synthetic full archive (see synthesize), after which
+    the snapshots and every chunk only they referenced are deleted.
+    The catalog and the archive index are updated as each archive is replaced, and what was done is kept in
+    save_dir/.recompacted.json so an archive is only rewritten once per codec and level.
+    Priority is the caller's, the recompact command lowers it to idle before starting.
+    """
+
+    def __init__(
+            self,
+            save_dir: str,
+            codec: str = None,
+            level: int = None,
+            workers: int = None,
+            min_age_days: float = DEFAULT_MIN_AGE_DAYS,
+            chunk_store=None,
+            limiter=None,
+            source: str = None
+    ):
+        """
+        :param save_dir: backup directory
+        :param codec: codec to recompact to, see target_codec
+        :param level: level for codec, its highest if None
+        :param workers: compression processes
+        :param min_age_days: only archives and snapshots older than this are touched
+        :param chunk_store: app.core.chunk_store.ChunkStore of save_dir whose snapshots are merged, None for none
+        :param limiter: optional TokenBucket every archive write is charged against
+        :param source: world directory of chunk_store, names merged archives whose snapshot recorded a scratch copy
+        """
+        self.save_dir = str(save_dir)
+        self.codec, self.level = target_codec(codec, level)
+        self.workers = workers
+        self.min_age = float(min_age_days) * 24 * 60 * 60
+        self.chunk_store = chunk_store
+        self.limiter = limiter
+        self.source = source
+        self.file_name = os.path.join(self.save_dir, STATE_FILE)
+        self.state = {"archives": {}, "reclaimed": 0}
+        if os.path.exists(self.file_name):
+            with open(self.file_name) as f:
+                self.state.update(json.load(f))
+
+    def clean_up(self) -> list:
+        # rewrites a crash cut short, the originals they were copies of are untouched
+        removed = []
+        for each in os.listdir(self.save_dir):
+            if each.endswith(TEMP_SUFFIX):
+                os.remove(os.path.join(self.save_dir, each))
+                removed.append(each)
+        return removed
+
+    def candidates(self, now: float = None) -> list:
+        # names of the aged archives not yet at the target codec and level, oldest first, by name on a tie
+        cutoff = (time.time() if now is None else now) - self.min_age
+        done = self.state["archives"]
+        index = retention.ArchiveIndex(self.save_dir)
+        return [
+            name for name, info in sorted(index.archives.items(), key=lambda item: (item[1]["created"], item[0]))
+            if info["created"] < cutoff
+            and (done.get(name, {}).get("codec"), done.get(name, {}).get("level")) != (self.codec, self.level)
+        ]
+
+    def incremental_runs(self, now: float = None) -> list:
+        # aged snapshots grouped by UTC day, the store's newest is never merged, the next incremental builds on it
+        if self.chunk_store is None:
+            return []
+        cutoff = (time.time() if now is None else now) - self.min_age
+        runs = {}
+        for name in self.chunk_store.snapshot_names()[:-1]:
+            try:
+                created = snapshot_created(name)
+            except ValueError:
+                # not one of ours, leave it alone
+                continue
+            if created < cutoff:
+                runs.setdefault(name[:10], []).append(name)
+        return [runs[day] for day in sorted(runs)]
+
+    def synthetic_name(self, snapshot: str) -> str:
+        # dated like the archive a full backup would have made then
+        created = datetime.datetime.strptime(snapshot, SNAPSHOT_FORMAT)
+        return FileIO.path_join(
+            self.save_dir, f"{created.strftime('%Y-%b-%d-%H.%M.%S')}.synthetic{compression.archive_suffix(self.codec)}"
+        )
+
+    def run(self, merge: bool = True, dry_run: bool = False, now: float = None) -> dict:
+        """
+        :param merge: also merge aged incremental snapshots into synthetic full archives
+        :param dry_run: only list what would be rewritten and merged
+        :return: dict of archives (one reencode result each), merged (snapshots, archive name, manifest bytes
+            deleted and archive bytes added), chunks_freed, reclaimed bytes (before minus after, merges included,
+            negative if the synthetic archives outweigh what the snapshots alone held) and seconds taken
+        """
+        started = time.monotonic()
+        report = {"archives": [], "merged": [], "chunks_freed": 0, "reclaimed": 0, "cleaned": []}
+        candidates = self.candidates(now)
+        runs = self.incremental_runs(now) if merge else []
+        if dry_run:
+            report.update(candidates=candidates, runs=runs, seconds=time.monotonic() - started)
+            return report
+        report["cleaned"] = self.clean_up()
+        for name in candidates:
+            result = self.recompact(name)
+            report["archives"].append(result)
+            report["reclaimed"] += result["before"] - result["after"]
+        if runs:
+            for snapshots in runs:
+                result = self.merge(snapshots)
+                report["merged"].append(result)
+                report["reclaimed"] += result["manifests"] - result["after"]
+            # one sweep for all the runs, chunks are shared between snapshots of different days
+            report["chunks_freed"] = self.chunk_store.collect_garbage()
+            report["reclaimed"] += report["chunks_freed"]
+        self.state["reclaimed"] += report["reclaimed"]
+        self.save()
+        report["seconds"] = time.monotonic() - started
+        return report
+
+    def recompact(self, name: str) -> dict:
+        result = reencode(
+            os.path.join(self.save_dir, name), self.codec, self.level, self.workers, limiter=self.limiter
+        )
+        new_name = os.path.basename(result["name"])
+        if result["shrunk"]:
+            index = retention.ArchiveIndex(self.save_dir)
+            self.update_catalog(name, result)
+            if new_name != name:
+                # the original and its sidecars, the copy is in place under its own name
+                index.remove(name)
+                self.state["archives"].pop(name, None)
+            index.record(new_name)
+        self.state["archives"][new_name] = {
+            "codec": self.codec, "level": self.level, "before": result["before"], "after": result["after"],
+            "at": time.time(),
+        }
+        self.save()
+        return result
+
+    def update_catalog(self, name: str, result: dict):
+        # same row under the new name, size and checksum, created stays what it was
+        if not os.path.exists(catalog.catalog_file(self.save_dir)):
+            return
+        with catalog.Catalog(catalog.catalog_file(self.save_dir)) as backup_catalog:
+            row = backup_catalog.get(name)
+            if row is None:
+                return
+            row.update(
+                name=os.path.basename(result["name"]), path=os.path.abspath(result["name"]), size=result["after"],
+                codec=result["codec"], checksum=result["sha256"],
+                ratio=result["after"] / row["bytes_read"] if row.get("bytes_read") else None
+            )
+            backup_catalog.record(**row)
+            if row["name"] != name:
+                backup_catalog.remove([name])
+
+    def merge(self, snapshots: list) -> dict:
+        # the newest of the run becomes a full archive, then every snapshot of the run goes
+        archive_name = self.synthetic_name(snapshots[-1])
+        done = self.state["archives"].get(os.path.basename(archive_name), {})
+        if done.get("merged") == snapshots and os.path.exists(archive_name):
+            # written by a run that stopped before deleting the snapshots
+            result = {"archive_bytes": os.path.getsize(archive_name), "seconds": 0.0}
+        else:
+            result = synthesize(
+                self.chunk_store, snapshots[-1], archive_name, self.codec, self.level, self.workers,
+                limiter=self.limiter, source=self.source
+            )
+            with catalog.Catalog(catalog.catalog_file(self.save_dir)) as backup_catalog:
+                backup_catalog.record_archive(result, source=result["source"], created=result["created"])
+            retention.ArchiveIndex(self.save_dir).record(os.path.basename(archive_name))
+            # recorded before any snapshot goes, so the archive is never lost track of
+            self.state["archives"][os.path.basename(archive_name)] = {
+                "codec": self.codec, "level": self.level, "merged": snapshots, "at": time.time()
+            }
+            self.save()
+        manifests = 0
+        for name in snapshots:
+            manifest = os.path.join(self.chunk_store.snapshot_dir, f"{name}.json")
+            if os.path.exists(manifest):
+                manifests += os.path.getsize(manifest)
+                self.chunk_store.delete_snapshot(name)
+        return {
+            "snapshots": snapshots, "name": archive_name, "manifests": manifests,
+            "after": result["archive_bytes"], "seconds": result["seconds"],
+        }
+
+    def save(self):
+        with FileIO.atomic_open(self.file_name, fsync=False) as f:
+            json.dump(self.state, f)
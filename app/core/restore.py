@@ -0,0 +1,251 @@
+import bisect
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+from fnmatch import fnmatch
+
+from app.core import archive
+from app.core import compression
+
+READ_SIZE = 1024 * 1024
+
+
+def load_member_index(archive_name: str) -> dict:
+    # None for archives written before the sidecar existed, those restore by reading the stream once
+    file_name = archive.member_index_name(archive_name)
+    if not os.path.exists(file_name):
+        return None
+    with open(file_name) as f:
+        return json.load(f)
+
+
+def relative_name(name: str, root: str) -> str:
+    # member path below the archived source directory, which is what patterns and restore targets are relative to
+    name = archive.normalize_arcname(name)
+    if root in ("", "."):
+        relative = name
+    elif name == root:
+        relative = ""
+    elif name.startswith(f"{root}/"):
+        relative = name[len(root) + 1:]
+    else:
+        relative = name
+    return relative[2:] if relative.startswith("./") else ("" if relative == "." else relative)
+
+
+def select(names: list, root: str, patterns: list = None) -> list:
+    # names whose relative path matches any glob, a directory pattern takes everything below it too
+    selected = []
+    for name in names:
+        relative = relative_name(name, root)
+        if not patterns or any(fnmatch(relative, each) or fnmatch(relative, f"{each.rstrip('/')}/*")
+                               for each in patterns):
+            selected.append(name)
+    return selected
+
+
+def target_path(target: str, relative: str) -> str:
+    # refuses anything that would land outside target, archives are data, not instructions
+    parts = [each for each in relative.split("/") if each not in ("", ".")]
+    if any(each == ".." for each in parts) or os.path.isabs(relative):
+        raise ValueError(f"refusing to restore outside the target: {relative}")
+    return os.path.join(target, *parts)
+
+
+class BlockReader:
+    """
+    Random access to the uncompressed tar stream of a block compressed archive.
+    Only the blocks overlapping a requested range are read and decompressed, the last one is kept for the next read
+    since members are usually restored in archive order.
+    """
+
+    def __init__(self, archive_name: str, codec: str, blocks: list):
+        self.codec = codec
+        self.starts = [each[0] for each in blocks]
+        self.offsets = [each[1] for each in blocks] + [os.path.getsize(archive_name)]
+        self.__file = open(archive_name, "rb")
+        self.__cached = (None, b"")
+
+    def __block(self, number: int) -> bytes:
+        if self.__cached[0] != number:
+            self.__file.seek(self.offsets[number])
+            compressed = self.__file.read(self.offsets[number + 1] - self.offsets[number])
+            self.__cached = (number, compression.decompress_block(self.codec, compressed))
+        return self.__cached[1]
+
+    def read(self, offset: int, size: int):
+        # yields the bytes of [offset, offset + size) block by block
+        number = bisect.bisect_right(self.starts, offset) - 1
+        while size > 0:
+            data = self.__block(number)
+            start = offset - self.starts[number]
+            piece = memoryview(data)[start:start + size]
+            if not piece:
+                raise ValueError(f"archive ends before offset {offset}")
+            yield piece
+            offset += len(piece)
+            size -= len(piece)
+            number += 1
+
+    def close(self):
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def check_parents(target: str, path: str, links: set):
+    # refuses a path below a symlink this restore created, writing there would land wherever the link points
+    parent = os.path.dirname(path)
+    while len(parent) > len(target):
+        if parent in links:
+            raise ValueError(f"refusing to restore through a symlink: {path}")
+        parent = os.path.dirname(parent)
+
+
+def _restore_entry(entry: dict, path: str, chunks=(), restored: dict = None, source: str = None) -> int:
+    """
+    Writes one member from its index entry.
+    :param restored: paths this restore has written so far, under "files" and "links" (symlinks), updated here
+    :param source: for a hard link, the path of the file it links to, already restored by this run
+    :return: the bytes written
+    """
+    restored = restored if restored is not None else {"files": set(), "links": set()}
+    kind = entry["type"]
+    if kind == tarfile.DIRTYPE.decode():
+        if path in restored["links"]:
+            raise ValueError(f"refusing to restore through a symlink: {path}")
+        os.makedirs(path, exist_ok=True)
+        return 0
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # whatever is there goes first, a file is never written through a link left at its path
+    if os.path.islink(path) or (os.path.lexists(path) and not os.path.isdir(path)):
+        os.remove(path)
+    restored["files"].discard(path)
+    restored["links"].discard(path)
+    if kind == tarfile.SYMTYPE.decode():
+        os.symlink(entry["linkname"], path)
+        restored["links"].add(path)
+        return 0
+    if kind == tarfile.LNKTYPE.decode():
+        if source not in restored["files"]:
+            raise ValueError(f"hard link {path} to {source}, which wasn't restored")
+        try:
+            os.link(source, path, follow_symlinks=False)
+        except OSError:
+            # a filesystem without hard links gets a copy
+            shutil.copy2(source, path, follow_symlinks=False)
+        restored["files"].add(path)
+        return 0
+    file_hash = hashlib.sha256()
+    written = 0
+    with open(path, "xb") as f:
+        for chunk in chunks:
+            file_hash.update(chunk)
+            f.write(chunk)
+            written += len(chunk)
+    if entry.get("sha256") and file_hash.hexdigest() != entry["sha256"]:
+        raise ValueError(f"checksum mismatch restoring {path}")
+    os.chmod(path, entry["mode"])
+    os.utime(path, (entry["mtime"], entry["mtime"]))
+    restored["files"].add(path)
+    return written
+
+
+def extract(archive_name: str, target: str, patterns: list = None) -> dict:
+    """
+    Restores members of an archive, paths relative to the archived source directory.
+    With a member index and a block codec only the blocks holding the selected files are decompressed,
+    otherwise the stream is read once up to the last selected member.
+    :param archive_name: archive file
+    :param target: directory the archived source directory's contents are restored into
+    :param patterns: optional fnmatch globs on the relative path, everything if unset
+    :return: dict of files restored, bytes written, and whether the index gave random access
+    """
+    index = load_member_index(archive_name)
+    stats = {"files": 0, "bytes": 0, "random_access": False}
+    if index is None or not index["blocks"]:
+        return _extract_stream(archive_name, target, patterns, index, stats)
+
+    stats["random_access"] = True
+    entries = index["entries"]
+    restored = {"files": set(), "links": set()}
+    with BlockReader(archive_name, index["codec"], index["blocks"]) as reader:
+        for name in select(list(entries), index["root"], patterns):
+            entry = entries[name]
+            path = target_path(target, relative_name(name, index["root"]))
+            check_parents(target, path, restored["links"])
+            source = None
+            if entry["type"] == tarfile.LNKTYPE.decode():
+                source = target_path(target, relative_name(entry["linkname"], index["root"]))
+                linked = entries.get(entry["linkname"])
+                if source not in restored["files"] and linked is not None and linked["type"] != entry["type"]:
+                    # the file it links to wasn't selected, its data is restored here instead
+                    entry = dict(linked, mode=entry["mode"], mtime=entry["mtime"])
+            chunks = reader.read(entry["offset_data"], entry["size"]) if entry["size"] else ()
+            stats["bytes"] += _restore_entry(entry, path, chunks, restored, source)
+            stats["files"] += entry["type"] != tarfile.DIRTYPE.decode()
+    return stats
+
+
+def _extract_stream(archive_name: str, target: str, patterns: list, index: dict, stats: dict) -> dict:
+    # single stream archives (tarfile's own gzip) can't seek, read forward and stop after the last wanted member
+    remaining = None
+    if index is not None:
+        remaining = set(select(list(index["entries"]), index["root"], patterns))
+    root = index["root"] if index is not None else None
+    restored = {"files": set(), "links": set()}
+    with tarfile.open(archive_name, "r|*") as stream:
+        for member in stream:
+            if root is None:
+                # no index, the first member is the archived source directory
+                root = archive.normalize_arcname(member.name)
+            if remaining is not None and not remaining:
+                break
+            if not select([member.name], root, patterns):
+                continue
+            if remaining is not None:
+                remaining.discard(member.name)
+            if not (member.isreg() or member.isdir() or member.issym() or member.islnk()):
+                continue
+            entry = {
+                "type": member.type.decode(), "mode": member.mode, "mtime": member.mtime,
+                "linkname": member.linkname, "sha256": None
+            }
+            if index is not None and member.name in index["entries"]:
+                entry["sha256"] = index["entries"][member.name]["sha256"]
+            path = target_path(target, relative_name(member.name, root))
+            check_parents(target, path, restored["links"])
+            chunks = ()
+            source = None
+            if member.isreg():
+                fileobj = stream.extractfile(member)
+                chunks = iter(lambda: fileobj.read(READ_SIZE), b"")
+            elif member.islnk():
+                source = target_path(target, relative_name(member.linkname, root))
+                if source not in restored["files"]:
+                    # the file it links to came earlier in the stream but wasn't selected, read it once more
+                    stats["bytes"] += _restore_linked(archive_name, member, entry, path, restored)
+                    stats["files"] += 1
+                    continue
+            stats["bytes"] += _restore_entry(entry, path, chunks, restored, source)
+            stats["files"] += not member.isdir()
+    return stats
+
+
+def _restore_linked(archive_name: str, member: tarfile.TarInfo, entry: dict, path: str, restored: dict) -> int:
+    # a hard link restored as a file of its own, from a second pass over the archive up to the file it links to
+    with tarfile.open(archive_name, "r|*") as stream:
+        for each in stream:
+            if each.name == member.linkname and each.isreg():
+                fileobj = stream.extractfile(each)
+                return _restore_entry(
+                    dict(entry, type=tarfile.REGTYPE.decode(), sha256=None), path,
+                    iter(lambda: fileobj.read(READ_SIZE), b""), restored
+                )
+    raise ValueError(f"hard link {member.name} to {member.linkname}, which isn't in {archive_name}")
@@ -0,0 +1,173 @@
+import datetime
+import json
+import os
+
+from app.core import compression
+from app.core.FileIO import FileIO
+
+# grandfather-father-son: the newest archive of each of the last N hours/days/weeks/months is kept
+PERIODS = {
+    "hourly": "%Y-%m-%d-%H",
+    "daily": "%Y-%m-%d",
+    "weekly": "%G-W%V",
+    "monthly": "%Y-%m",
+}
+INDEX_FILE = ".archive_index.json"
+# files that belong to an archive and go with it, see app.core.archive.manifest_name, member_index_name,
+# app.core.offsite.upload_state_file and app.core.prune.report_name
+SIDECARS = [".sha256", ".idx", ".upload.json", ".prune.json"]
+
+
+def is_archive(file_name: str) -> bool:
+    return any(str(file_name).endswith(info["suffix"]) for info in compression.CODECS.values())
+
+
+class ArchiveIndex:
+    """
+    Name, size and creation time of every archive in a backup directory, kept in save_dir/.archive_index.json.
+    A refresh only lists the directory, stat is only called for archives the index hasn't seen yet.
+    """
+
+    def __init__(self, save_dir: str):
+        self.save_dir = str(save_dir)
+        self.file_name = os.path.join(self.save_dir, INDEX_FILE)
+        self.archives = {}
+        if os.path.exists(self.file_name):
+            with open(self.file_name) as f:
+                self.archives = json.load(f)["archives"]
+        self.refresh()
+
+    def refresh(self):
+        names = {each for each in os.listdir(self.save_dir) if is_archive(each)}
+        if names == set(self.archives):
+            return
+        for name in names - set(self.archives):
+            stat = os.stat(os.path.join(self.save_dir, name))
+            self.archives[name] = {"size": stat.st_size, "created": stat.st_mtime}
+        for name in set(self.archives) - names:
+            # deleted by hand since the last run
+            del self.archives[name]
+        self.save()
+
+    def save(self):
+        with FileIO.atomic_open(self.file_name) as f:
+            json.dump({"archives": self.archives}, f)
+
+    def record(self, name: str):
+        stat = os.stat(os.path.join(self.save_dir, name))
+        self.archives[name] = {"size": stat.st_size, "created": stat.st_mtime}
+        self.save()
+
+    def remove(self, name: str) -> int:
+        # deletes the archive and its sidecar files, returns the bytes freed
+        freed = 0
+        for each in [name] + [f"{name}{suffix}" for suffix in SIDECARS]:
+            path = os.path.join(self.save_dir, each)
+            if os.path.exists(path):
+                freed += os.path.getsize(path)
+                os.remove(path)
+        self.archives.pop(name, None)
+        self.save()
+        return freed
+
+    def total_size(self) -> int:
+        return sum(each["size"] for each in self.archives.values())
+
+
+def select_keep(created: dict, policy: dict) -> set:
+    """
+    :param created: name -> creation time (epoch seconds)
+    :param policy: counts per PERIODS key, e.g. {"hourly": 24, "daily": 7}, plus optional "last" (newest N)
+    :return: names the policy keeps
+    """
+    newest_first = sorted(created, key=lambda name: created[name], reverse=True)
+    keep = set(newest_first[:max(1, int(policy.get("last") or 1))])
+    for period, time_format in PERIODS.items():
+        count = int(policy.get(period) or 0)
+        buckets = set()
+        for name in newest_first:
+            if len(buckets) >= count:
+                break
+            bucket = datetime.datetime.fromtimestamp(created[name]).strftime(time_format)
+            if bucket not in buckets:
+                # the first (newest) archive seen in each period represents it
+                buckets.add(bucket)
+                keep.add(name)
+    return keep
+
+
+def has_counts(policy: dict) -> bool:
+    # a count for any period, or the newest N, rather than a size budget only
+    return any(policy.get(each) for each in list(PERIODS) + ["last"])
+
+
+def has_policy(policy: dict) -> bool:
+    return has_counts(policy) or bool(policy.get("max_bytes"))
+
+
+def prune(index: ArchiveIndex, policy: dict, dry_run: bool = False, other_bytes: int = 0) -> dict:
+    """
+    Applies a GFS policy, then the max_bytes size budget (oldest first, the newest archive always stays).
+    :param other_bytes: what the chunk and region stores hold, counted against max_bytes along with the archives
+    :return: dict of deleted names and bytes freed
+    """
+    created = {name: info["created"] for name, info in index.archives.items()}
+    keep = select_keep(created, policy) if has_counts(policy) else set(created)
+    delete = [name for name in sorted(created, key=created.get) if name not in keep]
+
+    budget = policy.get("max_bytes")
+    if budget:
+        kept = sorted(keep, key=created.get)
+        total = sum(index.archives[name]["size"] for name in kept) + other_bytes
+        while total > budget and len(kept) > 1:
+            oldest = kept.pop(0)
+            total -= index.archives[oldest]["size"]
+            delete.append(oldest)
+
+    result = {"deleted": delete, "freed": 0}
+    if not dry_run:
+        for name in delete:
+            result["freed"] += index.remove(name)
+    return result
+
+
+def make_room(index: ArchiveIndex, needed: int, dry_run: bool = False) -> dict:
+    """
+    Deletes archives oldest first until needed bytes are freed, the newest archive always stays.
+    For when the next backup wouldn't fit otherwise, whatever the policy would keep.
+    :return: dict of deleted names and bytes freed, which can fall short of needed
+    """
+    created = {name: info["created"] for name, info in index.archives.items()}
+    oldest_first = sorted(created, key=created.get)[:-1]
+    result = {"deleted": [], "freed": 0}
+    for name in oldest_first:
+        if result["freed"] >= needed:
+            break
+        result["deleted"].append(name)
+        result["freed"] += index.remove(name) if not dry_run else index.archives[name]["size"]
+    return result
+
+
+def prune_snapshots(names: list, delete, policy: dict, parse_format: str = "%Y-%m-%d-%H.%M.%S") -> list:
+    """
+    GFS for chunk store / region store snapshots, whose names are their UTC creation time.
+    :param names: snapshot names
+    :param delete: callable removing one snapshot by name, the store's delete_snapshot
+    :return: names deleted
+    """
+    created = {}
+    for name in names:
+        try:
+            created[name] = datetime.datetime.strptime(name, parse_format).replace(
+                tzinfo=datetime.timezone.utc
+            ).timestamp()
+        except ValueError:
+            # not one of ours, leave it alone
+            continue
+    if not has_counts(policy):
+        return []
+    keep = select_keep(created, policy)
+    deleted = [name for name in sorted(created, key=created.get) if name not in keep]
+    for name in deleted:
+        delete(name)
+    return deleted
@@ -0,0 +1,95 @@
+import shlex
+import subprocess
+import time
+
+from app.core import rcon
+
+# server side path of the named pipe the container's console reads from
+CONSOLE_FIFO = "/tmp/server_stdin.fifo"
+FLUSH_CONFIRMATION = "Saved the game"
+
+
+class FifoControl:
+    """
+    Fallback backend: writes console lines into the container's stdin fifo through docker exec.
+    Nothing comes back, responses are empty strings, but a whole batch still costs a single process spawn.
+    """
+
+    def __init__(self, container: str):
+        self.container = str(container)
+
+    def commands(self, commands: list) -> list:
+        commands = [str(each).lstrip("/") for each in commands]
+        if not commands:
+            return []
+        # printf writes every line in one go, the list form of subprocess means no host shell quoting to get wrong
+        script = f"printf '%s\\n' {' '.join(shlex.quote(each) for each in commands)} > {CONSOLE_FIFO}"
+        subprocess.run(["docker", "exec", "-i", self.container, "/bin/bash", "-c", script], stdout=subprocess.PIPE)
+        return [""] * len(commands)
+
+    def command(self, command: str) -> str:
+        return self.commands([command])[0]
+
+    def say(self, message: str):
+        self.commands([f"say {each}" for each in str(message).split("\n") if each.strip()])
+
+    def save_flush(self, timeout: float = 60.0) -> float:
+        # the fifo can't answer, so the confirmation is read back from the container log
+        since = time.time()
+        self.command("save-all flush")
+        if timeout <= 0:
+            return 0.0
+        while time.time() - since < timeout:
+            logs = subprocess.run(
+                ["docker", "logs", "--since", f"{since:.3f}", self.container],
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+            ).stdout.decode("utf-8", errors="replace")
+            if FLUSH_CONFIRMATION in logs:
+                return time.time() - since
+            time.sleep(0.5)
+        raise TimeoutError(f"{self.container} did not confirm save-all flush within {timeout} seconds")
+
+
+class RconControl:
+    """
+    Talks to the server over a pooled, persistent RCON connection, a batch goes out over it command by command.
+    """
+
+    def __init__(self, host: str, port: int = rcon.DEFAULT_PORT, password: str = ""):
+        self.client = rcon.pool.get(host, port, password)
+
+    def commands(self, commands: list, timeout: float = None) -> list:
+        return self.client.commands([str(each).lstrip("/") for each in commands], timeout)
+
+    def command(self, command: str, timeout: float = None) -> str:
+        return self.commands([command], timeout)[0]
+
+    def say(self, message: str):
+        self.commands([f"say {each}" for each in str(message).split("\n") if each.strip()])
+
+    def save_flush(self, timeout: float = 60.0) -> float:
+        # the response only comes back once the save is done, so the answer itself is the confirmation
+        start = time.monotonic()
+        # a large world takes longer to save than the pool's socket timeout, the reply is waited for up to timeout
+        response = self.command("save-all flush", timeout if timeout > 0 else None)
+        if timeout > 0 and FLUSH_CONFIRMATION not in response:
+            raise TimeoutError(f"save-all flush was not confirmed: {response}")
+        return time.monotonic() - start
+
+
+# container name -> backend, anything not configured uses the fifo
+_backends = {}
+
+
+def configure(container: str, rcon_address: str = None, password: str = ""):
+    if rcon_address:
+        host, port = rcon.parse_address(rcon_address)
+        _backends[str(container)] = RconControl(host, port, password)
+    else:
+        _backends[str(container)] = FifoControl(container)
+
+
+def get_control(container: str):
+    if str(container) not in _backends:
+        _backends[str(container)] = FifoControl(container)
+    return _backends[str(container)]
@@ -0,0 +1,215 @@
+import asyncio
+import json
+import re
+import struct
+import time
+
+from app.core.rcon import parse_address
+
+# Server List Ping, what the multiplayer screen uses: https://minecraft.wiki/w/Java_Edition_protocol/Server_List_Ping
+# packet: VarInt length, VarInt packet id, payload. handshake (id 0, next state 1), status request (id 0, empty),
+# the server answers id 0 with a json string, then echoes a ping (id 1, int64) to measure latency.
+# servers before 1.7 only speak the legacy ping: 0xFE 0x01, answered by a 0xFF kick packet in UTF-16BE.
+DEFAULT_PORT = 25565
+# -1 asks the server for its own version rather than claiming one
+PROTOCOL_VERSION = -1
+MAX_RESPONSE = 1024 * 1024
+FORMATTING = re.compile("§.")
+# the status is whatever json the other end sent, any of these means it wasn't the shape a server answers with
+MALFORMED = (ValueError, TypeError, AttributeError, KeyError, IndexError, RecursionError, UnicodeDecodeError)
+
+
+def encode_varint(value: int) -> bytes:
+    value &= 0xFFFFFFFF
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def decode_varint(data: bytes, position: int = 0) -> (int, int):
+    # returns the signed value and the position after it
+    result = 0
+    for shift in range(0, 35, 7):
+        if position >= len(data):
+            raise ValueError("truncated VarInt")
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return (result - (1 << 32) if result & 0x80000000 else result), position
+    raise ValueError("VarInt longer than 5 bytes")
+
+
+def encode_string(value: str) -> bytes:
+    data = value.encode("utf-8")
+    return encode_varint(len(data)) + data
+
+
+def encode_packet(packet_id: int, payload: bytes = b"") -> bytes:
+    body = encode_varint(packet_id) + payload
+    return encode_varint(len(body)) + body
+
+
+async def read_packet(reader: asyncio.StreamReader) -> (int, bytes):
+    # (packet id, payload)
+    length_bytes = b""
+    while True:
+        byte = await reader.readexactly(1)
+        length_bytes += byte
+        if not byte[0] & 0x80:
+            break
+        if len(length_bytes) >= 5:
+            raise ValueError("VarInt longer than 5 bytes")
+    length, _ = decode_varint(length_bytes)
+    if not 0 < length <= MAX_RESPONSE:
+        raise ValueError(f"bad packet length {length}")
+    body = await reader.readexactly(length)
+    packet_id, position = decode_varint(body)
+    return packet_id, body[position:]
+
+
+def flatten_component(component) -> str:
+    # chat component (string, list, or {"text", "extra"}) down to its plain text
+    if isinstance(component, str):
+        return component
+    if isinstance(component, list):
+        return "".join(flatten_component(each) for each in component)
+    if isinstance(component, dict):
+        return str(component.get("text", "")) + "".join(flatten_component(each) for each in component.get("extra", []))
+    return ""
+
+
+def status_dict(host: str, port: int, ip: str, info: dict, latency: float, legacy: bool) -> dict:
+    # the dict shape api.mcsrvstat.us/2 returns, so get_status callers don't care where it came from
+    raw = flatten_component(info.get("description", ""))
+    lines = raw.split("\n")
+    players = info.get("players", {})
+    status = {
+        "online": True,
+        "ip": ip,
+        "port": port,
+        "hostname": host,
+        "debug": {
+            "ping": True, "query": False, "srv": False, "legacy": legacy, "cachetime": 0, "apiversion": 2,
+            "latency": round(latency * 1000, 2)
+        },
+        "motd": {"raw": lines, "clean": [FORMATTING.sub("", each).strip() for each in lines]},
+        "players": {"online": int(players.get("online", 0)), "max": int(players.get("max", 0))},
+        "version": info.get("version", {}).get("name", ""),
+        "protocol": info.get("version", {}).get("protocol"),
+    }
+    sample = [each.get("name") for each in players.get("sample", []) if isinstance(each, dict)]
+    if sample:
+        status["players"]["list"] = sample
+    if info.get("favicon"):
+        status["icon"] = info["favicon"]
+    return status
+
+
+def offline_dict(host: str, port: int, error: Exception) -> dict:
+    return {
+        "online": False,
+        "ip": host,
+        "port": port,
+        "hostname": host,
+        "debug": {"ping": False, "query": False, "srv": False, "cachetime": 0, "apiversion": 2, "error": repr(error)},
+    }
+
+
+async def _close(writer: asyncio.StreamWriter):
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+
+
+async def status(host: str, port: int = DEFAULT_PORT) -> (dict, float, str):
+    # modern ping: (status json, latency seconds, peer ip)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        handshake = encode_varint(PROTOCOL_VERSION) + encode_string(host) + struct.pack(">H", port) + encode_varint(1)
+        # handshake and status request go out together, one round trip
+        writer.write(encode_packet(0, handshake) + encode_packet(0))
+        await writer.drain()
+        packet_id, payload = await read_packet(reader)
+        if packet_id != 0:
+            raise ValueError(f"unexpected packet {packet_id} in place of the status response")
+        length, position = decode_varint(payload)
+        info = json.loads(payload[position:position + length].decode("utf-8"))
+
+        sent = time.monotonic()
+        token = struct.pack(">q", int(time.time() * 1000))
+        writer.write(encode_packet(1, token))
+        await writer.drain()
+        packet_id, payload = await read_packet(reader)
+        latency = time.monotonic() - sent
+        if packet_id != 1 or payload != token:
+            raise ValueError("bad pong")
+        return info, latency, writer.get_extra_info("peername")[0]
+    finally:
+        await _close(writer)
+
+
+async def legacy_status(host: str, port: int = DEFAULT_PORT) -> (dict, float, str):
+    # 1.4 - 1.6 answer "§1\0protocol\0version\0motd\0online\0max", older ones "motd§online§max"
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        sent = time.monotonic()
+        writer.write(b"\xfe\x01")
+        await writer.drain()
+        header = await reader.readexactly(3)
+        latency = time.monotonic() - sent
+        if header[0] != 0xFF:
+            raise ValueError("not a legacy ping response")
+        text = (await reader.readexactly(struct.unpack(">H", header[1:])[0] * 2)).decode("utf-16-be")
+        if text.startswith("§1\x00"):
+            _, protocol, version, motd, online, maximum = text.split("\x00")[:6]
+            info = {"version": {"name": version, "protocol": int(protocol)}}
+        else:
+            motd, online, maximum = text.rsplit("§", 2)
+            info = {"version": {"name": "", "protocol": None}}
+        info["description"] = motd
+        info["players"] = {"online": int(online), "max": int(maximum)}
+        return info, latency, writer.get_extra_info("peername")[0]
+    finally:
+        await _close(writer)
+
+
+async def ping(address: str, timeout: float = 3.0) -> dict:
+    """
+    :param address: host, host:port or [v6]:port, port 25565 if unset
+    :param timeout: seconds for the whole exchange with this host, legacy fallback included
+    :return: mcsrvstat shaped status dict, online False (with the error under debug) if the host didn't answer
+    """
+    host, port = parse_address(address, DEFAULT_PORT)
+
+    async def exchange():
+        try:
+            return await status(host, port), False
+        except (ValueError, asyncio.IncompleteReadError, UnicodeDecodeError):
+            # spoke, but not the modern protocol, a pre 1.7 server
+            return await legacy_status(host, port), True
+
+    try:
+        (info, latency, ip), legacy = await asyncio.wait_for(exchange(), timeout)
+        return status_dict(host, port, ip, info, latency, legacy)
+    except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) + MALFORMED as e:
+        return offline_dict(host, port, e)
+
+
+async def ping_many(addresses: list, timeout: float = 3.0, concurrency: int = 256) -> dict:
+    # address -> status dict, every host pinged at once (up to concurrency sockets), each with its own timeout
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one(address: str):
+        async with limit:
+            return address, await ping(address, timeout)
+
+    return dict(await asyncio.gather(*(one(each) for each in addresses)))
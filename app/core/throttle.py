@@ -0,0 +1,220 @@
+import ctypes
+import os
+import platform
+import re
+import sys
+import threading
+import time
+
+IONICE_CLASSES = {"realtime": 1, "best-effort": 2, "idle": 3}
+# python has no wrapper for ioprio_set, these are its syscall numbers
+IOPRIO_SET = {"x86_64": 251, "aarch64": 30, "i686": 289, "armv7l": 314}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+# paper/spigot "tps": "TPS from last 1m, 5m, 15m: *20.0, 19.8, 19.9", vanilla "tick query": "...per tick: 12.3ms"
+TPS_PATTERN = re.compile(r"TPS from last [^:]*:\s*\*?([\d.]+)")
+MSPT_PATTERN = re.compile(r"Average time per tick:\s*([\d.]+)\s*ms")
+COLOR_CODE = re.compile("\u00a7.")
+TARGET_TPS = 20.0
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket, one token per byte.
+    Shared between every backup in the process, so the limit holds for all of them together.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        """
+        :param rate: tokens (bytes) added per second, 0 or None for unlimited
+        :param capacity: burst size, defaults to one second worth of rate
+        """
+        self.rate = float(rate or 0)
+        self.capacity = float(capacity or self.rate)
+        self.__burst = capacity
+        self.__tokens = self.capacity
+        self.__updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def consume(self, amount: int) -> float:
+        # blocks until amount tokens are available, returns the seconds spent waiting
+        if self.rate <= 0 or amount <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.__tokens = min(self.capacity, self.__tokens + (now - self.__updated) * self.rate)
+                self.__updated = now
+                # requests bigger than the bucket go through once it is full, and leave it in debt
+                if self.__tokens >= min(amount, self.capacity):
+                    self.__tokens -= amount
+                    return waited
+                delay = (min(amount, self.capacity) - self.__tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def set_rate(self, rate: float):
+        # takes effect for the next consume, tokens already in the bucket are kept up to the new capacity
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self.capacity, self.__tokens + (now - self.__updated) * self.rate)
+            self.__updated = now
+            self.rate = float(rate or 0)
+            self.capacity = float(self.__burst or self.rate)
+            self.__tokens = min(self.__tokens, self.capacity)
+
+
+def set_io_priority(io_class: str, level: int = 4) -> bool:
+    """
+    ioprio_set for the calling thread and whatever it starts from now on, the ionice command without the command.
+    :param io_class: one of IONICE_CLASSES, realtime needs root
+    :param level: 0 (highest) to 7 within the class, idle has none
+    :return: False where it isn't supported (not linux, unknown architecture) or the kernel refused
+    """
+    if io_class not in IONICE_CLASSES:
+        raise ValueError(f"unknown io class: {io_class}, expected one of {', '.join(IONICE_CLASSES)}")
+    number = IOPRIO_SET.get(platform.machine())
+    if not sys.platform.startswith("linux") or number is None:
+        return False
+    value = (IONICE_CLASSES[io_class] << IOPRIO_CLASS_SHIFT) | (0 if io_class == "idle" else int(level))
+    return ctypes.CDLL(None, use_errno=True).syscall(number, IOPRIO_WHO_PROCESS, 0, value) == 0
+
+
+def lower_priority(nice: int = 0, io_class: str = None) -> dict:
+    """
+    On linux both only apply to the calling thread, and to the threads and compression processes it starts after.
+    :param nice: niceness to raise to, a thread already at or above it is left alone (so repeat calls don't stack),
+        there is no going back down without privileges
+    :param io_class: ionice class, None leaves it as is
+    :return: dict of what was applied, the resulting niceness and whether the io class was set
+    """
+    applied = {}
+    if nice:
+        current = os.nice(0)
+        applied["nice"] = os.nice(int(nice) - current) if int(nice) > current else current
+    if io_class:
+        applied["ionice"] = set_io_priority(io_class)
+    return applied
+
+
+def parse_tps(response: str):
+    # ticks per second from a "tps" or "tick query" response, None if the response has neither
+    response = COLOR_CODE.sub("", str(response or ""))
+    match = TPS_PATTERN.search(response)
+    if match:
+        return float(match.group(1))
+    match = MSPT_PATTERN.search(response)
+    if match:
+        mspt = float(match.group(1))
+        return min(TARGET_TPS, 1000.0 / mspt) if mspt > 0 else TARGET_TPS
+    return None
+
+
+class Governor:
+    """
+    Resource limits for a backup: read and write bandwidth buckets and cpu/io priority.
+    Given a lag signal (host load average per cpu, or the server's tps) a monitor thread halves both rates while the
+    server lags and ramps them back up by a quarter per interval once it recovers, down to floor of the set rates.
+    """
+
+    def __init__(
+            self,
+            read_rate: float = 0,
+            write_rate: float = 0,
+            nice: int = 0,
+            io_class: str = None,
+            max_load: float = None,
+            min_tps: float = None,
+            tps_probe=None,
+            interval: float = 5.0,
+            floor: float = 0.1,
+            read_limiter: TokenBucket = None,
+            burst: float = 1.0
+    ):
+        """
+        :param read_rate: source read bytes per second, 0 for unlimited
+        :param write_rate: archive write bytes per second, 0 for unlimited
+        :param nice: niceness to run at, see lower_priority
+        :param io_class: ionice class, see lower_priority
+        :param max_load: back off while the 1 minute load average per cpu is above this
+        :param min_tps: back off while tps_probe() answers below this
+        :param tps_probe: callable returning the server's current tps, or None when it can't tell
+        :param interval: seconds between lag checks
+        :param floor: lowest fraction of the set rates backing off goes to
+        :param read_limiter: an existing (shared) bucket to use for reads instead of a new one
+        :param burst: seconds worth of the set rates either bucket holds
+        """
+        self.read_limiter = read_limiter or (TokenBucket(read_rate, read_rate * burst) if read_rate else None)
+        self.write_limiter = TokenBucket(write_rate, write_rate * burst) if write_rate else None
+        self.nice = int(nice or 0)
+        self.io_class = io_class
+        self.max_load = max_load
+        self.min_tps = min_tps
+        self.tps_probe = tps_probe
+        self.interval = float(interval)
+        self.floor = float(floor)
+        self.scale = 1.0
+        self.backoffs = 0
+        self.__base = [
+            (bucket, bucket.rate) for bucket in (self.read_limiter, self.write_limiter) if bucket is not None
+        ]
+        if self.adaptive and not self.__base:
+            raise ValueError("adaptive throttling scales the read or write rate, set at least one of them")
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    @property
+    def adaptive(self) -> bool:
+        return bool(self.max_load or (self.min_tps and self.tps_probe))
+
+    def apply_priority(self) -> dict:
+        return lower_priority(self.nice, self.io_class)
+
+    def lagging(self) -> bool:
+        if self.max_load and hasattr(os, "getloadavg"):
+            if os.getloadavg()[0] / (os.cpu_count() or 1) > self.max_load:
+                return True
+        if self.min_tps and self.tps_probe is not None:
+            try:
+                tps = self.tps_probe()
+            except (OSError, TimeoutError):
+                tps = None
+            if tps is not None and tps < self.min_tps:
+                return True
+        return False
+
+    def adjust(self, lagging: bool) -> float:
+        # multiplicative back off and a gentler recovery, so a lagging server gets relief within one interval
+        self.scale = max(self.floor, self.scale / 2) if lagging else min(1.0, self.scale * 1.25)
+        self.backoffs += bool(lagging)
+        for bucket, rate in self.__base:
+            bucket.set_rate(rate * self.scale)
+        return self.scale
+
+    def __monitor(self):
+        while not self.__stop.wait(self.interval):
+            self.adjust(self.lagging())
+
+    def start(self):
+        if self.adaptive and self.__thread is None:
+            self.__stop.clear()
+            self.__thread = threading.Thread(target=self.__monitor, name="backup-governor", daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        if self.__thread is not None:
+            self.__stop.set()
+            self.__thread.join()
+            self.__thread = None
+        # a shared bucket goes back to its full rate for whoever uses it next
+        self.scale = 1.0
+        for bucket, rate in self.__base:
+            bucket.set_rate(rate)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
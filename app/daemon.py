@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+# standard libraries included in python
+import argparse
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# local file imports
+from app import docker_world_backup as dwb
+from app import orchestrator
+from app.core import config as config_io
+from app.core import hot_pack
+from app.core import inotify
+
+logger = dwb.logger
+
+DEFAULT_SOCKET = "backup_daemon.sock"
+KINDS = ("full", "incremental")
+
+
+class WorldState:
+    """
+    One configured world as the daemon keeps it between backups: its settings, its schedule,
+    and the change tracker that lets an incremental backup skip the scan.
+    Schedules come from the world's settings, full_every_minutes (default 60) and incremental_every_minutes
+    (default 0, off), either can be 0 to only back up on request.
+    Player data, level.dat, advancements and stats go to the world's hot pack every hot_every_seconds (default 60,
+    0 for off), on the scheduler thread outside the daemon's lock: a pass reads a few small files and doesn't pause
+    saving.
+    The pack keeps hot_keep_versions of each file and everything of the last hot_keep_hours, see HotPack.compact.
+    """
+
+    def __init__(self, settings: dict, now: float = None):
+        now = time.monotonic() if now is None else now
+        self.settings = settings
+        self.name = settings["container"]
+        self.every = {
+            "full": float(settings.get("full_every_minutes", 60)) * 60,
+            "incremental": float(settings.get("incremental_every_minutes", 0)) * 60,
+        }
+        self.next = {kind: now + every if every else None for kind, every in self.every.items()}
+        self.paused = False
+        self.running = None
+        self.last = {}
+        self.tracker = None
+        self.hot_every = float(settings.get("hot_every_seconds", 60))
+        self.next_hot = now + self.hot_every if self.hot_every else None
+        self.hot = None
+        self.hot_last = None
+        # one pass at a time per world, the scheduler's and a requested one share the pack
+        self.hot_lock = threading.Lock()
+        self.__worlds = None
+
+    def schedule_hot(self, now: float):
+        # called with the daemon's lock held, the pass itself runs after it is released
+        if self.hot_every:
+            self.next_hot = now + self.hot_every
+
+    def hot_pass(self) -> dict:
+        # called without the daemon's lock, a pass writes and fsyncs. failures are logged and the next pass tries again
+        with self.hot_lock:
+            try:
+                if self.hot is None:
+                    self.hot = hot_pack.HotPack(dwb.hot_pack_file(self.settings["save_dir"], self.settings["source"]))
+                    # worlds (dimensions) of a server don't come and go, found once rather than every minute
+                    self.__worlds = hot_pack.world_dirs(self.settings["source"])
+                stats = self.hot.snapshot(self.settings["source"], self.__worlds)
+                compacted = self.hot.compact(
+                    int(self.settings.get("hot_keep_versions", hot_pack.KEEP_VERSIONS)),
+                    float(self.settings.get("hot_keep_hours", hot_pack.KEEP_SECONDS / 3600)) * 3600
+                )
+                if compacted["rewritten"]:
+                    logger.write(
+                        f"{self.name}: hot pack compacted, {compacted['dropped']} old versions dropped,"
+                        f" {compacted['before']} to {compacted['after']} bytes"
+                    )
+                stats["size"] = self.hot.size
+            except (OSError, ValueError) as e:
+                logger.write(f"{self.name}: hot snapshot failed: {e!r}", "error")
+                stats = {"error": repr(e)}
+            self.hot_last = stats
+            return stats
+
+    def track(self):
+        # only worth the watches if incrementals run on a schedule, otherwise each one scans anyway
+        if not self.every["incremental"] or not inotify.available():
+            return
+        try:
+            self.tracker = inotify.ChangeTracker(self.settings["source"]).start()
+            logger.write(f"{self.name}: tracking changes, {self.tracker.watches} directories watched")
+        except OSError as e:
+            logger.write(f"{self.name}: change tracking unavailable, incrementals will scan: {e!r}", "warning")
+
+    def due(self, now: float):
+        # the kind of backup that is due, a full one wins when both are
+        if self.paused or self.running:
+            return None
+        for kind in KINDS:
+            if self.next[kind] is not None and self.next[kind] <= now:
+                return kind
+        return None
+
+    def reschedule(self, kind: str, now: float):
+        if self.every[kind]:
+            self.next[kind] = now + self.every[kind]
+
+    def wait(self, now: float):
+        # seconds until the next scheduled backup, None if nothing is scheduled
+        if self.paused:
+            return None
+        pending = [each - now for each in [*self.next.values(), self.next_hot] if each is not None]
+        return max(0.0, min(pending)) if pending else None
+
+    def status(self, now: float) -> dict:
+        return {
+            "world": self.name,
+            "paused": self.paused,
+            "running": self.running,
+            "next": {kind: None if each is None else round(each - now, 1) for kind, each in self.next.items()},
+            "last": self.last,
+            "tracking": self.tracker.watches if self.tracker is not None else None,
+            "hot": self.hot_last,
+        }
+
+    def close(self):
+        if self.hot is not None:
+            self.hot.close()
+            self.hot = None
+        if self.tracker is not None:
+            self.tracker.close()
+            self.tracker = None
+
+
+class BackupDaemon:
+    """
+    Keeps every world in memory and runs their scheduled and requested backups,
+    at most max_concurrent at a time, until stop() is called.
+    """
+
+    def __init__(self, settings: list, max_concurrent: int = 1):
+        now = time.monotonic()
+        self.worlds = {each["container"]: WorldState(each, now) for each in settings}
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.__lock = threading.Lock()
+        self.__wake = threading.Event()
+        self.__stopped = threading.Event()
+        self.__pool = None
+        self.__thread = None
+
+    def start(self) -> "BackupDaemon":
+        for world in self.worlds.values():
+            world.track()
+        self.__pool = ThreadPoolExecutor(self.max_concurrent, thread_name_prefix="backup")
+        self.__thread = threading.Thread(target=self.__schedule, name="scheduler", daemon=True)
+        self.__thread.start()
+        return self
+
+    def __schedule(self):
+        while not self.__stopped.is_set():
+            now = time.monotonic()
+            waits = []
+            hot = []
+            with self.__lock:
+                for world in self.worlds.values():
+                    if not world.paused and world.next_hot is not None and world.next_hot <= now:
+                        world.schedule_hot(now)
+                        hot.append(world)
+                    kind = world.due(now)
+                    if kind:
+                        world.reschedule(kind, now)
+                        self.__submit(world, kind)
+                    wait = world.wait(now)
+                    if wait is not None:
+                        waits.append(wait)
+            # like the backups __submit hands to the pool, hot passes write with the lock released
+            for world in hot:
+                world.hot_pass()
+            # woken early by any request that changes the schedule
+            self.__wake.wait(min(waits) if waits else None)
+            self.__wake.clear()
+
+    def __submit(self, world: WorldState, kind: str):
+        # called with the lock held
+        world.running = kind
+        self.__pool.submit(self.run, world, kind)
+
+    def run(self, world: WorldState, kind: str) -> bool:
+        settings = dict(world.settings, incremental=kind == "incremental")
+        drained = []
+        if kind == "incremental" and world.tracker is not None:
+            def changes():
+                drained.append(world.tracker.drain())
+                return drained[-1]
+            settings["changes"] = changes
+        started = time.time()
+        try:
+            succeeded = dwb.backup_world(settings)
+        except BaseException as e:
+            logger.write(f"{world.name}: {e!r}", "error")
+            succeeded = False
+        if not succeeded and drained:
+            # the next incremental has to see whatever this one took off the tracker
+            world.tracker.restore(drained[-1])
+        with self.__lock:
+            world.running = None
+            world.last[kind] = {"succeeded": succeeded, "started": started, "seconds": time.time() - started}
+        logger.write(f"{world.name}: {kind} backup {'ok' if succeeded else 'FAILED'}")
+        self.__wake.set()
+        return succeeded
+
+    def __select(self, name: str = None) -> list:
+        if name is None:
+            return list(self.worlds.values())
+        if name not in self.worlds:
+            raise KeyError(name)
+        return [self.worlds[name]]
+
+    def handle(self, request: dict) -> dict:
+        """
+        One control request, {"command": "status" | "backup" | "pause" | "resume" | "stop", ...}
+        backup takes "world" and optionally "kind" (full, incremental or hot), pause and resume an optional "world".
+        :return: {"ok": bool, ...}
+        """
+        command = request.get("command")
+        now = time.monotonic()
+        try:
+            if command == "backup" and request.get("kind") == "hot" and request.get("world"):
+                # a few small files, taken right here rather than queued behind full backups
+                world = self.__select(request["world"])[0]
+                with self.__lock:
+                    world.schedule_hot(now)
+                stats = world.hot_pass()
+                return {"ok": "error" not in stats, "world": world.name, "hot": stats}
+            with self.__lock:
+                if command == "status":
+                    return {"ok": True, "worlds": [each.status(now) for each in self.worlds.values()]}
+                if command == "backup":
+                    kind = request.get("kind", "full")
+                    if kind not in KINDS:
+                        return {"ok": False, "error": f"unknown kind: {kind}"}
+                    if not request.get("world"):
+                        return {"ok": False, "error": "backup needs a world"}
+                    world = self.__select(request["world"])[0]
+                    if self.__stopped.is_set():
+                        return {"ok": False, "error": "the daemon is stopping"}
+                    if world.running:
+                        return {"ok": False, "error": f"{world.name} is already running a {world.running} backup"}
+                    self.__submit(world, kind)
+                    return {"ok": True, "world": world.name, "kind": kind}
+                if command in ("pause", "resume"):
+                    selected = self.__select(request.get("world"))
+                    for world in selected:
+                        world.paused = command == "pause"
+                    self.__wake.set()
+                    return {"ok": True, "worlds": [each.name for each in selected]}
+            if command == "stop":
+                threading.Thread(target=self.stop, name="stop").start()
+                return {"ok": True}
+        except KeyError as e:
+            return {"ok": False, "error": f"unknown world: {e.args[0]}"}
+        return {"ok": False, "error": f"unknown command: {command}"}
+
+    def wait(self, timeout: float = None) -> bool:
+        return self.__stopped.wait(timeout)
+
+    def stop(self):
+        # backups already running finish, nothing new starts
+        self.__stopped.set()
+        self.__wake.set()
+        if self.__thread is not None:
+            self.__thread.join()
+        if self.__pool is not None:
+            self.__pool.shutdown(wait=True)
+        for world in self.worlds.values():
+            world.close()
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    # one json request per line, one json answer per line
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                answer = self.server.daemon.handle(json.loads(line))
+            except (ValueError, AttributeError) as e:
+                answer = {"ok": False, "error": f"bad request: {e}"}
+            self.wfile.write(json.dumps(answer).encode() + b"\n")
+            self.wfile.flush()
+
+
+class ControlServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_file: str, daemon: BackupDaemon):
+        if os.path.exists(socket_file):
+            # left behind by a daemon that didn't shut down cleanly
+            os.remove(socket_file)
+        self.daemon = daemon
+        super().__init__(socket_file, ControlHandler)
+        # anyone who can write the socket can start backups
+        os.chmod(socket_file, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def control(socket_file: str, request: dict, timeout: float = 10.0) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(socket_file)
+        with client.makefile("rwb") as stream:
+            stream.write(json.dumps(request).encode() + b"\n")
+            stream.flush()
+            return json.loads(stream.readline())
+
+
+def serve(daemon: BackupDaemon, socket_file: str):
+    server = ControlServer(socket_file, daemon)
+    thread = threading.Thread(target=server.serve_forever, name="control", daemon=True)
+    daemon.start()
+    thread.start()
+    logger.write(f"daemon running {len(daemon.worlds)} worlds, control socket {socket_file}")
+    try:
+        daemon.wait()
+    except KeyboardInterrupt:
+        daemon.stop()
+    finally:
+        server.shutdown()
+        server.server_close()
+    logger.write("daemon stopped")
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Long running backup scheduler for the worlds in a config")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="unix socket the daemon listens on")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="start the daemon in the foreground")
+    run.add_argument("--config", default="backup_config.json", help="json config of worlds and schedules")
+    run.add_argument("--max-concurrent", type=int, default=1, help="backups allowed to run at once")
+    ctl = commands.add_parser("ctl", help="talk to a running daemon")
+    ctl.add_argument("action", choices=["status", "backup", "pause", "resume", "stop"])
+    ctl.add_argument("world", nargs="?", default=None, help="container name, pause and resume default to every world")
+    ctl.add_argument("--incremental", action="store_true", help="backup: an incremental instead of a full one")
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None):
+    args = parse_args(argv)
+    if args.command == "run":
+        config = config_io.load_config(args.config)
+        settings = [orchestrator.world_settings(each, config["defaults"]) for each in config["worlds"]]
+        if not settings:
+            print(f"no worlds configured in {args.config}, nothing to do")
+            sys.exit(1)
+        serve(BackupDaemon(settings, args.max_concurrent), args.socket)
+        return
+    request = {"command": args.action}
+    if args.world:
+        request["world"] = args.world
+    if args.action == "backup":
+        if not args.world:
+            print("backup needs a world")
+            sys.exit(1)
+        request["kind"] = "incremental" if args.incremental else "full"
+    answer = control(args.socket, request)
+    print(json.dumps(answer, indent=4))
+    if not answer.get("ok"):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
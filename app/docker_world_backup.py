@@ -1,16 +1,39 @@
 #!/usr/bin/env python3
 # standard libraries included in python
+import argparse
 import datetime
+import hashlib
+import json
 import os
 import subprocess
 import sys
 import tarfile
 import shutil
 import math
+import time
 
 # local file imports
 from app.core import LogHandler
+from app.core import adaptive
 from app.core import FileIO
+from app.core import StatIndex
+from app.core import IntegrityValidationException
+from app.core import archive
+from app.core import catalog
+from app.core import compression
+from app.core import estimate
+from app.core import hot_pack
+from app.core import metrics as metrics_core
+from app.core import offsite
+from app.core import prune
+from app.core import recompact
+from app.core import restore
+from app.core import retention
+from app.core import server_control
+from app.core import snapshot
+from app.core import throttle
+from app.core.anvil import RegionDeltaStore
+from app.core.chunk_store import ChunkStore
 
 # directories defined at execution
 root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -22,11 +45,8 @@ SUCCESS = 'Backup Succeeded!'
 FAIL = 'Backup Failure! \nPlease notify an Admin'
 DEBUG = True
 
-# global logger setup
-if FileIO.verify_dir(log_dir) != 1:
-    FileIO.mkdir(log_dir)
+# global logger setup, the log directory is only created once there is something to write
 logger = LogHandler(file_name=f"{log_dir}{os.path.sep}py_backup_util_log.txt", logging_level="info")
-logger.write("logging initialized", "info")
 
 
 def verify_backup_directory(backup_directory: str) -> bool:
@@ -59,78 +79,316 @@ def parse_sub_process(command: str, ) -> [str]:  # get command, return list of s
     return result_list
 
 
-def docker_cmd_format(cmd: str, container_name: str) -> str:
-    # sudo -H -u root screen -S minecraft -p 0 -X stuff "$CMDPAUSE^M"
-    return f"docker exec -i {container_name} /bin/bash -c \"echo '{cmd}' > /tmp/server_stdin.fifo\""
-
-
 def world_echo(container_name: str, msg: str):
-    for each in msg.split("\n"):
-        command = docker_cmd_format(f"say {each}", container_name)
-        parse_sub_process(command)
+    # every line goes out as one batch, a single rcon round trip or a single docker exec
+    server_control.get_control(container_name).say(msg)
 
 
 def world_save_pause(container_name: str):
     # stop saving on server
     # pipe to session to stop saving while taking backup
     command_pause = "/save-off"
-    command = docker_cmd_format(command_pause, container_name)
-    parse_sub_process(command)
+    server_control.get_control(container_name).command(command_pause)
 
 
 def world_save_resume(container_name: str):
     # pipe to session "/save-on"
     command_resume = "/save-on"
-    command = docker_cmd_format(command_resume, container_name)
-    parse_sub_process(command)
+    server_control.get_control(container_name).command(command_resume)
+
 
+def world_save_flush(container_name: str, timeout: float = 60.0) -> float:
+    # save-all flush only finishes once every loaded chunk is on disk, the server says "Saved the game" then
+    # over rcon that is the command's response, over the fifo it is read back from the container log
+    return server_control.get_control(container_name).save_flush(timeout)
+
+
+def report_save_window(container_name: str, paused_at: float) -> float:
+    # how long autosave was off, the window of progress at risk if the server died during the backup
+    seconds = time.monotonic() - paused_at
+    message = f"World saving was paused for {seconds:.2f} seconds"
+    logger.write(message)
+    if DEBUG:
+        print(message)
+    world_echo(container_name, message)
+    return seconds
 
-def list_containers() -> list:
+
+def list_containers(image_filter: str = "minecraft-server") -> list:
     # docker container ls --format "{{.Names}}"
     # docker container ls --format "{{.Image}}" | grep minecraft-server
-    pass
+    running = parse_sub_process('docker container ls --format "{{.Names}}\t{{.Image}}"')
+    return [each.split("\t")[0] for each in running if "\t" in each and image_filter in each.split("\t")[1]]
+
+
+def container_data_dir(container_name: str, destination: str = "/data") -> str:
+    # host side path of the volume mounted at destination (/data in the itzg/minecraft-server image)
+    mount = "{{range .Mounts}}{{if eq .Destination \"%s\"}}{{.Source}}{{end}}{{end}}" % destination
+    found = parse_sub_process(f"docker inspect -f '{mount}' {container_name}")
+    return found[0] if found else ""
+
+
+def container_running(container_name: str) -> bool:
+    state = parse_sub_process(f"docker inspect -f '{{{{.State.Running}}}}' {container_name}")
+    return bool(state) and state[0] == "true"
 
 
-def tar_archive(name: str, mode: str, source: str, recursive: bool = True) -> list:
+def tar_archive(
+        name: str,
+        mode: str,
+        source: str,
+        recursive: bool = True,
+        codec: str = None,
+        level: int = None,
+        workers: int = None,
+        arcname: str = None,
+        filter=None,
+        limiter=None,
+        write_limiter=None
+) -> list:
     # return list as we care about representations of the members, not the actual items themselves
     # 28176904 & 4180384
     # the actual archive creation/compression line using tar
     # tar using options:
     # c - CREATE, z - filter through gzip, v - verbose, f - --file = ARCHIVE use file or device ARCHIVE
-    with tarfile.open(name=name, mode=mode) as archive:
-        archive.add(source, recursive=recursive)
-        return archive.getmembers()
+    # codec None keeps tarfile's single core gzip, anything else goes through the block compressor
+    return archive.write_archive(
+        name=name, mode=mode, source=source, recursive=recursive,
+        codec=codec, level=level, workers=workers, arcname=arcname, filter=filter, limiter=limiter,
+        write_limiter=write_limiter
+    )["members"]
 
 
-def archive_validation(backup_filename: str, mode: str, source_dir: str, backup_dir: str) -> bool:
-    archive = tar_archive(
-        name=FileIO.path_join(backup_dir, backup_filename),
-        # x:gz Create tarfile w/ gzip compression. FileExistsError exception if file exists.
-        # w:gz Create/overwrite tarfile w/ gzip compression.
-        mode=mode,  # 'w:gz' if options_dict["-overwrite"] else 'x:gz',
-        source=source_dir,
-        recursive=True
+def archive_validation(
+        backup_filename: str,
+        mode: str,
+        source_dir: str,
+        backup_dir: str,
+        archive_options: dict = None,
+        container: str = None,
+        metrics: metrics_core.RunMetrics = None,
+        offsite_target: offsite.S3Target = None
+) -> bool:
+    # checksums are taken while the data streams into the tar and checked against a set index of the source tree,
+    # so validation is linear and never reads the archive back
+    metrics = metrics or metrics_core.RunMetrics(container or "")
+    archive_name = FileIO.path_join(backup_dir, backup_filename)
+    # the offsite copy is uploaded from the bytes as they are written, parts go out while compression still runs
+    upload = offsite_target.start_upload(archive_name) if offsite_target is not None else None
+    try:
+        result = archive.write_archive(
+            name=archive_name,
+            # x:gz Create tarfile w/ gzip compression. FileExistsError exception if file exists.
+            # w:gz Create/overwrite tarfile w/ gzip compression.
+            mode=mode,  # 'w:gz' if options_dict["-overwrite"] else 'x:gz',
+            source=source_dir,
+            recursive=True,
+            mirror=upload,
+            **(archive_options or {})
+        )
+    except BaseException:
+        if upload is not None:
+            upload.abort()
+        raise
+    # read, compress and write overlap in one streaming pass, the archiver times the file io on either side of it
+    timings = result["timings"]
+    ratio = result["archive_bytes"] / result["bytes_read"] if result["bytes_read"] else 0.0
+    metrics.add("scan", timings["scan"], files=len(result["scan"]))
+    metrics.add("read", timings["read"], result["bytes_read"])
+    metrics.add(
+        "compress", max(0.0, timings["archive"] - timings["read"] - timings["write"]), result["bytes_read"],
+        codec=result["codec"], ratio=ratio
     )
-    if DEBUG:
-        print(archive)
-    
+    metrics.add("write", timings["write"], result["archive_bytes"])
+    metrics.fields.update(compression_ratio=ratio, archive_bytes=result["archive_bytes"])
+    if "pruned" in result:
+        report_pruned(archive_name, result["pruned"], metrics)
+
     # write results to log file in a formatted text block
-    archive_results = f"\n\tArchive created:{backup_filename}"
-    source_files = FileIO.long_list_files(source_dir)
-    # DONE: refine logic to verify contents and name automatically
-    for each in archive:
-        archive_results += f"\n\t{str(each)}"
-        logger.write(archive_results)
-    
-    for each in source_files:
-        item = str(each).split()[1]
-        if item not in str(archive_results):
-            fail_message = "failure: {} not found in:\n".format(item, str(archive_results))
+    archive_results = (
+        f"\n\tArchive created:{backup_filename}\n\tmembers: {len(result['members'])}"
+        f"\n\tread: {sizeof_fmt(result['bytes_read'])}\n\tmanifest: {result['manifest']}"
+    )
+    if DEBUG:
+        print(archive_results)
+    logger.write(archive_results)
+    if result["changed"]:
+        logger.write("changed while archiving:\n\t" + "\n\t".join(result["changed"]), "warning")
+
+    with metrics.phase("validate", members=len(result["members"])):
+        problems = archive.verify(result)
+        if problems:
+            fail_message = f"failure: {len(problems)} problems in {backup_filename}:\n\t" + "\n\t".join(problems[:50])
             print(fail_message)
-            logger.write(fail_message)
-            raise IntegrityValidationException
+            logger.write(fail_message, "error")
+            if upload is not None:
+                upload.abort()
+            raise IntegrityValidationException(fail_message)
+
+        # a snapshot copy is archived under the live world's path, catalog and index it under that too
+        world_source = (archive_options or {}).get("arcname") or source_dir
+        changes = StatIndex(stat_index_file(backup_dir, world_source)).update(result["scan"])
+        logger.write(
+            f"since the last backup: {len(changes['added'])} added, {len(changes['changed'])} changed,"
+            f" {len(changes['removed'])} removed, {changes['unchanged']} unchanged"
+        )
+        with catalog.Catalog(catalog.catalog_file(backup_dir)) as backup_catalog:
+            backup_catalog.record_archive(result, source=world_source, container=container)
+    if upload is not None:
+        with metrics.phase("offsite") as phase:
+            phase["bytes"] = result["archive_bytes"]
+            finish_offsite(upload, offsite_target, archive_name)
+    return True
+
+
+def report_pruned(archive_name: str, pruned: dict, metrics: metrics_core.RunMetrics):
+    # the per region report goes next to the archive, the log gets the totals and the regions that shrank most
+    metrics.add(
+        "prune", pruned["seconds"], pruned["bytes_before"], chunks=pruned["chunks"], pruned=pruned["pruned"],
+        bytes_saved=pruned["bytes_saved"]
+    )
+    metrics.fields["pruned_bytes"] = pruned["bytes_saved"]
+    with FileIO.atomic_open(prune.report_name(archive_name), fsync=False) as f:
+        json.dump(pruned, f)
+    largest = sorted(
+        pruned["per_region"].items(), key=lambda item: item[1]["bytes_after"] - item[1]["bytes_before"]
+    )[:10]
+    logger.write(
+        f"left out {pruned['pruned']} of {pruned['chunks']} chunks inhabited under {pruned['threshold']} ticks"
+        f" ({pruned['unreadable']} unreadable, kept), {sizeof_fmt(pruned['bytes_saved'])} saved"
+        f" in {len(pruned['per_region'])} region files, report: {prune.report_name(archive_name)}\n\t"
+        + "\n\t".join(
+            f"{relative}: {each['pruned']} chunks, {sizeof_fmt(each['bytes_before'] - each['bytes_after'])}"
+            for relative, each in largest
+        )
+    )
+
+
+def finish_offsite(upload: offsite.MultipartUpload, target: offsite.S3Target, archive_name: str) -> bool:
+    # a failed offsite copy never fails the backup, the local archive is good and the upload state says what's left
+    try:
+        uploaded = upload.close()
+        target.upload_sidecars(archive_name)
+    except (offsite.OffsiteUploadError,) + offsite.TRANSFER_ERRORS as e:
+        logger.write(
+            f"offsite copy of {archive_name} is incomplete: {e!r}, finish it with: upload {archive_name}", "error"
+        )
+        return False
+    logger.write(
+        f"offsite copy verified: s3://{target.bucket}/{uploaded['key']} {sizeof_fmt(uploaded['size'])}"
+        f" in {uploaded['parts']} parts"
+    )
+    return True
+
+
+def build_offsite_target(settings: dict):
+    # None unless a bucket is configured
+    if not settings.get("s3_bucket"):
+        return None
+    return offsite.S3Target(
+        bucket=settings["s3_bucket"],
+        prefix=settings.get("s3_prefix") or settings.get("container") or "",
+        endpoint_url=settings.get("s3_endpoint"),
+        region=settings.get("s3_region"),
+        part_size=int((settings.get("s3_part_mb") or offsite.DEFAULT_PART_SIZE // 1024 // 1024) * 1024 * 1024),
+        workers=settings.get("s3_workers") or 4,
+    )
+
+
+def upload_archives(args: argparse.Namespace):
+    # archives from before the target was configured, and streamed uploads that broke off
+    target = build_offsite_target(vars(args))
+    if target is None:
+        print("upload needs --s3-bucket")
+        sys.exit(1)
+    for each in args.archives:
+        archive_name = resolve_archive(args.save_dir, each)
+        started = time.monotonic()
+        uploaded = target.upload_file(archive_name)
+        message = (
+            f"Uploaded {archive_name} to s3://{target.bucket}/{uploaded['key']} ({sizeof_fmt(uploaded['size'])},"
+            f" {uploaded['parts']} parts) in {time.monotonic() - started:.2f} seconds"
+        )
+        logger.write(message)
+        print(message)
+
+
+def incremental_backup(
+        store_dir: str, source_dir: str, metrics: metrics_core.RunMetrics = None, changes=None, root: str = None
+) -> bool:
+    # only files whose size or mtime changed since the last snapshot are read, only unseen chunks are written
+    # changes: callable returning the paths changed since the last snapshot (see ChangeTracker.drain), None to walk
+    # root: the live world recorded in the snapshot when source_dir is a scratch copy of it
+    metrics = metrics or metrics_core.RunMetrics("")
+    with metrics.phase("incremental") as phase:
+        # asked for here, after the save flush, so the flush's own writes are in it
+        snapshot = ChunkStore(store_dir).backup(
+            source_dir, changed=changes() if changes is not None else None, root=root
+        )
+        stats = snapshot["stats"]
+        phase.update(
+            bytes=stats["bytes_read"], bytes_written=stats["bytes_written"], chunks_new=stats["chunks_new"],
+            files_checked=stats["walked"]
+        )
+    logger.write(
+        f"Snapshot created:{snapshot['name']}\n\tfiles: {stats['files']} unchanged: {stats['unchanged']}"
+        f" checked: {stats['walked']}"
+        f"\n\tread: {sizeof_fmt(stats['bytes_read'])} new chunks: {stats['chunks_new']}"
+        f" written: {sizeof_fmt(stats['bytes_written'])}"
+    )
+    if DEBUG:
+        print(stats)
+    return True
+
+
+def skip_region_files(member: tarfile.TarInfo):
+    # tarfile filter, region files are covered by the region delta store
+    return None if member.name.endswith(".mca") else member
+
+
+def region_backup(
+        store_dir: str, source_dir: str, archive_options: dict = None, metrics: metrics_core.RunMetrics = None
+) -> bool:
+    # changed chunks of every region file go to the delta store, everything else into a tar next to them
+    metrics = metrics or metrics_core.RunMetrics("")
+    store = RegionDeltaStore(store_dir)
+    with metrics.phase("regions") as phase:
+        index = store.backup(source_dir)
+        stats = index["stats"]
+        phase.update(bytes=stats["bytes_written"], chunks_changed=stats["chunks_changed"])
+    codec = (archive_options or {}).get("codec")
+    with metrics.phase("archive"):
+        tar_archive(
+            name=FileIO.path_join(
+                store.snapshot_dir(index["name"]), f"world{compression.archive_suffix(codec or 'gzip')}"
+            ),
+            mode="x:gz",
+            source=source_dir,
+            arcname=".",
+            filter=skip_region_files,
+            **(archive_options or {})
+        )
+    logger.write(
+        f"Region snapshot created:{index['name']}\n\tregions: {stats['regions']}"
+        f" unchanged: {stats['regions_unchanged']}\n\tchunks: {stats['chunks']} changed: {stats['chunks_changed']}"
+        f" written: {sizeof_fmt(stats['bytes_written'])}"
+    )
+    if DEBUG:
+        print(stats)
+    return True
+
+
+def region_restore(store_dir: str, snapshot: str, target: str) -> int:
+    store = RegionDeltaStore(store_dir)
+    snapshot_dir = store.snapshot_dir(snapshot)
+    world_tar = [each for each in os.listdir(snapshot_dir) if each.startswith("world.tar")][0]
+    # the non region files first, then full region files rebuilt from the chunk packs
+    with tarfile.open(FileIO.path_join(snapshot_dir, world_tar), "r:*") as world_archive:
+        if hasattr(tarfile, "data_filter"):
+            world_archive.extractall(target, filter="data")
         else:
-            return True
+            world_archive.extractall(target)
+    return store.restore(os.path.basename(snapshot_dir), target)
 
 
 def sizeof_fmt(num):
@@ -143,36 +401,170 @@ def sizeof_fmt(num):
 
 
 def get_max_file_size(target_dir: str):
+    # answered by the catalog once it has entries, the directory scan is only for trees that predate it
+    if os.path.exists(catalog.catalog_file(target_dir)):
+        with catalog.Catalog(catalog.catalog_file(target_dir)) as backup_catalog:
+            if backup_catalog.count():
+                return backup_catalog.max_size()
     max_value = 0
-    for each in os.listdir(target_dir):
-        full_dir = os.path.join(target_dir, each)
-        size = os.path.getsize(full_dir)
-        if size > max_value:
-            max_value = size
+    for each, entry in FileIO.scan_tree(target_dir, recursive=False).items():
+        if entry.is_dir:
+            continue
+        if entry.size > max_value:
+            max_value = entry.size
         if DEBUG:
-            print(f"{each}\n\t{size}")
+            print(f"{each}\n\t{entry.size}")
     return max_value
 
 
-def do_backup(container: str, backup_filename: str, mode: str, source_dir: str, save_dir: str):
-    # pause world saving
-    world_save_pause(container)
-    start_message = f"Backup starting at {datetime.datetime.utcnow().strftime('%Y-%b-%d-%H.%M.%S')} UTC"
-    if DEBUG:
-        print(start_message)
-    world_echo(container, start_message)
-    
+def world_key(source_dir: str) -> str:
+    # names the per world files in save_dir, several worlds can share one
+    return hashlib.sha256(os.path.abspath(source_dir).encode()).hexdigest()[:16]
+
+
+def stat_index_file(save_dir: str, source_dir: str) -> str:
+    return FileIO.path_join(save_dir, f".stat_index.{world_key(source_dir)}.jsonl")
+
+
+def codec_history_file(save_dir: str, source_dir: str) -> str:
+    # what the codec controller decided and measured for one world, see app.core.adaptive.CodecController
+    return FileIO.path_join(save_dir, f".codec_history.{world_key(source_dir)}.json")
+
+
+def build_codec_controller(settings: dict) -> adaptive.CodecController:
+    # only full archives go through the block compressor, None without a budget or for the incremental stores
+    if not settings.get("time_budget") and not settings.get("cpu_budget"):
+        return None
+    if settings.get("incremental") or settings.get("regions"):
+        return None
+    return adaptive.CodecController(
+        codec_history_file(settings["save_dir"], settings["source"]),
+        time_budget=settings["time_budget"] * 60 if settings.get("time_budget") else None,
+        cpu_budget=settings["cpu_budget"] / 100 if settings.get("cpu_budget") else None,
+        codecs=[settings["codec"]] if settings.get("codec") else None,
+        workers=settings.get("workers")
+    )
+
+
+def build_pruner(settings: dict) -> prune.ChunkPruner:
+    # only full archives leave chunks out, the incremental stores keep every one, None unless asked for
+    if settings.get("prune_inhabited") is None:
+        return None
+    if settings.get("incremental") or settings.get("regions"):
+        return None
+    return prune.ChunkPruner(
+        max(1, math.ceil(settings["prune_inhabited"] * prune.TICKS_PER_SECOND)), workers=settings.get("workers")
+    )
+
+
+def hot_pack_file(save_dir: str, source_dir: str) -> str:
+    # one pack per world, see app.core.hot_pack
+    return FileIO.path_join(save_dir, f"hot.{world_key(source_dir)}.pack")
+
+
+def estimate_file(save_dir: str, source_dir: str) -> str:
+    # sampled ratios and past predictions of one world, see app.core.estimate.SpaceEstimator
+    return FileIO.path_join(save_dir, f".estimate.{world_key(source_dir)}.json")
+
+
+def run_backup(
+        backup_filename: str,
+        mode: str,
+        source_dir: str,
+        save_dir: str,
+        archive_options: dict = None,
+        chunk_store: str = None,
+        region_store: str = None,
+        container: str = None,
+        metrics: metrics_core.RunMetrics = None,
+        offsite_target: offsite.S3Target = None,
+        changes=None,
+        root: str = None
+) -> bool:
     # tar file
     # zip world
-    if archive_validation(backup_filename, mode, source_dir, save_dir):
+    if chunk_store:
+        return incremental_backup(chunk_store, source_dir, metrics, changes, root)
+    elif region_store:
+        return region_backup(region_store, source_dir, archive_options, metrics)
+    else:
+        return archive_validation(
+            backup_filename, mode, source_dir, save_dir, archive_options, container, metrics, offsite_target
+        )
+
+
+def do_backup(
+        container: str,
+        backup_filename: str,
+        mode: str,
+        source_dir: str,
+        save_dir: str,
+        archive_options: dict = None,
+        chunk_store: str = None,
+        region_store: str = None,
+        snapshot_dir: str = None,
+        snapshot_method: str = "auto",
+        flush_timeout: float = 60.0,
+        metrics: metrics_core.RunMetrics = None,
+        offsite_target: offsite.S3Target = None,
+        changes=None
+):
+    metrics = metrics or metrics_core.RunMetrics(container)
+    # pause world saving
+    paused_at = time.monotonic()
+    with metrics.phase("save-pause"):
+        world_save_pause(container)
+        start_message = f"Backup starting at {datetime.datetime.utcnow().strftime('%Y-%b-%d-%H.%M.%S')} UTC"
+        if DEBUG:
+            print(start_message)
+        world_echo(container, start_message)
+        # nothing reads the world until the server says everything in memory is on disk
+        world_save_flush(container, flush_timeout)
+
+    if snapshot_dir:
+        # two phase: a point in time copy while saving is paused, then saving resumes and compression runs after
+        copy_dir = FileIO.path_join(snapshot_dir, f"{backup_filename}{snapshot.SCRATCH_SUFFIX}")
+        with metrics.phase("snapshot") as phase:
+            copy_stats = snapshot.copy_tree(source_dir, copy_dir, snapshot_method)
+            phase.update(bytes=copy_stats["bytes"], reflinked=copy_stats["reflinked"])
+        with metrics.phase("resume"):
+            world_save_resume(container)
+            metrics.fields["save_window_seconds"] = report_save_window(container, paused_at)
+        logger.write(
+            f"Snapshot copied to {copy_dir}\n\tfiles: {copy_stats['files']} reflinked: {copy_stats['reflinked']}"
+            f"\n\tsize: {sizeof_fmt(copy_stats['bytes'])} in {copy_stats['seconds']:.2f} seconds"
+        )
+        # archive names stay those of the live world, not of the scratch copy
+        snapshot_options = dict(archive_options or {})
+        # the scan is of the live world, the copy gets one of its own
+        snapshot_options.pop("scan", None)
+        if not chunk_store and not region_store:
+            snapshot_options["arcname"] = source_dir
+        try:
+            succeeded = run_backup(
+                backup_filename, mode, copy_dir, save_dir, snapshot_options, chunk_store, region_store, container,
+                metrics, offsite_target, changes, root=source_dir
+            )
+        finally:
+            shutil.rmtree(copy_dir, ignore_errors=True)
+    else:
+        succeeded = run_backup(
+            backup_filename, mode, source_dir, save_dir, archive_options, chunk_store, region_store, container,
+            metrics, offsite_target, changes
+        )
+
+    if succeeded:
         print(SUCCESS)
         world_echo(container, SUCCESS)
     else:
         print(FAIL)
         world_echo(container, FAIL)
     
-    # resume saving to server (preferably after zip concludes)
-    world_save_resume(container)
+    if not snapshot_dir:
+        # resume saving to server (preferably after zip concludes)
+        with metrics.phase("resume"):
+            world_save_resume(container)
+            metrics.fields["save_window_seconds"] = report_save_window(container, paused_at)
     end_message = f"Backup complete at {datetime.datetime.utcnow().strftime('%Y-%b-%d-%H.%M.%S')} UTC"
     world_echo(container, end_message)
     if DEBUG:
@@ -188,38 +580,634 @@ def help_info():
     exit(0)
 
 
-def main():
+def parse_args(argv: list = None) -> argparse.Namespace:
+    # maybe do as config file down the line, defaults match the original hardcoded values
+    parser = argparse.ArgumentParser(description="Backup a minecraft world running in a docker container")
+    parser.add_argument("--container", default="minecraft18_mc-server_1", help="docker container running the server")
+    parser.add_argument("--source", default=f"{current_dir}{os.path.sep}minecraft_data", help="world data to archive")
+    parser.add_argument("--save-dir", default=f"{current_dir}{os.path.sep}world_backups", help="archive destination")
+    parser.add_argument(
+        "--codec", default=None, choices=sorted(compression.CODECS),
+        help="multi core block compression codec, leave unset for the single core tarfile gzip path"
+    )
+    parser.add_argument("--level", type=int, default=None, help="compression level, codec default if unset")
+    parser.add_argument("--workers", type=int, default=None, help="compression processes, defaults to cpu count")
+    parser.add_argument(
+        "--time-budget", type=float, default=None, metavar="MINUTES",
+        help="pick the codec and per file class levels giving the smallest archive compressed within this time"
+    )
+    parser.add_argument(
+        "--cpu-budget", type=float, default=None, metavar="PERCENT",
+        help="share of the cpu cores compression may use, levels and codec picked for the best ratio on them"
+    )
+    backup_mode = parser.add_mutually_exclusive_group()
+    backup_mode.add_argument(
+        "--incremental", action="store_true",
+        help="snapshot into the deduplicated chunk store under save-dir instead of writing a full archive"
+    )
+    backup_mode.add_argument(
+        "--regions", action="store_true",
+        help="store only the region file chunks changed since the last region snapshot, plus a tar of the rest"
+    )
+
+    parser.add_argument(
+        "--rcon", default=None, metavar="HOST[:PORT]",
+        help="control the server over rcon instead of the docker exec fifo, password from $RCON_PASSWORD"
+    )
+    parser.add_argument(
+        "--snapshot-dir", default=None,
+        help="scratch directory for a point in time copy taken while saving is paused, compression runs after resume"
+    )
+    parser.add_argument(
+        "--snapshot-method", default="auto", choices=snapshot.METHODS,
+        help="reflink (copy on write), copy, or auto to reflink where the filesystem allows"
+    )
+    parser.add_argument(
+        "--flush-timeout", type=float, default=60.0,
+        help="seconds to wait for the server to confirm save-all flush, 0 to not wait"
+    )
+    parser.add_argument(
+        "--space-margin", type=float, default=0.1,
+        help="free space required on top of the predicted archive size, as a fraction of it"
+    )
+    parser.add_argument(
+        "--prune-inhabited", type=float, default=None, metavar="SECONDS",
+        help="leave chunks players spent less than this long in (InhabitedTime) out of full archives,"
+             " 0 for only never visited ones, the game generates them again when they are next loaded"
+    )
+
+    parser.add_argument("--read-mb", type=float, default=0, help="source read bandwidth in MiB/s, 0 for unlimited")
+    parser.add_argument("--write-mb", type=float, default=0, help="archive write bandwidth in MiB/s, 0 for unlimited")
+    parser.add_argument("--nice", type=int, default=0, help="niceness to archive and compress at, 0 leaves it as is")
+    parser.add_argument(
+        "--ionice", default=None, choices=sorted(throttle.IONICE_CLASSES),
+        help="io scheduling class to archive at, idle only gets the disk when nothing else wants it"
+    )
+    parser.add_argument(
+        "--max-load", type=float, default=None,
+        help="halve the read/write rates while the load average per cpu is above this, ramp back up below it"
+    )
+    parser.add_argument(
+        "--min-tps", type=float, default=None,
+        help="halve the read/write rates while the server reports fewer ticks per second than this (needs --rcon)"
+    )
+    parser.add_argument(
+        "--tps-command", default="tps", help="console command answering the server's tps, 'tick query' on vanilla"
+    )
+
+    parser.add_argument(
+        "--s3-bucket", default=None,
+        help="replicate every archive to this bucket while it is written, credentials the usual boto3 way"
+    )
+    parser.add_argument("--s3-prefix", default=None, help="key prefix, defaults to the container name")
+    parser.add_argument("--s3-endpoint", default=None, help="endpoint url of an S3 compatible store (MinIO...)")
+    parser.add_argument("--s3-region", default=None)
+    parser.add_argument("--s3-part-mb", type=int, default=16, help="multipart upload part size, at least 5")
+    parser.add_argument("--s3-workers", type=int, default=4, help="parts uploaded at once")
+
+    parser.add_argument(
+        "--metrics-dir", default=None,
+        help="write a json report and a prometheus textfile (per phase seconds, bytes, throughput) of every run here"
+    )
+    parser.add_argument(
+        "--profile", default=None, choices=metrics_core.PROFILERS,
+        help="profile the run, results next to the metrics report (or in save-dir)"
+    )
+
+    parser.add_argument("--keep-last", type=int, default=None, help="retention: always keep the newest N")
+    for period in retention.PERIODS:
+        parser.add_argument(
+            f"--keep-{period}", type=int, default=None,
+            help=f"retention: keep the newest archive of each of the last N {period} periods"
+        )
+    parser.add_argument(
+        "--max-total-gb", type=float, default=None, help="retention: delete the oldest archives past this total size"
+    )
+
+    commands = parser.add_subparsers(dest="command")
+    restore_snapshot = commands.add_parser("restore-snapshot", help="rebuild an incremental snapshot")
+    restore_snapshot.add_argument("snapshot", help="snapshot name, or latest")
+    restore_snapshot.add_argument("target", help="directory to rebuild the world into")
+    restore_snapshot.add_argument("patterns", nargs="*", help="only restore paths matching these globs")
+    restore_regions = commands.add_parser("restore-regions", help="rebuild a region delta snapshot")
+    restore_regions.add_argument("snapshot", help="snapshot name, or latest")
+    restore_regions.add_argument("target", help="directory to rebuild the world into")
+    prune_command = commands.add_parser("prune", help="apply the retention options now, without taking a backup")
+    prune_command.add_argument("--dry-run", action="store_true", help="only list the archives that would be deleted")
+    restore_command = commands.add_parser(
+        "restore", help="extract files from an archive, only the blocks holding them are read when it has an index"
+    )
+    restore_command.add_argument("archive", help="archive path, file name in save-dir, or latest")
+    restore_command.add_argument(
+        "patterns", nargs="*", help="globs relative to the world directory (e.g. world/playerdata/*.dat), all if unset"
+    )
+    restore_target = restore_command.add_mutually_exclusive_group()
+    restore_target.add_argument("--target", default=None, help="staging directory to extract into")
+    restore_target.add_argument(
+        "--into-container", default=None, metavar="CONTAINER",
+        help="extract into the /data volume of this container, which has to be stopped"
+    )
+    catalog_command = commands.add_parser("catalog", help="query the archive catalog without scanning save-dir")
+    catalog_command.add_argument(
+        "action", choices=["list", "lookup", "size", "import"],
+        help="list archives, lookup the one holding a world at a time, total size, or import archives not yet in it"
+    )
+    catalog_command.add_argument("--world", default=None, help="container name or source directory")
+    catalog_command.add_argument(
+        "--at", default=None, help="lookup: ISO date and time, UTC, e.g. 2024-05-01T12:00, defaults to now"
+    )
+    catalog_command.add_argument("--limit", type=int, default=None, help="list: newest N only")
+    upload_command = commands.add_parser(
+        "upload", help="copy archives to the --s3-bucket, resuming an interrupted upload where it stopped"
+    )
+    upload_command.add_argument("archives", nargs="+", help="archive paths, file names in save-dir, or latest")
+    hot_snapshot_command = commands.add_parser(
+        "hot-snapshot",
+        help="append changed level.dat, playerdata, advancements and stats to the hot pack, no pause, no docker"
+    )
+    hot_snapshot_command.add_argument(
+        "--keep-versions", type=int, default=hot_pack.KEEP_VERSIONS,
+        help="newest versions of each file compaction keeps"
+    )
+    hot_snapshot_command.add_argument(
+        "--keep-hours", type=float, default=hot_pack.KEEP_SECONDS / 3600,
+        help="every version stored within this many hours is kept as well"
+    )
+    hot_restore = commands.add_parser("hot-restore", help="restore one player's files from the hot pack")
+    hot_restore.add_argument("uuid", help="player uuid, as in playerdata/<uuid>.dat")
+    hot_restore.add_argument(
+        "--target", default=None, help="directory to restore into, defaults to --source (the player must be offline)"
+    )
+    hot_restore.add_argument("--at", default=None, help="ISO date and time, UTC, the newest versions at or before it")
+    hot_restore.add_argument("--list", action="store_true", help="only list the stored versions")
+    recompact_command = commands.add_parser(
+        "recompact",
+        help="at idle priority, re-encode aged archives at a high ratio and merge aged incrementals into full archives"
+    )
+    recompact_command.add_argument(
+        "--to-codec", default=None, choices=sorted(set(compression.CODECS) - {"none"}),
+        help="codec to re-encode to, zstd if installed, else gzip"
+    )
+    recompact_command.add_argument("--to-level", type=int, default=None, help="level to re-encode at, the codec's best")
+    recompact_command.add_argument(
+        "--min-age-days", type=float, default=recompact.DEFAULT_MIN_AGE_DAYS,
+        help="only archives and incremental snapshots older than this"
+    )
+    recompact_command.add_argument(
+        "--no-merge", action="store_true", help="leave incremental snapshots as they are, only re-encode archives"
+    )
+    recompact_command.add_argument("--dry-run", action="store_true", help="only list what would be rewritten")
+    return parser.parse_args(argv)
+
+
+def retention_policy(settings: dict) -> dict:
+    policy = {period: settings.get(f"keep_{period}") for period in retention.PERIODS}
+    policy["last"] = settings.get("keep_last")
+    if settings.get("max_total_gb"):
+        policy["max_bytes"] = int(settings["max_total_gb"] * 1024 ** 3)
+    return policy
+
+
+def apply_retention(save_dir: str, policy: dict, dry_run: bool = False) -> dict:
+    # incremental and region snapshots first, whose shared chunks / packs are only freed once no remaining
+    # snapshot references them, then archives by policy, with what the stores still hold counted against max_bytes
+    result = {"deleted": [], "freed": 0}
+    if not dry_run and os.path.isdir(chunk_store_dir(save_dir)):
+        store = ChunkStore(chunk_store_dir(save_dir))
+        deleted = retention.prune_snapshots(store.snapshot_names(), store.delete_snapshot, policy)
+        if deleted:
+            result["deleted"] += deleted
+            result["freed"] += store.collect_garbage()
+    if not dry_run and os.path.isdir(region_store_dir(save_dir)):
+        regions = RegionDeltaStore(region_store_dir(save_dir))
+        freed = []
+        result["deleted"] += retention.prune_snapshots(
+            regions.snapshot_names(), lambda name: freed.append(regions.delete_snapshot(name)), policy
+        )
+        result["freed"] += sum(freed)
+    archives = retention.prune(retention.ArchiveIndex(save_dir), policy, dry_run, other_bytes=store_bytes(save_dir))
+    if dry_run:
+        return archives
+    if archives["deleted"] and os.path.exists(catalog.catalog_file(save_dir)):
+        with catalog.Catalog(catalog.catalog_file(save_dir)) as backup_catalog:
+            backup_catalog.remove(archives["deleted"])
+    result["deleted"] = archives["deleted"] + result["deleted"]
+    result["freed"] += archives["freed"]
+    if result["deleted"]:
+        logger.write(f"Retention deleted {len(result['deleted'])}, freed {sizeof_fmt(result['freed'])}:\n\t"
+                     + "\n\t".join(result["deleted"]))
+    return result
+
+
+def make_room(save_dir: str, needed: int) -> dict:
+    # oldest archives go until needed bytes are free, for a backup that doesn't fit after the policy ran
+    result = retention.make_room(retention.ArchiveIndex(save_dir), needed)
+    if result["deleted"] and os.path.exists(catalog.catalog_file(save_dir)):
+        with catalog.Catalog(catalog.catalog_file(save_dir)) as backup_catalog:
+            backup_catalog.remove(result["deleted"])
+    if result["deleted"]:
+        logger.write(f"Made room for the backup, deleted {len(result['deleted'])},"
+                     f" freed {sizeof_fmt(result['freed'])}:\n\t" + "\n\t".join(result["deleted"]))
+    return result
+
+
+def store_bytes(save_dir: str) -> int:
+    # everything the chunk and region stores and the hot packs hold, they share the max_bytes budget with the archives
+    total = 0
+    for directory in (chunk_store_dir(save_dir), region_store_dir(save_dir)):
+        if os.path.isdir(directory):
+            total += sum(entry.size for entry in FileIO.scan_tree(directory).values() if not entry.is_dir)
+    if os.path.isdir(save_dir):
+        with os.scandir(save_dir) as entries:
+            total += sum(
+                entry.stat().st_size for entry in entries
+                if entry.name.startswith("hot.") and entry.name.endswith(".pack") and entry.is_file()
+            )
+    return total
+
+
+def chunk_store_dir(save_dir: str) -> str:
+    return FileIO.path_join(save_dir, "chunk_store")
+
+
+def region_store_dir(save_dir: str) -> str:
+    return FileIO.path_join(save_dir, "region_store")
+
+
+def restore_snapshot(args: argparse.Namespace):
+    restored = ChunkStore(chunk_store_dir(args.save_dir)).restore(args.snapshot, args.target, args.patterns)
+    logger.write(f"Restored {restored} files from snapshot {args.snapshot} into {args.target}")
+    print(f"restored {restored} files into {args.target}")
+
+
+def hot_snapshot(args: argparse.Namespace):
+    FileIO.mkdir(args.save_dir)
+    with hot_pack.HotPack(hot_pack_file(args.save_dir, args.source)) as pack:
+        stats = pack.snapshot(args.source)
+        compacted = pack.compact(args.keep_versions, args.keep_hours * 3600)
+    message = (
+        f"Hot snapshot: {stats['appended']} of {stats['files']} files changed, {sizeof_fmt(stats['bytes'])}"
+        f" appended, {stats['unsettled']} being written, in {stats['seconds']:.3f} seconds"
+    )
+    if compacted["rewritten"]:
+        message += (
+            f"\ncompacted: {compacted['dropped']} old versions dropped,"
+            f" {sizeof_fmt(compacted['before'])} to {sizeof_fmt(compacted['after'])}"
+        )
+    logger.write(message)
+    print(message)
+
+
+def hot_restore(args: argparse.Namespace):
+    pack_file = hot_pack_file(args.save_dir, args.source)
+    if not os.path.exists(pack_file):
+        print(f"no hot pack for {args.source} in {args.save_dir}")
+        sys.exit(1)
+    at = None
+    if args.at:
+        at = datetime.datetime.fromisoformat(args.at)
+        if at.tzinfo is None:
+            at = at.replace(tzinfo=datetime.timezone.utc)
+        at = at.timestamp()
+    with hot_pack.HotPack(pack_file, writable=False) as pack:
+        paths = pack.player_files(args.uuid)
+        if not paths:
+            print(f"nothing stored for player {args.uuid}")
+            sys.exit(1)
+        if args.list:
+            for each in paths:
+                print(f"{each}\t" + " ".join(pack.describe(version) for version in pack.index[each]))
+            return
+        target = args.target or args.source
+        restored = pack.restore(target, paths, at)
+    message = f"Restored {len(restored)} files of player {args.uuid} into {target}:\n\t" + "\n\t".join(restored)
+    logger.write(message)
+    print(message)
+
+
+def recompact_archives(args: argparse.Namespace) -> dict:
+    if FileIO.verify_dir(args.save_dir) != 1:
+        print(f"no backup directory at {args.save_dir}")
+        sys.exit(1)
+    # idle cpu and disk priority whatever --nice and --ionice say, recompaction never competes with the server
+    governor = throttle.Governor(
+        write_rate=(args.write_mb or 0) * 1024 * 1024, nice=19, io_class="idle",
+        max_load=args.max_load if args.write_mb else None
+    )
+    governor.apply_priority()
+    store = ChunkStore(chunk_store_dir(args.save_dir)) if os.path.isdir(chunk_store_dir(args.save_dir)) else None
+    recompactor = recompact.Recompactor(
+        args.save_dir, codec=args.to_codec, level=args.to_level, workers=args.workers,
+        min_age_days=args.min_age_days, chunk_store=store, limiter=governor.write_limiter, source=args.source
+    )
+    with governor:
+        report = recompactor.run(merge=not args.no_merge, dry_run=args.dry_run)
+    if args.dry_run:
+        print("\n".join(report["candidates"] + [f"merge: {' '.join(each)}" for each in report["runs"]])
+              or "nothing to recompact")
+        return report
+    lines = [
+        f"{os.path.basename(each['replaced'])} -> {os.path.basename(each['name'])}:"
+        f" {sizeof_fmt(each['before'])} -> {sizeof_fmt(each['after'])}" + ("" if each["shrunk"] else " (kept)")
+        for each in report["archives"]
+    ] + [
+        f"merged {len(each['snapshots'])} snapshots into {os.path.basename(each['name'])}: {sizeof_fmt(each['after'])}"
+        for each in report["merged"]
+    ]
+    # sizeof_fmt doesn't do negative numbers, merges can cost more than the chunks they free
+    reclaimed = report["reclaimed"]
+    message = (
+        f"Recompacted to {recompactor.codec} {recompactor.level} in {report['seconds']:.2f} seconds:\n\t"
+        + "\n\t".join(lines or ["nothing to recompact"])
+        + f"\n\t{'reclaimed' if reclaimed >= 0 else 'grew by'}: {sizeof_fmt(abs(reclaimed))}"
+        f", {sizeof_fmt(max(0, recompactor.state['reclaimed']))} reclaimed in total"
+    )
+    logger.write(message)
+    print(message)
+    return report
+
+
+def resolve_archive(save_dir: str, name: str, world: str = None) -> str:
+    # a path, a file name in save_dir, or latest (newest in the catalog, of world if given)
+    if name == "latest":
+        with catalog.Catalog(catalog.catalog_file(save_dir)) as backup_catalog:
+            newest = backup_catalog.list(world, limit=1)
+        if not newest:
+            raise FileNotFoundError(f"no archives in the catalog of {save_dir}")
+        return newest[0]["path"]
+    if os.path.exists(name):
+        return name
+    return FileIO.path_join(save_dir, name)
+
+
+def restore_archive(args: argparse.Namespace):
+    if args.into_container:
+        # straight into the server's volume, only while the server can't overwrite it or hold it open
+        if container_running(args.into_container):
+            print(f"{args.into_container} is running, stop it before restoring into its volume")
+            sys.exit(1)
+        target = container_data_dir(args.into_container)
+        if not target:
+            print(f"no /data volume found for {args.into_container}")
+            sys.exit(1)
+    elif args.target:
+        target = args.target
+    else:
+        print("restore needs --target or --into-container")
+        sys.exit(1)
+    archive_name = resolve_archive(args.save_dir, args.archive, args.into_container)
+    started = time.monotonic()
+    stats = restore.extract(archive_name, target, args.patterns)
+    message = (
+        f"Restored {stats['files']} files ({sizeof_fmt(stats['bytes'])}) from {archive_name} into {target}"
+        f" in {time.monotonic() - started:.2f} seconds{'' if stats['random_access'] else ', sequential read'}"
+    )
+    logger.write(message)
+    print(message)
+
+
+def format_catalog_entry(entry: dict) -> str:
+    created = datetime.datetime.utcfromtimestamp(entry["created"]).strftime('%Y-%b-%d-%H.%M.%S')
+    ratio = f"{entry['ratio']:.2f}" if entry["ratio"] is not None else "-"
+    return (
+        f"{entry['name']}\t{created}\t{sizeof_fmt(entry['size'])}\tmembers: {entry['members'] or '-'}"
+        f"\tratio: {ratio}\t{entry['container'] or entry['source'] or '-'}"
+    )
+
+
+def query_catalog(args: argparse.Namespace):
+    if FileIO.verify_dir(args.save_dir) != 1:
+        print(f"no backup directory at {args.save_dir}")
+        sys.exit(1)
+    with catalog.Catalog(catalog.catalog_file(args.save_dir)) as backup_catalog:
+        if args.action == "import":
+            print(f"imported {backup_catalog.import_directory(args.save_dir)} archives")
+        elif args.action == "size":
+            print(f"{backup_catalog.count()} archives, {sizeof_fmt(backup_catalog.total_size())}")
+        elif args.action == "lookup":
+            if not args.world:
+                print("lookup needs --world")
+                sys.exit(1)
+            at = datetime.datetime.fromisoformat(args.at) if args.at else datetime.datetime.utcnow()
+            if at.tzinfo is None:
+                at = at.replace(tzinfo=datetime.timezone.utc)
+            entry = backup_catalog.lookup(args.world, at.timestamp())
+            if entry is None:
+                print(f"no archive of {args.world} at or before {at}")
+                sys.exit(1)
+            print(format_catalog_entry(entry))
+            print(f"path: {entry['path']}\nsha256: {entry['checksum'] or '-'}")
+        else:
+            for entry in backup_catalog.list(args.world, args.limit):
+                print(format_catalog_entry(entry))
+
+
+def main(argv: list = None):
     
-    # TODO argparse container name, world_dir, log_dir, debug, help info et al
-    # Maybe do as config file
-    container = "minecraft18_mc-server_1"
-    source_dir = f"{current_dir}{os.path.sep}minecraft_data"
-    save_dir = f"{current_dir}{os.path.sep}world_backups"
+    # TODO: debug, help info et al
+    args = parse_args(argv)
+    logger.write("logging initialized", "info")
+    if args.codec is not None:
+        # fail before touching the server if the codec isn't installed
+        compression.check_codec(args.codec)
+    if args.command == "restore-snapshot":
+        restore_snapshot(args)
+        return
+    if args.command == "prune":
+        if FileIO.verify_dir(args.save_dir) != 1:
+            print(f"no backup directory at {args.save_dir}")
+            sys.exit(1)
+        result = apply_retention(args.save_dir, retention_policy(vars(args)), args.dry_run)
+        print("\n".join(result["deleted"]) or "nothing to delete")
+        print(f"{'would free' if args.dry_run else 'freed'}: {sizeof_fmt(result['freed'])}")
+        return
+    if args.command == "restore":
+        restore_archive(args)
+        return
+    if args.command == "catalog":
+        query_catalog(args)
+        return
+    if args.command == "upload":
+        upload_archives(args)
+        return
+    if args.command == "recompact":
+        recompact_archives(args)
+        return
+    if args.command == "hot-snapshot":
+        hot_snapshot(args)
+        return
+    if args.command == "hot-restore":
+        hot_restore(args)
+        return
+    if args.command == "restore-regions":
+        rebuilt = region_restore(region_store_dir(args.save_dir), args.snapshot, args.target)
+        logger.write(f"Restored {rebuilt} region files from snapshot {args.snapshot} into {args.target}")
+        print(f"rebuilt {rebuilt} region files into {args.target}")
+        return
+    backup_world(vars(args))
+
+
+def export_metrics(metrics: metrics_core.RunMetrics, metrics_dir: str):
+    # a json report per run, and one textfile per world the node_exporter textfile collector picks up
+    os.makedirs(metrics_dir, exist_ok=True)
+    metrics.write_json(f"{metrics_core.report_name(metrics_dir, metrics.container)}.json")
+    metrics.write_prometheus(
+        FileIO.path_join(metrics_dir, f"{metrics_core.METRIC_PREFIX}_{metrics.container}.prom")
+    )
+
+
+def build_governor(settings: dict) -> throttle.Governor:
+    # the orchestrator hands every world the same read bucket (limiter), so its limit holds across all of them
+    container = settings["container"]
+    tps_command = settings.get("tps_command") or "tps"
+    return throttle.Governor(
+        read_rate=(settings.get("read_mb") or 0) * 1024 * 1024,
+        write_rate=(settings.get("write_mb") or 0) * 1024 * 1024,
+        nice=settings.get("nice") or 0,
+        io_class=settings.get("ionice"),
+        max_load=settings.get("max_load"),
+        min_tps=settings.get("min_tps"),
+        tps_probe=lambda: throttle.parse_tps(server_control.get_control(container).command(tps_command)),
+        read_limiter=settings.get("limiter"),
+    )
+
+
+def backup_world(settings: dict) -> bool:
+    """
+    One full backup lifecycle of one world: space check, pause, archive, resume.
+    :param settings: parse_args destinations (container, source, save_dir, codec...), plus an optional limiter
+    :return: True if the backup ran, False if it was skipped or failed
+    """
+    container = settings["container"]
+    metrics = metrics_core.RunMetrics(container)
+    metrics_dir = settings.get("metrics_dir")
+    profile_prefix = metrics_core.report_name(metrics_dir or settings["save_dir"], container)
+    with metrics_core.profiling(settings.get("profile"), profile_prefix):
+        succeeded = attempt_backup(settings, metrics)
+    metrics.fields["success"] = succeeded
+    summary = ", ".join(f"{each['phase']} {each['seconds']:.2f}s" for each in metrics.phases)
+    logger.write(f"{container} phases: {summary}, peak rss {sizeof_fmt(metrics_core.peak_rss())}")
+    if metrics_dir:
+        export_metrics(metrics, metrics_dir)
+    return succeeded
+
+
+def attempt_backup(settings: dict, metrics: metrics_core.RunMetrics) -> bool:
+    # backup_world without the instrumentation around it
+    container = settings["container"]
+    server_control.configure(container, settings.get("rcon"), os.environ.get("RCON_PASSWORD", ""))
+    source_dir = settings["source"]
+    save_dir = settings["save_dir"]
     backup_directory_verified = verify_backup_directory(save_dir)
     if DEBUG:
         print(f"backup directory verified:{backup_directory_verified}")
     # get the date as a string i.e $(date +%Y-%b-%d-%H.%M.%S)
     date_string = datetime.datetime.utcnow().strftime('%Y-%b-%d-%H.%M.%S')
-    backup_filename = f"{date_string}.tar.gz"
-    
+    backup_filename = f"{date_string}{compression.archive_suffix(settings.get('codec') or 'gzip')}"
+    archive_options = {
+        "codec": settings.get("codec"),
+        "level": settings.get("level"),
+        "workers": settings.get("workers")
+    }
+    governor = build_governor(settings)
+    if governor.read_limiter is not None:
+        archive_options["limiter"] = governor.read_limiter
+    if governor.write_limiter is not None:
+        archive_options["write_limiter"] = governor.write_limiter
+
     # TODO: user defined overwrite or write protected if exists
     mode = "w:gz"
     try:
-        max_file_size = get_max_file_size(save_dir)
+        policy = retention_policy(settings)
+        if retention.has_policy(policy):
+            # old archives go before the space check, a tight disk is exactly when the policy has to have run
+            apply_retention(save_dir, policy)
+        # only a full archive is predicted and reserved, the stores only grow by what changed. its one scan of the
+        # world feeds the codec plan, the prediction and the archiver
+        full = not settings.get("incremental") and not settings.get("regions")
+        scan = (FileIO.scan_tree(source_dir) if os.path.isdir(source_dir) else {}) if full else None
+        pruner = build_pruner(settings)
+        if pruner is not None:
+            archive_options["pruner"] = pruner
+        controller = build_codec_controller(settings)
+        if controller is not None:
+            with metrics.phase("plan") as phase:
+                plan = controller.prepare(source_dir, scan)
+                phase.update(codec=plan["codec"], levels=plan["levels"])
+            archive_options.update(
+                codec=plan["codec"], level=plan["level"], workers=plan["workers"], controller=controller
+            )
+            backup_filename = f"{date_string}{compression.archive_suffix(plan['codec'])}"
+            logger.write(
+                f"{container}: {plan['codec']} on {plan['workers']} workers, levels {plan['levels']},"
+                f" predicted {sizeof_fmt(plan['predicted_bytes'])} in {plan['predicted_seconds']:.1f} seconds"
+            )
+        estimator = None
+        required = 0
+        if full:
+            # predicted from a sample of the world compressed with the codec, corrected by how past predictions did
+            estimator = estimate.SpaceEstimator(
+                estimate_file(save_dir, source_dir), archive_options["codec"], mode, archive_options["level"]
+            )
+            with metrics.phase("estimate") as phase:
+                prediction = estimator.predict(source_dir, settings.get("space_margin", 0.1), scan=scan)
+                phase.update(bytes=prediction["source_bytes"], sampled=prediction["sampled"])
+            metrics.fields["predicted_bytes"] = prediction["predicted"]
+            required = prediction["reserve"]
+            # the full archive gets its space up front
+            archive_options.update(reserve=required, scan=scan)
+            if DEBUG:
+                print(f"required space: {sizeof_fmt(required)}")
+        free = shutil.disk_usage(save_dir).free
+        if free < required and retention.has_policy(policy):
+            # the policy alone didn't leave enough, older archives go before this one is given up
+            make_room(save_dir, required - free)
+            free = shutil.disk_usage(save_dir).free
         if DEBUG:
-            
-            print(f"required space: {sizeof_fmt(max_file_size)}")
-            print(f"backup space available:{shutil.disk_usage(save_dir).free >= (max_file_size * 2)}")
-        if shutil.disk_usage(save_dir).free >= (max_file_size * 2):
+            print(f"backup space available:{free >= required}")
+        if free >= required:
             world_echo(container, "free space verified for backups, attempting backup")
-            do_backup(container, backup_filename, mode, source_dir, save_dir)
+            if estimator is not None:
+                logger.write(
+                    f"{container}: predicted archive {sizeof_fmt(prediction['predicted'])} of"
+                    f" {sizeof_fmt(prediction['source_bytes'])}, ratio {prediction['ratio']:.3f}"
+                    f" x {prediction['correction']:.3f}, reserving {sizeof_fmt(required)}"
+                )
+            priority = governor.apply_priority()
+            if priority:
+                logger.write(f"{container}: archiving at {priority}")
+            with governor:
+                do_backup(
+                    container, backup_filename, mode, source_dir, save_dir, archive_options,
+                    chunk_store=chunk_store_dir(save_dir) if settings.get("incremental") else None,
+                    region_store=region_store_dir(save_dir) if settings.get("regions") else None,
+                    snapshot_dir=settings.get("snapshot_dir"),
+                    snapshot_method=settings.get("snapshot_method", "auto"),
+                    flush_timeout=settings.get("flush_timeout", 60.0),
+                    metrics=metrics,
+                    offsite_target=build_offsite_target(settings),
+                    changes=settings.get("changes")
+                )
+            metrics.fields["throttle_backoffs"] = governor.backoffs
+            if controller is not None and controller.outcome is not None:
+                metrics.fields.update(
+                    codec=controller.outcome["codec"], within_budget=controller.outcome["within_budget"]
+                )
+            if os.path.exists(FileIO.path_join(save_dir, backup_filename)):
+                retention.ArchiveIndex(save_dir).record(backup_filename)
+                # an archive of pruned regions is smaller than the world predicted from, it would skew the correction
+                if estimator is not None and pruner is None:
+                    estimator.learn(os.path.getsize(FileIO.path_join(save_dir, backup_filename)))
+            return True
         else:
             world_echo(container, "Lacking disk space, please cleanup backups or increase partition")
+            return False
         
     except Exception as e:
         world_save_resume(container)
         world_echo(container, "Aborting backup\nResumed saving world\nError during backup")
-        logger.write(str(e.with_traceback))
+        logger.write(f"{container}: {e!r}", "error")
+        return False
 
 
 if __name__ == '__main__':
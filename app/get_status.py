@@ -1,50 +1,161 @@
 # https://api.mcsrvstat.us/2/73.5.182.165
 
-import requests
-import json
+import argparse
+import asyncio
+import threading
 from ipaddress import ip_address
 
-# TODO: caching
+# only the mcsrvstat path needs requests, direct pings are standard library only
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:
+    requests = None
+
+from app.core import server_ping
+from app.core.cache import TTLCache
+
+# endpoints are module level so tests (or a self hosted mirror) can point them elsewhere
+STATUS_API = "https://api.mcsrvstat.us/2/{}"
+PUBLIC_IP_API = {
+    4: "http://ipv4.icanhazip.com",
+    6: "http://ipv6.icanhazip.com"
+}
+# (connect, read) seconds, a hung endpoint must not hang the dashboard
+TIMEOUT = (3.05, 10)
+POOL_SIZE = 32
+
+PING_TIMEOUT = 3.0
+REQUEST_ERRORS = (ValueError, requests.RequestException) if requests is not None else (ValueError,)
+
+# mcsrvstat itself caches for about a minute, polling it faster only returns the same answer
+status_cache = TTLCache(ttl=60, max_entries=1024)
+# a direct ping is milliseconds, only keep it long enough to absorb bursts of dashboard requests
+ping_cache = TTLCache(ttl=5, max_entries=1024)
+public_ip_cache = TTLCache(ttl=300, max_entries=2)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> "requests.Session":
+    # one pooled session per process, keep-alive connections are reused across calls and poller threads
+    global _session
+    if requests is None:
+        raise ImportError("the mcsrvstat api needs requests: pip install requests, or use direct pings")
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def _fetch_public_ip(v: int) -> dict:
+    response = get_session().get(PUBLIC_IP_API[v], timeout=TIMEOUT)
+    response.raise_for_status()
+    address = response.text.strip()
+    # raises ValueError if the response isn't an address
+    ip_address(address)
+    return {"type": v, "address": address}
 
 
 def get_public_ip(v: int = 4) -> dict:
-    # TODO: branch ip
     try:
-        # should add check to verify formatting
-        url = {
-            4: "http://ipv4.icanhazip.com",
-            6: "http://ipv6.icanhazip.com"
-        }
-        ip = requests.request("get", f"{url[v]}")
-
-        # return {"type": v, "address": ip.text.strip()}
-        if ip_address(ip.text.strip()):
-            return {"type": v, "address": ip.text.strip()}
-        else:
-            return {"type": 0, "address": "0.0.0.0"}
-    except ValueError:
+        return public_ip_cache.get_or_load(v, lambda: _fetch_public_ip(v))
+    except REQUEST_ERRORS:
+        # not cached, the next call tries again
         return {"type": 0, "address": "0.0.0.0"}
 
 
-def get_status(ip: str = "127.0.0.1") -> json:
-    # todo: branch status
-    # mcsrvstat seems to support fqdn or ipv4, but not ipv6
-    data = requests.request("get", f"https://api.mcsrvstat.us/2/{ip}")
-    # data = "{success}"
-    print(data.text)
-    status = json.loads(data.text)
-    return status
-
-
-def main():
-    ip_info = get_public_ip()
-    print(ip_info)
-    if ip_info["type"] == 4:
-        status = get_status(ip_info["address"])
-        print(status)
-    else:
-        raise ValueError
-    
+def _fetch_status(ip: str) -> dict:
+    response = get_session().get(STATUS_API.format(ip), timeout=TIMEOUT)
+    response.raise_for_status()
+    # parsed once, straight from the body
+    return response.json()
+
+
+def get_status(ip: str = "127.0.0.1", max_age: float = None, direct: bool = False) -> dict:
+    """
+    :param ip: server address, mcsrvstat seems to support fqdn or ipv4, but not ipv6, direct pings handle both
+    :param max_age: seconds a cached status may be old, the cache ttl if None, 0 forces a refresh
+    :param direct: ping the server itself (app.core.server_ping) instead of asking api.mcsrvstat.us
+    :return: the mcsrvstat status dict, concurrent callers for the same ip share one request
+    """
+    cache = ping_cache if direct else status_cache
+    if max_age == 0:
+        cache.invalidate(ip)
+    if direct:
+        return cache.get_or_load(ip, lambda: asyncio.run(server_ping.ping(ip, PING_TIMEOUT)), max_age=max_age)
+    return cache.get_or_load(ip, lambda: _fetch_status(ip), max_age=max_age)
+
+
+async def poll_once(servers: list, concurrency: int = POOL_SIZE, direct: bool = False) -> dict:
+    # refreshes every server concurrently, at most concurrency at a time
+    if direct:
+        # already async, no threads needed, and each host has its own timeout
+        statuses = await server_ping.ping_many(servers, PING_TIMEOUT, concurrency)
+        for server, status in statuses.items():
+            ping_cache.put(server, status)
+        return statuses
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one(server: str):
+        async with limit:
+            try:
+                # the blocking requests run on threads
+                return server, await asyncio.to_thread(get_status, server)
+            except REQUEST_ERRORS as e:
+                return server, {"online": False, "error": repr(e)}
+
+    return dict(await asyncio.gather(*(one(each) for each in servers)))
+
+
+async def poll(servers: list, interval: float = 60.0, on_update=None, rounds: int = None, direct: bool = False):
+    """
+    :param servers: addresses to keep refreshed
+    :param interval: seconds between rounds, the cache keeps anything asked for in between from hitting the api
+    :param on_update: called with the {server: status} dict after every round
+    :param rounds: stop after this many rounds, forever if None
+    :param direct: ping the servers themselves instead of asking api.mcsrvstat.us
+    """
+    done = 0
+    while rounds is None or done < rounds:
+        statuses = await poll_once(servers, direct=direct)
+        if on_update is not None:
+            on_update(statuses)
+        done += 1
+        if rounds is None or done < rounds:
+            await asyncio.sleep(interval)
+
+
+def print_statuses(statuses: dict):
+    for server, status in statuses.items():
+        players = status.get("players", {})
+        print(f"{server}\tonline: {status.get('online', False)}\tplayers: {players.get('online', '-')}")
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Minecraft server status, through api.mcsrvstat.us or directly")
+    parser.add_argument("servers", nargs="*", help="addresses to check, this host's public ip if none")
+    parser.add_argument("--interval", type=float, default=None, help="keep polling every N seconds")
+    parser.add_argument(
+        "--direct", action="store_true", help="ping the servers directly (server list ping) instead of the api"
+    )
+    args = parser.parse_args(argv)
+
+    servers = args.servers
+    if not servers:
+        ip_info = get_public_ip()
+        print(ip_info)
+        if ip_info["type"] != 4:
+            raise ValueError
+        servers = [ip_info["address"]]
+    asyncio.run(
+        poll(servers, args.interval or 0, print_statuses, rounds=None if args.interval else 1, direct=args.direct)
+    )
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# standard libraries included in python
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+# local file imports
+from app import docker_world_backup as dwb
+from app.core import config as config_io
+from app.core.throttle import TokenBucket
+
+logger = dwb.logger
+
+
+class WorkerBudget:
+    """
+    Global pool of compression worker slots for the event loop.
+    A backup reserves every slot it needs in one go, so two half-started backups can never deadlock each other.
+    """
+
+    def __init__(self, total: int):
+        self.total = max(1, int(total))
+        self.__free = self.total
+        self.__condition = asyncio.Condition()
+
+    async def acquire(self, count: int) -> int:
+        count = max(1, min(int(count), self.total))
+        async with self.__condition:
+            await self.__condition.wait_for(lambda: self.__free >= count)
+            self.__free -= count
+        return count
+
+    async def release(self, count: int):
+        async with self.__condition:
+            self.__free += count
+            self.__condition.notify_all()
+
+
+def world_settings(world: dict, defaults: dict) -> dict:
+    # command line defaults, then the config defaults, then the world's own entry
+    settings = vars(dwb.parse_args([]))
+    settings.update(defaults)
+    settings.update(world)
+    if "save_dir" not in world:
+        # worlds sharing the default save_dir get a directory each, archive names are only unique per second
+        settings["save_dir"] = os.path.join(settings["save_dir"], str(world["container"]))
+    return settings
+
+
+def discover_worlds(image_filter: str) -> list:
+    worlds = []
+    for container in dwb.list_containers(image_filter):
+        source = dwb.container_data_dir(container)
+        if source:
+            worlds.append({"container": container, "source": source})
+        else:
+            logger.write(f"{container}: no /data volume found, skipping", "warning")
+    return worlds
+
+
+async def backup_one(settings: dict, budget: WorkerBudget, limiter: TokenBucket = None) -> dict:
+    # the single core tarfile path only ever needs one slot
+    requested = (settings.get("workers") or budget.total) if settings.get("codec") else 1
+    workers = await budget.acquire(requested)
+    settings = dict(settings, workers=workers, limiter=limiter)
+    start = time.monotonic()
+    try:
+        # pause, flush, archive and resume run in a thread per world, the event loop only does the scheduling
+        succeeded = await asyncio.to_thread(dwb.backup_world, settings)
+    except BaseException as e:
+        logger.write(f"{settings['container']}: {e!r}", "error")
+        succeeded = False
+    finally:
+        await budget.release(workers)
+    return {"container": settings["container"], "succeeded": succeeded, "seconds": time.monotonic() - start}
+
+
+async def orchestrate(worlds: list, max_workers: int, disk_bandwidth_mb: float = 0) -> list:
+    """
+    :param worlds: settings dicts, see world_settings
+    :param max_workers: compression processes shared by every backup at once
+    :param disk_bandwidth_mb: combined read bandwidth in MiB/s, 0 for unlimited
+    :return: one result dict per world, in the order given
+    """
+    budget = WorkerBudget(max_workers)
+    limiter = TokenBucket(disk_bandwidth_mb * 1024 * 1024) if disk_bandwidth_mb else None
+    return await asyncio.gather(*(backup_one(each, budget, limiter) for each in worlds))
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Backup every minecraft world on this host concurrently")
+    parser.add_argument("--config", default="backup_config.json", help="json config of worlds and limits")
+    parser.add_argument("--generate-config", action="store_true", help="write a default config and exit")
+    parser.add_argument("--discover", action="store_true", help="also back up running minecraft containers")
+    parser.add_argument("--max-workers", type=int, default=None, help="overrides max_workers from the config")
+    parser.add_argument(
+        "--disk-bandwidth-mb", type=float, default=None, help="overrides disk_bandwidth_mb from the config"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None):
+    args = parse_args(argv)
+    if args.generate_config:
+        created = config_io.generate_config(args.config)
+        print(f"{'created' if created else 'already exists'}: {args.config}")
+        return
+    config = config_io.load_config(args.config) if os.path.exists(args.config) else dict(config_io.DEFAULT_CONFIG)
+
+    worlds = list(config["worlds"])
+    if args.discover or config["discover"]:
+        configured = {each["container"] for each in worlds}
+        worlds += [each for each in discover_worlds(config["discover_image"]) if each["container"] not in configured]
+    if not worlds:
+        print("no worlds configured or discovered, nothing to do")
+        return
+
+    settings = [world_settings(each, config["defaults"]) for each in worlds]
+    max_workers = args.max_workers or config["max_workers"]
+    bandwidth = config["disk_bandwidth_mb"] if args.disk_bandwidth_mb is None else args.disk_bandwidth_mb
+    logger.write(f"Backing up {len(settings)} worlds, {max_workers} workers, {bandwidth or 'unlimited'} MB/s")
+
+    results = asyncio.run(orchestrate(settings, max_workers, bandwidth))
+    for each in results:
+        summary = f"{each['container']}: {'ok' if each['succeeded'] else 'FAILED'} in {each['seconds']:.1f} seconds"
+        print(summary)
+        logger.write(summary)
+    if not all(each["succeeded"] for each in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,11 +5,13 @@ import os
 import platform
 import subprocess
 import sys
-import tarfile
 
 # local file imports
 from app.core.FileIO import FileIO
 from app.core.LogIO import LogHandler
+from app.core import archive as archive_core
+from app.core import compression
+from app.core.Custom_Errors import IntegrityValidationException
 
 # special libraries (pip install requirements.txt)
 # none as of 28/NOV/2021 needed for this file
@@ -20,17 +22,7 @@ LOGGING_DIR = f"{ROOT}{os.path.sep}logs"
 
 # Logging setup
 
-# verify our logging directory exists, otherwise the script tends to break.
-if FileIO.verify_dir(LOGGING_DIR) != 1:
-    try:
-        FileIO.mkdir(LOGGING_DIR)
-        
-    except Exception as e:
-        print(f"failure to create logging directory at: \n\t{LOGGING_DIR}\nexiting")
-        print(f"{e}")
-        exit(-1)
-
-# initialize logger
+# initialize logger, LogHandler creates the logging directory with the first message
 logger = LogHandler(file_name=f"{LOGGING_DIR}{os.path.sep}py_backup_util_log.txt", logging_level="warning")
 
 
@@ -88,15 +80,24 @@ def time_string(format_string: str = "%Y-%b-%d-%H%M%S", timezone: str = "Local")
     return formatted_time
 
 
-def tar_archive(name: str, mode: str, source: str, recursive: bool = True) -> list:
+def tar_archive(
+        name: str,
+        mode: str,
+        source: str,
+        recursive: bool = True,
+        codec: str = None,
+        level: int = None,
+        workers: int = None
+) -> list:
     # return list as we care about representations of the members, not the actual items themselves
     # 28176904 & 4180384
     # the actual archive creation/compression line using tar
     # tar using options:
     # c - CREATE, z - filter through gzip, v - verbose, f - --file = ARCHIVE use file or device ARCHIVE
-    with tarfile.open(name=name, mode=mode) as archive:
-        archive.add(source, recursive=recursive)
-        return archive.getmembers()
+    # codec None keeps tarfile's single core gzip, anything else goes through the block compressor
+    return archive_core.write_archive(
+        name=name, mode=mode, source=source, recursive=recursive, codec=codec, level=level, workers=workers
+    )["members"]
 
 
 def help_info():
@@ -130,6 +131,13 @@ def help_info():
     -in: explicit archive specification
     
     -out: change output directory for current execution
+    
+    -codec: multi core block compression, one of gzip, zstd, lz4 or none.
+    (unset keeps the single core tarfile gzip path, zstd and lz4 need pip install zstandard lz4)
+    
+    -level: compression level for -codec, codec default if unset
+    
+    -workers: compression processes for -codec, defaults to cpu count
    
     FURTHER INFO:
     Supports relative directories i.e. ../
@@ -166,6 +174,9 @@ def main():
     options_dict: dict = {
         "-in": None,
         "-out": None,
+        "-codec": None,
+        "-level": None,
+        "-workers": None,
         "-help": help_info,
         "-version": version,
         "-debug": False,
@@ -256,30 +267,37 @@ def main():
 
         # Call archive method with options specified.
         # https://docs.python.org/3/library/tarfile.html
-        archive = tar_archive(
+        codec = compression.check_codec(options_dict["-codec"]) if options_dict["-codec"] else None
+        archive_name = time_string() + compression.archive_suffix(codec or "gzip")
+        # checksums are taken as the data streams into the tar, validation is a set comparison against the source tree
+        result = archive_core.write_archive(
             # defaults to local, can be changed to "UTC"
-            name=FileIO.path_join(backup_directory, time_string() + '.tar.gz'),
+            name=FileIO.path_join(backup_directory, archive_name),
             # x:gz Create tarfile w/ gzip compression. FileExistsError exception if file exists.
             # w:gz if options_dict["-overwrite"] is true, Create/overwrite tarfile w/ gzip compression.
             mode='w:gz' if options_dict["-overwrite"] else 'x:gz',
             source=options_dict["-in"],
-            recursive=True
+            recursive=True,
+            codec=codec,
+            level=int(options_dict["-level"]) if options_dict["-level"] else None,
+            workers=int(options_dict["-workers"]) if options_dict["-workers"] else None
         )
+        archive = result["members"]
 
         # write results to log file in a formatted text block
-        archive_results = "\n\tArchive created:{}".format(time_string() + '.tar.gz')
-        source_files = FileIO.long_list_files(options_dict["-in"])
-        # DONE: refine logic to verify contents and name automatically
-        for each in archive:
-            archive_results += "\n\t{}".format(str(each))
+        archive_results = "\n\tArchive created:{}\n\tmembers: {}\n\tmanifest: {}".format(
+            archive_name, len(archive), result["manifest"]
+        )
         logger.write(archive_results)
 
-        for each in source_files:
-            item = str(each).split()[1]
-            if item not in str(archive_results):
-                print("failure: {} not found in:\n".format(item, str(archive_results)))
-                logger.write("failure: {} not found in:\n".format(item, str(archive_results)))
-                raise IntegrityValidationException
+        problems = archive_core.verify(result)
+        if problems:
+            failure = "failure: {} problems in {}:\n\t{}".format(
+                len(problems), archive_name, "\n\t".join(problems[:50])
+            )
+            print(failure)
+            logger.write(failure)
+            raise IntegrityValidationException(failure)
 
         if options_dict["-debug"]:
             print("Archive created:\n\t {}".format(time_string()), archive)
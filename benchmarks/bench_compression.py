@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# throughput of the single core tarfile w:gz path against the block compressor codecs
+# python3 -m benchmarks.bench_compression --size-mb 256 --workers 4
+import argparse
+import os
+import tempfile
+import time
+
+from app.core import compression
+from app.world_backup import tar_archive
+from benchmarks.world_gen import generate_world
+
+
+def make_source(target_dir: str, size_mb: int) -> int:
+    # half incompressible (like zlib compressed region chunks), half repetitive (like uncompressed nbt)
+    return generate_world(target_dir, size_mb, compressibility=0.5)["bytes"]
+
+
+def run(source: str, out_dir: str, codec: str = None, level: int = None, workers: int = None) -> dict:
+    name = os.path.join(out_dir, f"bench-{codec or 'tarfile'}{compression.archive_suffix(codec or 'gzip')}")
+    start = time.perf_counter()
+    tar_archive(name=name, mode="w:gz", source=source, codec=codec, level=level, workers=workers)
+    elapsed = time.perf_counter() - start
+    size = os.path.getsize(name)
+    os.remove(name)
+    return {"codec": codec or "tarfile w:gz", "seconds": elapsed, "archive_bytes": size}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="compare archive throughput per codec")
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--level", type=int, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source = os.path.join(temp_dir, "world")
+        os.mkdir(source)
+        total = make_source(source, args.size_mb)
+        results = [run(source, temp_dir)]
+        for codec in compression.available_codecs():
+            results.append(run(source, temp_dir, codec, args.level, args.workers))
+
+    print(f"{'codec':<14}{'seconds':>10}{'MB/s':>10}{'ratio':>8}")
+    for each in results:
+        print(
+            f"{each['codec']:<14}{each['seconds']:>10.2f}"
+            f"{total / each['seconds'] / 1024 / 1024:>10.1f}{each['archive_bytes'] / total:>8.3f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# times the backup path end to end on a generated world and writes the results as json,
+# compare two result files to see what got slower between versions
+# python3 -m benchmarks.suite --size-mb 256 --repeat 5 --output bench_results.json
+# python3 -m benchmarks.suite --compare old.json new.json
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from app import docker_world_backup
+from app.core import compression, estimate, restore, throttle
+from app.core.FileIO import FileIO
+from benchmarks.world_gen import generate_world
+
+RESULTS_VERSION = 1
+
+
+def measure(name: str, body, repeat: int = 3, unit: str = "bytes", **params) -> dict:
+    """
+    :param name: benchmark name, params are added to it as [key=value] so every variant gets its own entry
+    :param body: called once per repeat with the repeat index, returns how many units it processed
+    :param repeat: runs, the minimum is the figure least disturbed by the rest of the machine
+    :param unit: what body counts, "bytes" or "files"
+    :return: one result entry
+    """
+    seconds = []
+    processed = 0
+    # compression workers are counted once the pool has shut down and they've been reaped
+    cpu_started = sum(os.times()[:4])
+    for iteration in range(repeat):
+        started = time.perf_counter()
+        processed = body(iteration) or 0
+        seconds.append(time.perf_counter() - started)
+    cpu_seconds = (sum(os.times()[:4]) - cpu_started) / repeat
+    label = ",".join(f"{key}={value}" for key, value in params.items())
+    return {
+        "name": f"{name}[{label}]" if label else name,
+        "params": params,
+        "seconds": [round(each, 6) for each in seconds],
+        "min": round(min(seconds), 6),
+        "median": round(statistics.median(seconds), 6),
+        "processed": processed,
+        "unit": unit,
+        "per_second": round(processed / min(seconds), 3) if processed and min(seconds) else None,
+        "cpu_seconds": round(cpu_seconds, 6),
+    }
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "codecs": compression.available_codecs(),
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+
+
+def run_suite(
+        work_dir: str,
+        size_mb: float = 64,
+        compressibility: float = 0.5,
+        seed: int = 0,
+        repeat: int = 3,
+        codecs: list = None,
+        workers: int = None,
+        throttle_mb: float = None
+) -> dict:
+    """
+    :param work_dir: scratch directory, the world and every archive are written under it
+    :param size_mb: generated world size
+    :param compressibility: chunk data compressibility, see WorldGenerator
+    :param seed: world generator seed
+    :param repeat: runs per benchmark
+    :param codecs: block codecs to archive with, tarfile's own gzip always runs too, all available if unset
+    :param workers: compression processes
+    :param throttle_mb: read limit of the throttled archive run, half the unthrottled throughput if unset
+    :return: dict of the world, the environment and the results
+    """
+    world_dir = os.path.join(work_dir, "world")
+    world = generate_world(world_dir, size_mb, compressibility, seed)
+    archives_dir = os.path.join(work_dir, "archives")
+    os.makedirs(archives_dir, exist_ok=True)
+    results = []
+
+    codecs = [each for each in (codecs or compression.available_codecs()) if each != "none"]
+    archives = {}
+    for codec in [None] + codecs:
+        name = os.path.join(
+            archives_dir, f"world-{codec or 'tarfile'}{compression.archive_suffix(codec or 'gzip')}"
+        )
+        archives[codec] = name
+
+        def archive_world(iteration: int, codec=codec, name=name) -> int:
+            docker_world_backup.tar_archive(
+                name=name, mode="w:gz", source=world_dir, codec=codec, workers=workers
+            )
+            return world["bytes"]
+        entry = measure("tar_archive", archive_world, repeat, codec=codec or "tarfile")
+        entry["archive_bytes"] = os.path.getsize(name)
+        entry["ratio"] = round(entry["archive_bytes"] / world["bytes"], 4)
+        results.append(entry)
+
+    # the pre-flight prediction of each archive above, a fresh estimator every run so the sample isn't cached
+    for codec in [None] + codecs:
+        predictions = []
+
+        def predict(iteration: int, codec=codec) -> int:
+            estimate_dir = tempfile.mkdtemp(dir=work_dir, prefix="estimate-")
+            try:
+                estimator = estimate.SpaceEstimator(os.path.join(estimate_dir, "estimate.json"), codec, "w:gz")
+                predictions.append(estimator.predict(world_dir)["predicted"])
+            finally:
+                shutil.rmtree(estimate_dir)
+            return world["bytes"]
+        entry = measure("space_estimate", predict, repeat, codec=codec or "tarfile")
+        entry["error"] = round(predictions[-1] / os.path.getsize(archives[codec]) - 1, 4)
+        results.append(entry)
+
+    # the same archive under the governor's read limit, next to the unthrottled run of the same codec
+    throttled_codec = codecs[0] if codecs else None
+    unthrottled = next(each for each in results if each["params"]["codec"] == (throttled_codec or "tarfile"))
+    rate = throttle_mb * 1024 * 1024 if throttle_mb else unthrottled["per_second"] / 2
+
+    def archive_throttled(iteration: int) -> int:
+        # a small burst, or a world this size would mostly be read out of the first second's tokens
+        governor = throttle.Governor(read_rate=rate, burst=0.1)
+        docker_world_backup.tar_archive(
+            name=archives[throttled_codec], mode="w:gz", source=world_dir, codec=throttled_codec, workers=workers,
+            limiter=governor.read_limiter
+        )
+        return world["bytes"]
+    results.append(measure(
+        "tar_archive", archive_throttled, repeat, codec=throttled_codec or "tarfile",
+        throttle=f"{rate / 1024 / 1024:.1f}MB/s"
+    ))
+
+    # a fresh backup directory every run, the catalog and stat index of the last one would change the work done
+    validation_codec = codecs[0] if codecs else None
+    backup_dirs = []
+
+    def validate(iteration: int) -> int:
+        backup_dir = tempfile.mkdtemp(dir=work_dir, prefix="backups-")
+        backup_dirs.append(backup_dir)
+        docker_world_backup.archive_validation(
+            os.path.join(backup_dir, f"world{compression.archive_suffix(validation_codec or 'gzip')}"),
+            "x:gz", world_dir, backup_dir, {"codec": validation_codec, "workers": workers}, "benchmark"
+        )
+        return world["bytes"]
+    results.append(measure("archive_validation", validate, repeat, codec=validation_codec or "tarfile"))
+
+    playerdata = os.path.join(world_dir, "playerdata")
+    results.append(measure(
+        "long_list_files", lambda iteration: len(FileIO.long_list_files(playerdata)), repeat, unit="files"
+    ))
+
+    # without a catalog the backup directory is scanned, with one it's a single query
+    def max_file_size(backup_dir: str):
+        def body(iteration: int) -> int:
+            docker_world_backup.get_max_file_size(backup_dir)
+            return len(os.listdir(backup_dir))
+        return body
+    results.append(measure("get_max_file_size", max_file_size(archives_dir), repeat, unit="files", source="scan"))
+    results.append(
+        measure("get_max_file_size", max_file_size(backup_dirs[-1]), repeat, unit="files", source="catalog")
+    )
+
+    # full restore, then a single player file, which the member index turns into a one block read
+    restore_archive = archives[validation_codec]
+    player = sorted(os.listdir(playerdata))[0]
+    for label, patterns in [("all", None), ("one-player", [f"playerdata/{player}"])]:
+        def restore_world(iteration: int, patterns=patterns) -> int:
+            target = tempfile.mkdtemp(dir=work_dir, prefix="restore-")
+            try:
+                return restore.extract(restore_archive, target, patterns)["bytes"]
+            finally:
+                shutil.rmtree(target)
+        results.append(
+            measure("restore", restore_world, repeat, codec=validation_codec or "tarfile", select=label)
+        )
+
+    for each in backup_dirs:
+        shutil.rmtree(each)
+    return {
+        "version": RESULTS_VERSION,
+        "environment": environment(),
+        "world": {key: value for key, value in world.items() if key != "root"},
+        "parameters": {
+            "size_mb": size_mb, "compressibility": compressibility, "seed": seed, "repeat": repeat,
+            "workers": workers, "throttle_mb": throttle_mb,
+        },
+        "results": results,
+    }
+
+
+def compare(previous: dict, current: dict, threshold: float = 0.10) -> list:
+    # (name, previous min, current min, change) for every benchmark at least threshold slower, slowest first
+    before = {each["name"]: each["min"] for each in previous["results"]}
+    regressions = []
+    for each in current["results"]:
+        old = before.get(each["name"])
+        if old and each["min"] > old * (1 + threshold):
+            regressions.append((each["name"], old, each["min"], each["min"] / old - 1))
+    return sorted(regressions, key=lambda regression: regression[3], reverse=True)
+
+
+def print_results(report: dict):
+    print(f"{'benchmark':<52}{'min s':>10}{'median s':>10}{'cpu s':>10}{'rate':>16}")
+    for each in report["results"]:
+        rate = "-"
+        if each["per_second"] is not None and each["unit"] == "bytes":
+            rate = f"{each['per_second'] / 1024 / 1024:.1f} MB/s"
+        elif each["per_second"] is not None:
+            rate = f"{each['per_second']:.0f} {each['unit']}/s"
+        print(
+            f"{each['name']:<52}{each['min']:>10.4f}{each['median']:>10.4f}{each['cpu_seconds']:>10.3f}{rate:>16}"
+        )
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="benchmark the backup path on a synthetic world")
+    parser.add_argument("--size-mb", type=float, default=64)
+    parser.add_argument("--compressibility", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--codecs", nargs="*", default=None, help="block codecs, all installed ones if unset")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--throttle-mb", type=float, default=None, help="read limit of the throttled archive run")
+    parser.add_argument("--work-dir", default=None, help="scratch space, a temporary directory if unset")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("PREVIOUS", "CURRENT"), default=None,
+        help="only compare two result files, exits 1 if anything got slower by more than --threshold"
+    )
+    parser.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        previous, current = [json.loads(FileIO.read_as_string(each)) for each in args.compare]
+        regressions = compare(previous, current, args.threshold)
+        for name, old, new, change in regressions:
+            print(f"{name}: {old:.4f}s -> {new:.4f}s (+{change:.0%})")
+        return 1 if regressions else 0
+
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as work_dir:
+        report = run_suite(
+            work_dir, args.size_mb, args.compressibility, args.seed, args.repeat, args.codecs, args.workers,
+            args.throttle_mb
+        )
+    with FileIO.atomic_open(args.output, fsync=False) as f:
+        json.dump(report, f, indent=2)
+    print_results(report)
+    print(f"results written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# synthetic minecraft worlds for the benchmarks, the same seed and arguments always give the same bytes
+# python3 -m benchmarks.world_gen /tmp/world --size-mb 256 --compressibility 0.3
+import argparse
+import gzip
+import json
+import os
+import random
+import struct
+import uuid
+
+from app.core import anvil
+
+# fixed mtimes, so stat based change detection sees the same world on every run
+EPOCH = 1700000000
+PALETTE = [
+    b"minecraft:stone", b"minecraft:deepslate", b"minecraft:dirt", b"minecraft:grass_block", b"minecraft:air",
+    b"minecraft:water", b"minecraft:oak_log", b"minecraft:oak_leaves", b"minecraft:sand", b"minecraft:gravel",
+    b"minecraft:coal_ore", b"minecraft:iron_ore", b"minecraft:andesite", b"minecraft:diorite", b"minecraft:granite",
+    b"minecraft:bedrock",
+]
+# uncompressed chunk data, readable by the game since 1.20.5 and what makes compressibility visible to the archiver
+UNCOMPRESSED = 3
+
+
+def nbt_like(rng: random.Random, size: int) -> bytes:
+    # palette names and short tags, compresses roughly like real uncompressed chunk nbt
+    parts = []
+    total = 0
+    while total < size:
+        name = rng.choice(PALETTE)
+        part = b"\x08\x00\x04Name" + struct.pack(">H", len(name)) + name + bytes([rng.randrange(4)]) * 12
+        parts.append(part)
+        total += len(part)
+    return b"".join(parts)[:size]
+
+
+class WorldGenerator:
+    """
+    Writes an Anvil like world: region files (overworld, nether, end, entities, poi) holding chunk records
+    whose compressibility is set by the caller, many small gzipped playerdata files with their stats and
+    advancements, and a level.dat.
+    """
+
+    def __init__(
+            self,
+            seed: int = 0,
+            compressibility: float = 0.5,
+            chunks_per_region: int = 256,
+            chunk_kb: int = 8,
+            players: int = 200
+    ):
+        """
+        :param seed: everything random comes from this
+        :param compressibility: 0.0 chunk data is random (like the zlib chunks of a stock world),
+        1.0 all of it is palette nbt that compresses well
+        :param chunks_per_region: populated slots per region file, at most 1024
+        :param chunk_kb: average chunk record size
+        :param players: playerdata, stats and advancements files each
+        """
+        if not 0.0 <= compressibility <= 1.0:
+            raise ValueError(f"compressibility {compressibility} is outside 0.0 to 1.0")
+        self.seed = int(seed)
+        self.compressibility = float(compressibility)
+        self.chunks_per_region = min(int(chunks_per_region), anvil.SLOTS)
+        self.chunk_size = int(chunk_kb) * 1024
+        self.players = int(players)
+        self.__rng = random.Random(self.seed)
+        # one compressible buffer sliced for every chunk, building nbt per chunk would dominate generation time
+        self.__nbt = nbt_like(self.__rng, 1024 * 1024)
+
+    def chunk_record(self) -> bytes:
+        size = self.__rng.randint(self.chunk_size // 2, self.chunk_size * 3 // 2)
+        compressible = int(size * self.compressibility)
+        start = self.__rng.randrange(len(self.__nbt) - compressible) if compressible < len(self.__nbt) else 0
+        data = self.__nbt[start:start + compressible] + self.__rng.randbytes(size - compressible)
+        return struct.pack(">IB", len(data) + 1, UNCOMPRESSED) + data
+
+    def region(self, file_name: str, index: int, chunks: int):
+        slots = sorted(self.__rng.sample(range(anvil.SLOTS), chunks))
+        records = {slot: self.chunk_record() for slot in slots}
+        timestamps = [EPOCH + index if slot in records else 0 for slot in range(anvil.SLOTS)]
+        anvil.write_region(file_name, records, timestamps)
+        os.utime(file_name, ns=((EPOCH + index) * 10 ** 9,) * 2)
+
+    def player_files(self, root: str, index: int) -> list:
+        player = str(uuid.UUID(int=self.__rng.getrandbits(128), version=4))
+        paths = [
+            os.path.join(root, "playerdata", f"{player}.dat"),
+            os.path.join(root, "stats", f"{player}.json"),
+            os.path.join(root, "advancements", f"{player}.json"),
+        ]
+        # gzip with a fixed mtime, the header would differ between runs otherwise
+        with open(paths[0], "wb") as f:
+            f.write(gzip.compress(nbt_like(self.__rng, self.__rng.randint(1024, 6144)), mtime=EPOCH))
+        stats = {f"minecraft:{each.decode().split(':')[1]}": self.__rng.randrange(10000) for each in PALETTE}
+        with open(paths[1], "w") as f:
+            json.dump({"stats": {"minecraft:mined": stats}, "DataVersion": 3700}, f)
+        with open(paths[2], "w") as f:
+            json.dump({f"minecraft:story/step_{each}": {"done": True} for each in range(self.__rng.randrange(40))}, f)
+        for each in paths:
+            os.utime(each, ns=((EPOCH + index) * 10 ** 9,) * 2)
+        return paths
+
+    def generate(self, root: str, size_mb: float = 64) -> dict:
+        """
+        :param root: world directory, created if missing
+        :param size_mb: approximate total size, region files take whatever the player files leave
+        :return: dict of files, bytes, regions and players written
+        """
+        for each in ["region", "entities", "poi", "DIM-1/region", "DIM1/region", "playerdata", "stats",
+                     "advancements", "data"]:
+            os.makedirs(os.path.join(root, *each.split("/")), exist_ok=True)
+        with open(os.path.join(root, "level.dat"), "wb") as f:
+            f.write(gzip.compress(nbt_like(self.__rng, 4096), mtime=EPOCH))
+        written = [os.path.join(root, "level.dat")]
+        for index in range(self.players):
+            written += self.player_files(root, index)
+
+        budget = size_mb * 1024 * 1024 - sum(os.path.getsize(each) for each in written)
+        # a chunk record averages chunk_size, plus half a sector of padding
+        chunk_share = self.chunk_size + anvil.SECTOR // 2
+        # mostly overworld terrain, a share of entities and poi and a little of the other dimensions, like a real save
+        layout = ["region"] * 6 + ["entities", "poi", "DIM-1/region", "region"]
+        index = 0
+        while index == 0 or budget > anvil.HEADER_SIZE + chunk_share:
+            # the last region only gets the chunks that are left of the budget
+            chunks = max(1, min(self.chunks_per_region, int((budget - anvil.HEADER_SIZE) // chunk_share)))
+            directory = layout[index % len(layout)]
+            x, z = divmod(index, 8)
+            file_name = os.path.join(root, *directory.split("/"), f"r.{x - 4}.{z - 4}.mca")
+            self.region(file_name, index, chunks)
+            written.append(file_name)
+            budget -= os.path.getsize(file_name)
+            index += 1
+        return {
+            "root": root,
+            "files": len(written),
+            "bytes": sum(os.path.getsize(each) for each in written),
+            "regions": index,
+            "players": self.players,
+        }
+
+
+def generate_world(root: str, size_mb: float = 64, compressibility: float = 0.5, seed: int = 0, **options) -> dict:
+    # options are the remaining WorldGenerator arguments (chunks_per_region, chunk_kb, players)
+    return WorldGenerator(seed=seed, compressibility=compressibility, **options).generate(root, size_mb)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="write a reproducible synthetic minecraft world")
+    parser.add_argument("root")
+    parser.add_argument("--size-mb", type=float, default=64)
+    parser.add_argument("--compressibility", type=float, default=0.5)
+    parser.add_argument("--players", type=int, default=200)
+    parser.add_argument("--chunks-per-region", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(generate_world(
+        args.root, args.size_mb, args.compressibility, args.seed,
+        players=args.players, chunks_per_region=args.chunks_per_region
+    )))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import gzip
+import io
+import json
+import os
+import tarfile
+import tempfile
+import unittest
+from unittest import mock
+
+from app.core import adaptive, archive, compression
+
+
+class BlockLevelTestCase(unittest.TestCase):
+    def test_level_changes_end_the_block_and_are_totalled_per_tag(self):
+        text = b"minecraft " * 50000
+        output = io.BytesIO()
+        with compression.BlockCompressor(output, "gzip", level=6, workers=1, block_size=1 << 20) as stream:
+            stream.set_level(9, "small:9")
+            stream.write(text)
+            stream.set_level(0, "compressed:0")
+            stream.write(os.urandom(100000))
+            stream.set_level(0, "compressed:0")
+        self.assertEqual(len(stream.blocks), 2)
+        self.assertEqual(gzip.decompress(output.getvalue())[:len(text)], text)
+        self.assertEqual(stream.classes["small:9"]["bytes_in"], len(text))
+        self.assertLess(stream.classes["small:9"]["bytes_out"], len(text) // 50)
+        # stored, not compressed: a little bigger than what went in
+        self.assertGreaterEqual(stream.classes["compressed:0"]["bytes_out"], 100000)
+
+
+class CodecControllerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.world = os.path.join(self.temp_dir.name, "world")
+        os.makedirs(os.path.join(self.world, "region"))
+        os.makedirs(os.path.join(self.world, "playerdata"))
+        words = b" ".join(b"%d" % (each % 997) for each in range(400000))
+        for x in range(3):
+            with open(os.path.join(self.world, "region", f"r.{x}.0.mca"), "wb") as f:
+                f.write(words)
+        for each in range(20):
+            with open(os.path.join(self.world, "playerdata", f"{each}.dat"), "wb") as f:
+                f.write(os.urandom(30000))
+        self.history = os.path.join(self.temp_dir.name, "history.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def archive(self, controller: adaptive.CodecController) -> dict:
+        plan = controller.prepare(self.world)
+        return archive.write_archive(
+            os.path.join(self.temp_dir.name, "world.tar.gz"), "w", self.world, codec=plan["codec"],
+            level=plan["level"], workers=1, controller=controller
+        )
+
+    def test_classify(self):
+        self.assertEqual(adaptive.classify("world/region/r.0.0.mca", 1 << 20), "region")
+        self.assertEqual(adaptive.classify("world/level.dat", 2000), "compressed")
+        self.assertEqual(adaptive.classify("world/stats/uuid.json", 2000), "small")
+        self.assertEqual(adaptive.classify("world/server.log", 1 << 20), "other")
+        with self.assertRaises(ValueError):
+            adaptive.CodecController(self.history)
+
+    def test_incompressible_data_is_stored_and_the_budget_picks_the_level(self):
+        generous = adaptive.CodecController(self.history, time_budget=3600, codecs=["gzip"])
+        result = self.archive(generous)
+        levels = generous.plan["levels"]
+        self.assertEqual(levels["compressed"], compression.CODECS["gzip"]["store_level"])
+        self.assertEqual(levels["region"], max(compression.CODECS["gzip"]["levels"]))
+        with tarfile.open(result["name"]) as tar:
+            self.assertEqual(sorted(tar.getnames()), sorted(each.name for each in result["members"]))
+        self.assertEqual(set(result["classes"]), {"region:9", "compressed:0"})
+
+        # learned from the first run, nothing left to calibrate
+        with mock.patch.object(compression, "measure_block", wraps=compression.measure_block) as measured:
+            tight = adaptive.CodecController(self.history, time_budget=1e-6, codecs=["gzip"])
+            tight.prepare(self.world)
+        measured.assert_not_called()
+        self.assertEqual(tight.plan["levels"]["region"], compression.CODECS["gzip"]["store_level"])
+        self.assertFalse(tight.plan["fits"])
+
+        with open(self.history) as f:
+            runs = json.load(f)["runs"]
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(runs[0]["archive_bytes"], result["archive_bytes"])
+        self.assertEqual(runs[0]["decisions"][0]["levels"], levels)
+
+
+if __name__ == '__main__':
+    unittest.main()
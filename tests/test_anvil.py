@@ -0,0 +1,65 @@
+import os
+import struct
+import tempfile
+import unittest
+
+from app.core import anvil
+from app.core.anvil import RegionDeltaStore, RegionFile
+
+
+def chunk_record(payload: bytes) -> bytes:
+    # length covers the compression type byte, 2 is zlib
+    return struct.pack(">IB", len(payload) + 1, 2) + payload
+
+
+class RegionDeltaStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.temp_dir.name, "world")
+        os.makedirs(os.path.join(self.source, "region"))
+        self.region = os.path.join(self.source, "region", "r.0.0.mca")
+        self.records = {slot: chunk_record(os.urandom(5000 + slot)) for slot in (0, 1, 33, 1023)}
+        self.timestamps = [0] * anvil.SLOTS
+        for slot in self.records:
+            self.timestamps[slot] = 1000
+        anvil.write_region(self.region, self.records, self.timestamps)
+        self.store = RegionDeltaStore(os.path.join(self.temp_dir.name, "regions"))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_region_file_reads_header_and_records(self):
+        with RegionFile(self.region) as region:
+            self.assertEqual(region.timestamps[33], 1000)
+            self.assertIsNone(region.chunk_record(2))
+            record = region.chunk_record(33)
+            self.assertEqual(bytes(record), self.records[33])
+            record.release()
+
+    def test_only_changed_chunks_are_stored_and_restore_rebuilds(self):
+        first = self.store.backup(self.source, name="one")
+        self.assertEqual(first["stats"]["chunks_changed"], 4)
+
+        self.records[33] = chunk_record(b"edited chunk")
+        self.timestamps[33] = 2000
+        anvil.write_region(self.region, self.records, self.timestamps)
+        second = self.store.backup(self.source, name="two")
+        self.assertEqual(second["stats"]["chunks_changed"], 1)
+        self.assertEqual(second["stats"]["bytes_written"], len(self.records[33]))
+        # "two" maps chunks into the pack of "one", neither may be written over
+        with self.assertRaises(FileExistsError):
+            self.store.backup(self.source, name="one")
+        self.assertEqual(self.store.load_index("two")["regions"], second["regions"])
+
+        target = os.path.join(self.temp_dir.name, "restored")
+        self.assertEqual(self.store.restore("two", target), 1)
+        with RegionFile(os.path.join(target, "region", "r.0.0.mca")) as region:
+            self.assertEqual(region.timestamps, self.timestamps)
+            for slot, record in self.records.items():
+                view = region.chunk_record(slot)
+                self.assertEqual(bytes(view), record)
+                view.release()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import hashlib
+import os
+import tarfile
+import tempfile
+import unittest
+
+from app.core import archive
+from app.core.FileIO import FileIO
+
+
+class WriteArchiveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.temp_dir.name, "world")
+        os.makedirs(os.path.join(self.source, "region"))
+        os.makedirs(os.path.join(self.source, "playerdata"))
+        self.data = os.urandom(20000)
+        with open(os.path.join(self.source, "region", "r.0.0.mca"), "wb") as f:
+            f.write(self.data)
+        with open(os.path.join(self.source, "playerdata", "player.dat"), "wb") as f:
+            f.write(b"player")
+        self.name = os.path.join(self.temp_dir.name, "backup.tar.gz")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_checksums_and_manifest_match_source(self):
+        result = archive.write_archive(self.name, "x:gz", self.source, arcname="world")
+        self.assertEqual(archive.verify(result), [])
+        digest = hashlib.sha256(self.data).hexdigest()
+        self.assertEqual(result["checksums"]["world/region/r.0.0.mca"], digest)
+        with open(archive.manifest_name(self.name)) as f:
+            self.assertIn(f"{digest}  world/region/r.0.0.mca\n", f.read())
+        with tarfile.open(self.name, "r:gz") as written:
+            self.assertEqual(written.extractfile("world/region/r.0.0.mca").read(), self.data)
+
+    def test_block_codec_path_and_recursive_index(self):
+        result = archive.write_archive(self.name, "w", self.source, codec="gzip", workers=1)
+        self.assertIn(archive.normalize_arcname(os.path.join(self.source, "playerdata", "player.dat")), result["index"])
+        self.assertEqual(archive.verify(result), [])
+
+    def test_an_earlier_scan_picks_up_files_created_since(self):
+        os.utime(os.path.join(self.source, "region"), ns=(1, 1))
+        scan = FileIO.scan_tree(self.source)
+        with open(os.path.join(self.source, "region", "r.1.0.mca"), "wb") as f:
+            f.write(b"generated during the flush")
+        result = archive.write_archive(self.name, "x:gz", self.source, arcname="world", scan=scan)
+        self.assertIn("world/region/r.1.0.mca", result["checksums"])
+        self.assertEqual(archive.verify(result), [])
+
+    def test_filtered_members_are_not_missing(self):
+        def skip_region(member):
+            return None if member.name.endswith("region") else member
+        result = archive.write_archive(self.name, "w:gz", self.source, arcname="world", filter=skip_region)
+        self.assertNotIn("world/region/r.0.0.mca", result["checksums"])
+        self.assertEqual(archive.verify(result), [])
+
+    def test_missing_member_is_reported(self):
+        result = archive.write_archive(self.name, "w:gz", self.source, arcname="world")
+        result["members"] = [each for each in result["members"] if not each.name.endswith("player.dat")]
+        self.assertEqual(archive.verify(result), ["missing from archive: world/playerdata/player.dat"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import gzip
+import hashlib
+import os
+import tempfile
+import unittest
+
+from app.core import anvil
+from benchmarks import suite
+from benchmarks.world_gen import generate_world
+
+
+def tree_digest(root: str) -> str:
+    digest = hashlib.sha256()
+    for directory, dir_names, file_names in sorted(os.walk(root)):
+        for file_name in sorted(file_names):
+            path = os.path.join(directory, file_name)
+            digest.update(os.path.relpath(path, root).encode())
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+class WorldGeneratorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def generate(self, name: str, **options) -> dict:
+        return generate_world(os.path.join(self.temp_dir.name, name), **options)
+
+    def test_same_seed_same_world(self):
+        first = self.generate("a", size_mb=2, seed=7, players=20)
+        second = self.generate("b", size_mb=2, seed=7, players=20)
+        self.assertEqual(tree_digest(first["root"]), tree_digest(second["root"]))
+        self.assertNotEqual(
+            tree_digest(first["root"]), tree_digest(self.generate("c", size_mb=2, seed=8, players=20)["root"])
+        )
+
+    def test_layout_size_and_compressibility(self):
+        world = self.generate("world", size_mb=4, compressibility=1.0, players=30)
+        self.assertAlmostEqual(world["bytes"] / (4 * 1024 * 1024), 1.0, delta=0.25)
+        self.assertEqual(len(os.listdir(os.path.join(world["root"], "playerdata"))), 30)
+        with open(os.path.join(world["root"], "level.dat"), "rb") as f:
+            gzip.decompress(f.read())
+
+        regions = anvil.region_files(world["root"])
+        self.assertEqual(len(regions), world["regions"])
+        with anvil.RegionFile(os.path.join(world["root"], regions[0])) as region:
+            slot = next(slot for slot, each in enumerate(region.locations) if each[0])
+            self.assertGreater(len(region.chunk_record(slot)), 5)
+        random = self.generate("random", size_mb=4, compressibility=0.0, players=30)
+        compressed = []
+        for each in [world, random]:
+            with open(os.path.join(each["root"], "region", "r.-4.-4.mca"), "rb") as f:
+                compressed.append(len(gzip.compress(f.read())))
+        self.assertLess(compressed[0] * 4, compressed[1])
+
+
+class SuiteTestCase(unittest.TestCase):
+    def test_results_and_compare(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            report = suite.run_suite(work_dir, size_mb=1, repeat=1, codecs=["gzip"])
+        names = [each["name"] for each in report["results"]]
+        for expected in ["tar_archive[codec=tarfile]", "tar_archive[codec=gzip]", "archive_validation[codec=gzip]",
+                         "long_list_files", "get_max_file_size[source=scan]", "restore[codec=gzip,select=all]"]:
+            self.assertIn(expected, names)
+        self.assertEqual(suite.compare(report, report), [])
+        slower = {"results": [dict(each, min=each["min"] * 2) for each in report["results"]]}
+        self.assertEqual(len(suite.compare(report, slower)), len(names))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+from app.core import archive
+from app.core.catalog import Catalog, catalog_file
+
+
+class CatalogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.save_dir = self.temp_dir.name
+        self.source = os.path.join(self.save_dir, "world")
+        os.makedirs(os.path.join(self.source, "region"))
+        for each in ["level.dat", os.path.join("region", "r.0.0.mca")]:
+            with open(os.path.join(self.source, each), "wb") as f:
+                f.write(b"minecraft" * 2000)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_records_what_the_archiver_measured(self):
+        for codec in [None, "gzip"]:
+            name = os.path.join(self.save_dir, f"{codec}.tar.gz")
+            result = archive.write_archive(name, "x:gz", self.source, codec=codec, workers=1)
+            with open(name, "rb") as f:
+                self.assertEqual(result["archive_sha256"], hashlib.sha256(f.read()).hexdigest())
+            self.assertEqual(result["archive_bytes"], os.path.getsize(name))
+            with Catalog(catalog_file(self.save_dir)) as backup_catalog:
+                backup_catalog.record_archive(result, source=self.source, container="mc")
+                entry = backup_catalog.list("mc", limit=1)[0]
+            self.assertEqual(entry["codec"], "gzip")
+            self.assertEqual(entry["members"], 4)
+            self.assertEqual(entry["bytes_read"], 2 * 18000)
+            self.assertLess(entry["ratio"], 0.1)
+
+    def test_lookup_and_size_queries(self):
+        with Catalog(catalog_file(self.save_dir)) as backup_catalog:
+            for created, size in [(100.0, 10), (200.0, 30), (300.0, 20)]:
+                backup_catalog.record(
+                    name=f"{created}.tar.gz", path=f"/backups/{created}.tar.gz", created=created, size=size,
+                    source=self.source, container="mc"
+                )
+            backup_catalog.record(name="other.tar.gz", path="/other.tar.gz", created=250.0, size=5, container="b")
+            self.assertEqual(backup_catalog.lookup("mc", 250.0)["name"], "200.0.tar.gz")
+            self.assertEqual(backup_catalog.lookup(self.source, 999.0)["name"], "300.0.tar.gz")
+            self.assertIsNone(backup_catalog.lookup("mc", 50.0))
+            self.assertEqual(backup_catalog.total_size(), 65)
+            self.assertEqual(backup_catalog.max_size(), 30)
+            backup_catalog.remove(["200.0.tar.gz"])
+            self.assertEqual([each["name"] for each in backup_catalog.list("mc")], ["300.0.tar.gz", "100.0.tar.gz"])
+
+    def test_import_skips_known_and_non_archives(self):
+        for each in ["a.tar.gz", "b.tar.zst", "notes.txt", "a.tar.gz.sha256"]:
+            with open(os.path.join(self.save_dir, each), "wb") as f:
+                f.write(b"x" * 10)
+        with Catalog(catalog_file(self.save_dir)) as backup_catalog:
+            self.assertEqual(backup_catalog.import_directory(self.save_dir), 2)
+            self.assertEqual(backup_catalog.import_directory(self.save_dir), 0)
+            self.assertEqual(backup_catalog.total_size(), 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
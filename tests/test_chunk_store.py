@@ -0,0 +1,78 @@
+import io
+import os
+import tempfile
+import unittest
+
+from app.core import anvil, chunk_store
+from app.core.chunk_store import ChunkStore
+
+
+class ChunkingTestCase(unittest.TestCase):
+    def test_chunks_rebuild_the_stream_within_size_limits(self):
+        data = os.urandom(700000)
+        chunks = list(chunk_store.iter_chunks(io.BytesIO(data)))
+        self.assertEqual(b"".join(chunks), data)
+        for each in chunks[:-1]:
+            self.assertGreaterEqual(len(each), chunk_store.MIN_CHUNK)
+            self.assertLessEqual(len(each), chunk_store.MAX_CHUNK)
+
+    def test_insert_only_changes_nearby_chunks(self):
+        data = os.urandom(1000000)
+        before = set(chunk_store.iter_chunks(io.BytesIO(data)))
+        after = set(chunk_store.iter_chunks(io.BytesIO(data[:500000] + b"edit" + data[500000:])))
+        self.assertGreater(len(before & after), len(before) - 4)
+
+    def test_region_pieces_are_sector_aligned(self):
+        data = bytearray(os.urandom(anvil.HEADER_SIZE + 5 * chunk_store.REGION_CHUNK + anvil.SECTOR))
+        before = list(chunk_store.iter_region_chunks(io.BytesIO(bytes(data))))
+        self.assertEqual(b"".join(before), data)
+        self.assertEqual([len(each) for each in before], [anvil.HEADER_SIZE] + [chunk_store.REGION_CHUNK] * 5 + [
+            anvil.SECTOR
+        ])
+        # a chunk rewritten in place, and the timestamp in the header that goes with it
+        data[anvil.HEADER_SIZE + 2 * chunk_store.REGION_CHUNK + 100] ^= 1
+        data[anvil.SECTOR + 8] ^= 1
+        after = list(chunk_store.iter_region_chunks(io.BytesIO(bytes(data))))
+        self.assertEqual([index for index, each in enumerate(before) if each != after[index]], [0, 3])
+
+
+class ChunkStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.temp_dir.name, "world")
+        os.makedirs(os.path.join(self.source, "region"))
+        os.makedirs(os.path.join(self.source, "empty"))
+        self.region = os.path.join(self.source, "region", "r.0.0.mca")
+        with open(self.region, "wb") as f:
+            f.write(os.urandom(300000))
+        with open(os.path.join(self.source, "level.dat"), "wb") as f:
+            f.write(b"level")
+        self.store = ChunkStore(os.path.join(self.temp_dir.name, "store"))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_second_snapshot_skips_unchanged_files(self):
+        self.store.backup(self.source, name="one")
+        with open(self.region, "r+b") as f:
+            f.seek(200000)
+            f.write(b"changed")
+        os.utime(self.region, ns=(1, 1))
+        second = self.store.backup(self.source, name="two")
+        self.assertEqual(second["stats"]["unchanged"], 1)
+        self.assertLess(second["stats"]["chunks_new"], 4)
+        self.assertEqual(self.store.snapshot_names(), ["one", "two"])
+
+    def test_restore_rebuilds_snapshot(self):
+        self.store.backup(self.source, name="one")
+        with open(self.region, "rb") as f:
+            original = f.read()
+        target = os.path.join(self.temp_dir.name, "restored")
+        self.assertEqual(self.store.restore("latest", target), 2)
+        with open(os.path.join(target, "region", "r.0.0.mca"), "rb") as f:
+            self.assertEqual(f.read(), original)
+        self.assertTrue(os.path.isdir(os.path.join(target, "empty")))
+
+
+if __name__ == '__main__':
+    unittest.main()
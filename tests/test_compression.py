@@ -0,0 +1,48 @@
+import gzip
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+
+from app.core import compression
+
+
+class BlockCompressorTestCase(unittest.TestCase):
+    def test_multi_member_gzip_round_trip(self):
+        data = os.urandom(50000) + b"minecraft" * 20000
+        buffer = io.BytesIO()
+        with compression.BlockCompressor(buffer, codec="gzip", workers=1, block_size=16384) as stream:
+            stream.write(data)
+        # several independent gzip members, still one stream to any gzip reader
+        self.assertGreater(buffer.getvalue().count(b"\x1f\x8b\x08"), 1)
+        self.assertEqual(gzip.decompress(buffer.getvalue()), data)
+
+    def test_process_pool_keeps_block_order(self):
+        data = b"".join(bytes([each % 251]) * 4096 for each in range(64))
+        buffer = io.BytesIO()
+        with compression.BlockCompressor(buffer, codec="gzip", workers=2, block_size=8192) as stream:
+            stream.write(data)
+        self.assertEqual(gzip.decompress(buffer.getvalue()), data)
+
+    def test_tar_stream_reads_back_with_tarfile(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source = os.path.join(temp_dir, "world")
+            os.makedirs(os.path.join(source, "region"))
+            with open(os.path.join(source, "region", "r.0.0.mca"), "wb") as f:
+                f.write(os.urandom(100000))
+            name = os.path.join(temp_dir, "backup" + compression.archive_suffix("gzip"))
+            with compression.open_writer(name, mode="x", codec="gzip", workers=1, block_size=32768) as stream:
+                with tarfile.open(fileobj=stream, mode="w|") as archive:
+                    archive.add(source, arcname="world")
+            self.assertEqual(compression.codec_from_name(name), "gzip")
+            with tarfile.open(name, "r:gz") as archive:
+                self.assertIn("world/region/r.0.0.mca", archive.getnames())
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            compression.check_codec("bzip3")
+
+
+if __name__ == '__main__':
+    unittest.main()
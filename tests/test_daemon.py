@@ -0,0 +1,151 @@
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from app import daemon
+from app.core import inotify
+from app.core.chunk_store import ChunkStore
+
+
+@unittest.skipUnless(inotify.available(), "needs inotify")
+class ChangeTrackerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.temp_dir.name, "world")
+        os.makedirs(os.path.join(self.source, "region"))
+        for name in ["level.dat", "region/r.0.0.mca", "region/r.0.1.mca"]:
+            with open(os.path.join(self.source, name), "wb") as f:
+                f.write(os.urandom(70000))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_drain_reports_changes_once(self):
+        with inotify.ChangeTracker(self.source) as tracker:
+            self.assertEqual(tracker.drain(), set())
+            with open(os.path.join(self.source, "region", "r.0.0.mca"), "ab") as f:
+                f.write(b"edit")
+            os.makedirs(os.path.join(self.source, "DIM-1", "region"))
+            with open(os.path.join(self.source, "DIM-1", "region", "r.0.0.mca"), "wb") as f:
+                f.write(b"nether")
+            self.assertEqual(tracker.drain(), {"region/r.0.0.mca", "DIM-1"})
+            # directories created since are watched too
+            with open(os.path.join(self.source, "DIM-1", "region", "r.0.0.mca"), "ab") as f:
+                f.write(b"edit")
+            changed = tracker.drain()
+            self.assertEqual(changed, {"DIM-1/region/r.0.0.mca"})
+            tracker.restore(changed)
+            tracker.restore(None)
+            self.assertIsNone(tracker.drain())
+            self.assertEqual(tracker.drain(), set())
+
+    def test_changed_backup_matches_a_full_walk(self):
+        tracked = ChunkStore(os.path.join(self.temp_dir.name, "tracked"))
+        walked = ChunkStore(os.path.join(self.temp_dir.name, "walked"))
+        with inotify.ChangeTracker(self.source) as tracker:
+            tracked.backup(self.source, "first")
+            walked.backup(self.source, "first")
+            tracker.drain()
+            with open(os.path.join(self.source, "region", "r.0.1.mca"), "r+b") as f:
+                f.write(b"edit")
+            os.remove(os.path.join(self.source, "level.dat"))
+            os.makedirs(os.path.join(self.source, "playerdata"))
+            with open(os.path.join(self.source, "playerdata", "uuid.dat"), "wb") as f:
+                f.write(b"player")
+            snapshot = tracked.backup(self.source, "second", changed=tracker.drain())
+        self.assertEqual(snapshot["stats"]["walked"], 2)
+        self.assertEqual(snapshot["files"], walked.backup(self.source, "second")["files"])
+
+
+class BackupDaemonTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        settings = [
+            {"container": name, "source": self.temp_dir.name, "save_dir": self.temp_dir.name, "full_every_minutes": 0}
+            for name in ("survival", "creative")
+        ]
+        self.daemon = daemon.BackupDaemon(settings, max_concurrent=2)
+        self.socket_file = os.path.join(self.temp_dir.name, "control.sock")
+        self.server = daemon.ControlServer(self.socket_file, self.daemon)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.daemon.start()
+
+    def tearDown(self):
+        self.daemon.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        self.temp_dir.cleanup()
+
+    def test_control_socket(self):
+        release = threading.Event()
+        called = []
+
+        def fake_backup(settings: dict) -> bool:
+            called.append((settings["container"], settings["incremental"]))
+            release.wait(5)
+            return True
+
+        with mock.patch.object(daemon.dwb, "backup_world", fake_backup):
+            self.assertEqual(oct(os.stat(self.socket_file).st_mode & 0o777), "0o600")
+            answer = daemon.control(self.socket_file, {"command": "backup", "world": "survival", "kind": "incremental"})
+            self.assertTrue(answer["ok"])
+            again = daemon.control(self.socket_file, {"command": "backup", "world": "survival"})
+            self.assertFalse(again["ok"])
+            self.assertFalse(daemon.control(self.socket_file, {"command": "backup", "world": "missing"})["ok"])
+            self.assertEqual(daemon.control(self.socket_file, {"command": "pause"})["worlds"], ["survival", "creative"])
+            status = {each["world"]: each for each in daemon.control(self.socket_file, {"command": "status"})["worlds"]}
+            self.assertEqual(status["survival"]["running"], "incremental")
+            self.assertTrue(status["creative"]["paused"])
+            release.set()
+            self.daemon.stop()
+        self.assertEqual(called, [("survival", True)])
+        self.assertTrue(self.daemon.worlds["survival"].last["incremental"]["succeeded"])
+        self.assertTrue(daemon.control(self.socket_file, {"command": "stop"})["ok"])
+
+    def test_hot_pass_runs_outside_the_lock(self):
+        answered = []
+        snapshot = daemon.hot_pack.HotPack.snapshot
+
+        def slow_snapshot(pack, *args, **kwargs):
+            # status is answered while the pass is still writing
+            asking = threading.Thread(target=lambda: answered.append(self.daemon.handle({"command": "status"})))
+            asking.start()
+            asking.join(5)
+            return snapshot(pack, *args, **kwargs)
+
+        with mock.patch.object(daemon.hot_pack.HotPack, "snapshot", slow_snapshot):
+            answer = self.daemon.handle({"command": "backup", "world": "survival", "kind": "hot"})
+        self.assertTrue(answer["ok"], answer)
+        self.assertEqual(len(answered), 1)
+        self.assertTrue(answered[0]["ok"])
+        self.assertEqual(self.daemon.worlds["survival"].hot_last, answer["hot"])
+
+    def test_schedule(self):
+        settings = {"container": "survival", "full_every_minutes": 1, "incremental_every_minutes": 0.5}
+        world = daemon.WorldState(settings, 0)
+        self.assertIsNone(world.due(29))
+        self.assertEqual(world.due(30), "incremental")
+        self.assertEqual(world.due(60), "full")
+        world.reschedule("full", 60)
+        self.assertEqual(world.wait(60), 0)
+        world.paused = True
+        self.assertIsNone(world.due(200))
+
+
+class ImportTestCase(unittest.TestCase):
+    def test_importing_creates_no_log_directory(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            subprocess.run(
+                [sys.executable, "-c", "import app.daemon"], check=True, cwd=temp_dir,
+                env=dict(os.environ, PYTHONPATH=root)
+            )
+            self.assertEqual(os.listdir(temp_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import errno
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+from unittest import mock
+
+from app.core import archive, estimate
+from app.core.FileIO import FileIO
+from benchmarks.world_gen import generate_world
+
+
+class EstimateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.world = generate_world(os.path.join(self.temp_dir.name, "world"), size_mb=4, players=40)["root"]
+        self.estimate_file = os.path.join(self.temp_dir.name, "estimate.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def archive(self, **options) -> dict:
+        return archive.write_archive(
+            os.path.join(self.temp_dir.name, "world.tar.gz"), "w:gz", self.world, manifest=False, member_index=False,
+            **options
+        )
+
+    def test_tar_layout_matches_tarfile(self):
+        stream = io.BytesIO()
+        with tarfile.open(fileobj=stream, mode="w") as tar:
+            tar.add(self.world, arcname="world")
+        layout = estimate.tar_layout(FileIO.scan_tree(self.world), "world")
+        self.assertEqual(layout["size"], len(stream.getvalue()))
+
+    def test_prediction_within_a_few_percent_and_learns(self):
+        estimator = estimate.SpaceEstimator(self.estimate_file, "gzip", level=6)
+        prediction = estimator.predict(self.world)
+        self.assertTrue(prediction["sampled"])
+        measured = self.archive(codec="gzip", level=6, workers=1)["archive_bytes"]
+        self.assertAlmostEqual(prediction["predicted"] / measured, 1.0, delta=0.05)
+        self.assertEqual(prediction["reserve"], int(prediction["predicted"] * 1.1))
+
+        estimator.learn(measured * 2)
+        again = estimate.SpaceEstimator(self.estimate_file, "gzip", level=6).predict(self.world)
+        # the sample is cached, the correction comes from the run that went twice as big
+        self.assertFalse(again["sampled"])
+        self.assertAlmostEqual(again["correction"], measured * 2 / prediction["predicted"], places=3)
+        self.assertTrue(estimate.SpaceEstimator(self.estimate_file, "gzip", level=1).predict(self.world)["sampled"])
+
+    def test_reserved_archive_is_truncated_to_what_was_written(self):
+        result = self.archive(reserve=50 * 1024 * 1024)
+        if not result["reserved"]:
+            self.skipTest("filesystem can't preallocate")
+        self.assertEqual(os.path.getsize(result["name"]), result["archive_bytes"])
+        with tarfile.open(result["name"]) as tar:
+            self.assertEqual(len(tar.getmembers()), len(result["members"]))
+
+    def test_full_disk_fails_before_writing(self):
+        full = OSError(errno.ENOSPC, "No space left on device")
+        with mock.patch.object(estimate.os, "posix_fallocate", side_effect=full, create=True), \
+                mock.patch.object(archive, "_add_tree") as add_tree:
+            with self.assertRaises(OSError):
+                self.archive(reserve=1024)
+        add_tree.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
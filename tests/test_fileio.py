@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+
+from app.core import FileIO, StatIndex
+
+
+class ScanTreeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        for relative in ["level.dat", "a/x.dat", "a/b/y.dat", "a.txt", "region/r.0.0.mca"]:
+            path = os.path.join(self.root, *relative.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(b"x" * len(relative))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_depth_first_order_and_stat_data(self):
+        scan = FileIO.scan_tree(self.root, workers=4)
+        self.assertEqual(
+            list(scan), ["a", "a/b", "a/b/y.dat", "a/x.dat", "a.txt", "level.dat", "region", "region/r.0.0.mca"]
+        )
+        self.assertTrue(scan["a/b"].is_dir)
+        self.assertEqual(scan["a/b/y.dat"].size, len("a/b/y.dat"))
+        self.assertEqual(scan["level.dat"].inode, os.stat(os.path.join(self.root, "level.dat")).st_ino)
+        self.assertEqual(list(FileIO.scan_tree(self.root, recursive=False)), ["a", "a.txt", "level.dat", "region"])
+
+    def test_refresh_only_lists_directories_that_changed(self):
+        for relative in ["a", "a/b", "region"]:
+            os.utime(os.path.join(self.root, *relative.split("/")), ns=(1, 1))
+        scan = FileIO.scan_tree(self.root)
+        with open(os.path.join(self.root, "region", "r.1.0.mca"), "wb") as f:
+            f.write(b"new")
+        os.remove(os.path.join(self.root, "a", "b", "y.dat"))
+        os.rmdir(os.path.join(self.root, "a", "b"))
+        os.makedirs(os.path.join(self.root, "c", "d"))
+        # changed in place, the directory doesn't move and the old entry stays
+        with open(os.path.join(self.root, "a", "x.dat"), "ab") as f:
+            f.write(b"more")
+        refreshed = FileIO.refresh_scan(self.root, scan)
+        self.assertEqual(list(refreshed), list(FileIO.scan_tree(self.root)))
+        self.assertEqual(refreshed["a/x.dat"], scan["a/x.dat"])
+        self.assertEqual(refreshed["region/r.1.0.mca"].size, 3)
+
+    def test_stat_index_reports_changes_between_runs(self):
+        index_file = os.path.join(self.root, "index.json")
+        self.assertEqual(len(StatIndex(index_file).update(FileIO.scan_tree(self.root))["added"]), 5)
+        with open(os.path.join(self.root, "a.txt"), "ab") as f:
+            f.write(b"more")
+        os.remove(os.path.join(self.root, "level.dat"))
+        # index.json itself shows up as added, it lives inside the scanned tree here
+        changes = StatIndex(index_file).update(FileIO.scan_tree(self.root))
+        self.assertEqual(changes["changed"], ["a.txt"])
+        self.assertEqual(changes["removed"], ["level.dat"])
+        self.assertEqual(changes["added"], ["index.json"])
+        self.assertEqual(changes["unchanged"], 3)
+
+    def test_verify_dir(self):
+        self.assertEqual(FileIO.verify_dir(self.root), 1)
+        self.assertEqual(FileIO.verify_dir(os.path.join(self.root, "missing")), -1)
+
+
+class WriteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.temp_dir.name, "state.txt")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_failed_atomic_write_keeps_the_old_file(self):
+        FileIO.overwrite(self.file_name, "old")
+        with self.assertRaises(RuntimeError):
+            with FileIO.atomic_open(self.file_name) as f:
+                f.write("half written")
+                raise RuntimeError("crash")
+        self.assertEqual(FileIO.read_as_string(self.file_name), "old")
+        self.assertEqual(os.listdir(self.temp_dir.name), ["state.txt"])
+
+    def test_append_and_records_read_back_through_mmap(self):
+        FileIO.append(self.file_name, "first\n")
+        FileIO.append_records(self.file_name, ["second", "third"])
+        self.assertEqual(list(FileIO.iter_lines(self.file_name)), ["first", "second", "third"])
+        FileIO.write_records(self.file_name, ["only"])
+        self.assertEqual(list(FileIO.iter_lines(self.file_name)), ["only"])
+        FileIO.write_records(self.file_name, [])
+        self.assertEqual(list(FileIO.iter_lines(self.file_name)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import gzip
+import os
+import tempfile
+import time
+import unittest
+
+from app.core import hot_pack
+
+UUID = "0f3c2a6e-5d1b-4c8a-9e7f-2b6d4a1c8e90"
+
+
+class HotPackTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.temp_dir.name, "data")
+        self.pack_file = os.path.join(self.temp_dir.name, "hot.pack")
+        for world in ("world", "world_nether"):
+            self.write(f"{world}/level.dat", gzip.compress(world.encode()))
+            os.makedirs(os.path.join(self.source, world, "region"))
+        self.write(f"world/playerdata/{UUID}.dat", gzip.compress(b"inventory 1"))
+        self.write("world/playerdata/other.dat", gzip.compress(b"someone else"))
+        self.write(f"world/advancements/{UUID}.json", b'{"story/root": true}')
+        self.write(f"world/stats/{UUID}.json", b'{"stats": {}}')
+        self.write("world/region/r.0.0.mca", os.urandom(4096))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, relative: str, data: bytes, mtime_ns: int = None):
+        path = os.path.join(self.source, *relative.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        if mtime_ns is not None:
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def test_only_changed_files_are_appended(self):
+        with hot_pack.HotPack(self.pack_file) as pack:
+            first = pack.snapshot(self.source)
+            self.assertEqual(first["files"], 6)
+            self.assertEqual(first["appended"], 6)
+            self.assertNotIn("world/region/r.0.0.mca", pack.index)
+
+            # touched without changing, and changed
+            self.write("world/stats/other.json", b"{}")
+            self.write(f"world/stats/{UUID}.json", b'{"stats": {}}', mtime_ns=time.time_ns() + 10 ** 9)
+            self.write(f"world/playerdata/{UUID}.dat", gzip.compress(b"inventory 2"), mtime_ns=time.time_ns() + 10 ** 9)
+            second = pack.snapshot(self.source)
+            self.assertEqual(second["appended"], 2)
+            self.assertEqual(second["unchanged"], 5)
+            self.assertEqual(pack.snapshot(self.source)["appended"], 0)
+            self.assertEqual(pack.passes, 2)
+            size = pack.size
+
+        self.assertEqual(os.path.getsize(self.pack_file), size)
+        with hot_pack.HotPack(self.pack_file, writable=False) as reader:
+            self.assertEqual(len(reader.index[f"world/playerdata/{UUID}.dat"]), 2)
+            self.assertEqual(reader.passes, 2)
+
+    def test_half_written_nbt_waits_for_the_next_pass(self):
+        self.write("world/playerdata/other.dat", gzip.compress(b"someone else")[:-6])
+        with hot_pack.HotPack(self.pack_file) as pack:
+            stats = pack.snapshot(self.source)
+            self.assertEqual(stats["unsettled"], 1)
+            self.assertNotIn("world/playerdata/other.dat", pack.index)
+
+    def test_torn_pass_is_ignored_then_cut(self):
+        with hot_pack.HotPack(self.pack_file) as pack:
+            pack.snapshot(self.source)
+            committed = pack.size
+        with open(self.pack_file, "ab") as f:
+            # a file record whose pass never got its commit
+            f.write(hot_pack.RECORD.pack(hot_pack.KIND_FILE, 9, 0, 0, 3, 3, 0) + b"world/x.y" + b"abc")
+        with hot_pack.HotPack(self.pack_file, writable=False) as reader:
+            self.assertNotIn("world/x.y", reader.index)
+            self.assertEqual(reader.size, committed)
+        self.write(f"world/playerdata/{UUID}.dat", gzip.compress(b"inventory 2"), mtime_ns=time.time_ns() + 10 ** 9)
+        with hot_pack.HotPack(self.pack_file) as pack:
+            pack.snapshot(self.source)
+            self.assertEqual(os.path.getsize(self.pack_file), pack.size)
+        with hot_pack.HotPack(self.pack_file, writable=False) as reader:
+            self.assertEqual(reader.passes, 2)
+
+    def test_restore_one_player_at_a_time(self):
+        with hot_pack.HotPack(self.pack_file) as pack:
+            pack.snapshot(self.source)
+            between = time.time()
+            time.sleep(0.01)
+            self.write(f"world/playerdata/{UUID}.dat", gzip.compress(b"griefed"), mtime_ns=time.time_ns() + 10 ** 9)
+            pack.snapshot(self.source)
+
+            paths = pack.player_files(UUID.upper())
+            self.assertEqual(paths, sorted(f"world/{each}" for each in (
+                f"advancements/{UUID}.json", f"playerdata/{UUID}.dat", f"stats/{UUID}.json"
+            )))
+            target = os.path.join(self.temp_dir.name, "restored")
+            self.assertEqual(pack.restore(target, paths, at=between), paths)
+            with gzip.open(os.path.join(target, "world", "playerdata", f"{UUID}.dat")) as f:
+                self.assertEqual(f.read(), b"inventory 1")
+            self.assertFalse(os.path.exists(os.path.join(target, "world", "playerdata", "other.dat")))
+
+            pack.restore(target, paths)
+            with gzip.open(os.path.join(target, "world", "playerdata", f"{UUID}.dat")) as f:
+                self.assertEqual(f.read(), b"griefed")
+            self.assertEqual(pack.restore(target, paths, at=between - 3600), [])
+
+    def test_compaction_keeps_the_newest_and_other_writers_follow(self):
+        with hot_pack.HotPack(self.pack_file) as pack, hot_pack.HotPack(self.pack_file) as other:
+            pack.snapshot(self.source)
+            for each in range(8):
+                self.write(
+                    f"world/playerdata/{UUID}.dat", gzip.compress(b"inventory %d" % each),
+                    mtime_ns=time.time_ns() + (each + 1) * 10 ** 9
+                )
+                pack.snapshot(self.source)
+            latest = pack.version(f"world/playerdata/{UUID}.dat")
+            # nothing old enough yet
+            self.assertFalse(pack.compact(keep_versions=1)["rewritten"])
+            stats = pack.compact(keep_versions=2, keep_seconds=0)
+            self.assertEqual((stats["kept"], stats["dropped"], stats["rewritten"]), (7, 7, True))
+            self.assertEqual(os.path.getsize(self.pack_file), stats["after"])
+            self.assertLess(stats["after"], stats["before"])
+            self.assertFalse(os.path.exists(self.pack_file + hot_pack.TEMP_SUFFIX))
+            versions = pack.index[f"world/playerdata/{UUID}.dat"]
+            self.assertEqual(len(versions), 2)
+            self.assertEqual(versions[-1][0], latest[0])
+            self.assertEqual(gzip.decompress(pack.read(versions[-1])), b"inventory 7")
+
+            # opened before the rewrite, its next pass goes to the new file
+            self.write("world/playerdata/other.dat", gzip.compress(b"moved"), mtime_ns=time.time_ns() + 10 ** 10)
+            self.assertEqual(other.snapshot(self.source)["appended"], 1)
+        with hot_pack.HotPack(self.pack_file, writable=False) as reader:
+            self.assertEqual(len(reader.index["world/playerdata/other.dat"]), 2)
+            self.assertEqual(len(reader.index[f"world/playerdata/{UUID}.dat"]), 2)
+
+    def test_not_a_pack(self):
+        with open(self.pack_file, "wb") as f:
+            f.write(b"something else")
+        with self.assertRaises(ValueError):
+            hot_pack.HotPack(self.pack_file)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import json
+import os
+import tempfile
+import unittest
+
+from app.core import LogHandler
+
+
+class LogHandlerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        LogHandler.flush()
+        self.temp_dir.cleanup()
+
+    def read_lines(self, file_name: str) -> list:
+        LogHandler.flush()
+        with open(file_name) as f:
+            return f.read().splitlines()
+
+    def test_json_lines_with_call_site(self):
+        file_name = os.path.join(self.temp_dir.name, "backup.jsonl")
+        logger = LogHandler(file_name, name="test_json", logging_level="info", json_lines=True)
+        logger.write("archive created")
+        logger.write("not shown", "debug")
+        logger.write("disk full", "error")
+        entries = [json.loads(each) for each in self.read_lines(file_name)]
+        self.assertEqual([(each["level"], each["message"]) for each in entries],
+                         [("info", "archive created"), ("error", "disk full")])
+        self.assertTrue(entries[0]["site"].startswith(__file__))
+
+    def test_rate_limit_per_call_site_and_message_cap(self):
+        file_name = os.path.join(self.temp_dir.name, "backup.log")
+        logger = LogHandler(file_name, name="test_rate", logging_level="info", rate_limit=5, rate_period=60)
+        for each in range(100):
+            logger.write(f"member {each}")
+        # errors are never dropped
+        for each in range(10):
+            logger.write(f"failure {each}", "error")
+        logger.write("x" * 100000)
+        lines = self.read_lines(file_name)
+        self.assertEqual(sum("member" in each for each in lines), 5)
+        self.assertEqual(sum("failure" in each for each in lines), 10)
+        self.assertTrue(lines[-1].endswith(f"... ({100000 - 64 * 1024} more characters)"))
+
+    def test_size_rotation(self):
+        file_name = os.path.join(self.temp_dir.name, "rotating.log")
+        logger = LogHandler(
+            file_name, name="test_rotation", logging_level="info", max_bytes=2000, backup_count=2, rate_limit=0
+        )
+        for each in range(200):
+            logger.write(f"line {each}")
+        LogHandler.flush()
+        self.assertEqual(
+            sorted(os.listdir(self.temp_dir.name)), ["rotating.log", "rotating.log.1", "rotating.log.2"]
+        )
+        self.assertLessEqual(os.path.getsize(file_name), 2000)
+
+
+if __name__ == '__main__':
+    unittest.main()
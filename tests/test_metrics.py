@@ -0,0 +1,58 @@
+import json
+import os
+import tempfile
+import unittest
+
+from app.core import metrics
+
+
+class RunMetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_phases_record_seconds_bytes_and_throughput(self):
+        run = metrics.RunMetrics("survival")
+        with run.phase("snapshot", method="copy") as phase:
+            phase["bytes"] = 4096
+        run.add("read", 2.0, 1000)
+        run.add("scan", 0.5, files=12)
+        snapshot, read, scan = run.phases
+        self.assertEqual((snapshot["phase"], snapshot["bytes"], snapshot["method"]), ("snapshot", 4096, "copy"))
+        self.assertEqual(read["throughput_bytes_per_second"], 500.0)
+        self.assertNotIn("bytes", scan)
+        self.assertEqual(scan["files"], 12)
+
+    def test_exports(self):
+        run = metrics.RunMetrics("survival", labels={"host": 'a"b'})
+        run.add("write", 1.0, 2048)
+        run.fields.update(success=True, codec="zstd")
+        report = run.write_json(os.path.join(self.temp_dir.name, "report.json"))
+        with open(os.path.join(self.temp_dir.name, "report.json")) as f:
+            self.assertEqual(json.load(f), report)
+        self.assertEqual(report["phases"][0]["phase"], "write")
+
+        prom_file = os.path.join(self.temp_dir.name, "survival.prom")
+        run.write_prometheus(prom_file)
+        with open(prom_file) as f:
+            lines = f.read().splitlines()
+        self.assertIn('pycraft_backup_phase_bytes{container="survival",host="ab",phase="write"} 2048.0', lines)
+        self.assertIn('pycraft_backup_success{container="survival",host="ab"} 1.0', lines)
+        # strings aren't gauges
+        self.assertFalse(any(each.startswith("pycraft_backup_codec") for each in lines))
+
+    def test_tracemalloc_profile_written(self):
+        prefix = os.path.join(self.temp_dir.name, "profiles", "survival")
+        with metrics.profiling("tracemalloc", prefix):
+            [bytes(1024) for _ in range(100)]
+        with open(f"{prefix}.tracemalloc.txt") as f:
+            self.assertTrue(f.readline().startswith("current:"))
+        with self.assertRaises(ValueError):
+            with metrics.profiling("perf", prefix):
+                pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from app.core import archive, offsite
+
+try:
+    from moto.server import ThreadedMotoServer
+except ImportError:
+    ThreadedMotoServer = None
+
+PART_SIZE = offsite.MIN_PART_SIZE
+
+
+@unittest.skipIf(offsite.boto3 is None or ThreadedMotoServer is None, "needs boto3 and moto[server]")
+class OffsiteTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # a local S3 stand in, the same endpoint_url path MinIO would take
+        cls.server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+        cls.server.start()
+        host, port = cls.server.get_host_and_port()
+        os.environ.update(AWS_ACCESS_KEY_ID="testing", AWS_SECRET_ACCESS_KEY="testing")
+        cls.client = offsite.make_client(f"http://{host}:{port}", "us-east-1")
+        cls.client.create_bucket(Bucket="backups")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.target = offsite.S3Target("backups", "survival", part_size=PART_SIZE, workers=2, client=self.client)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_file(self, size: int) -> str:
+        file_name = os.path.join(self.temp_dir.name, "2024-May-01-12.00.00.tar.gz")
+        with open(file_name, "wb") as f:
+            f.write(os.urandom(size))
+        return file_name
+
+    def remote(self, key: str) -> bytes:
+        return self.client.get_object(Bucket="backups", Key=key)["Body"].read()
+
+    def test_archive_streams_to_s3_while_written(self):
+        source = os.path.join(self.temp_dir.name, "world")
+        os.mkdir(source)
+        with open(os.path.join(source, "r.0.0.mca"), "wb") as f:
+            f.write(os.urandom(2 * PART_SIZE + 1000))
+        name = os.path.join(self.temp_dir.name, "world.tar.gz")
+        upload = self.target.start_upload(name)
+        archive.write_archive(name, "x:gz", source, codec="gzip", workers=1, mirror=upload)
+        # the upload saw every byte while the archive was written, nothing is read back from disk
+        self.assertEqual(upload.bytes_written, os.path.getsize(name))
+        uploaded = upload.close()
+        self.assertEqual(uploaded["parts"], 3)
+        self.assertEqual(
+            self.target.upload_sidecars(name), ["survival/world.tar.gz.sha256", "survival/world.tar.gz.idx"]
+        )
+        with open(name, "rb") as f:
+            self.assertEqual(self.remote("survival/world.tar.gz"), f.read())
+        self.assertFalse(os.path.exists(offsite.upload_state_file(name)))
+
+    def test_interrupted_upload_resumes_with_the_missing_parts_only(self):
+        file_name = self.make_file(2 * PART_SIZE + 4096)
+        upload = self.target.start_upload(file_name)
+        with open(file_name, "rb") as f:
+            upload.upload_part(1, f.read(PART_SIZE))
+        # the process died here, the state file knows part 1 made it
+        with mock.patch.object(self.client, "upload_part", wraps=self.client.upload_part) as sent:
+            uploaded = self.target.upload_file(file_name)
+        self.assertEqual(sorted(each.kwargs["PartNumber"] for each in sent.call_args_list), [2, 3])
+        self.assertEqual(uploaded["parts"], 3)
+        with open(file_name, "rb") as f:
+            self.assertEqual(self.remote(self.target.key(file_name)), f.read())
+
+    def test_failed_parts_never_fail_the_writer(self):
+        file_name = self.make_file(PART_SIZE + 10)
+        upload = self.target.start_upload(file_name)
+        with mock.patch.object(self.client, "upload_part", side_effect=OSError("connection reset")), \
+                mock.patch.object(offsite.time, "sleep"):
+            with open(file_name, "rb") as f:
+                upload.write(f.read())
+            with self.assertRaises(offsite.OffsiteUploadError):
+                upload.close()
+        self.assertTrue(os.path.exists(offsite.upload_state_file(file_name)))
+        self.assertEqual(self.target.upload_file(file_name)["parts"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+from app import orchestrator
+from app.core.throttle import TokenBucket
+
+
+class OrchestratorTestCase(unittest.TestCase):
+    def test_worker_budget_caps_concurrent_backups(self):
+        lock = threading.Lock()
+        state = {"active": 0, "peak": 0, "workers": []}
+
+        def fake_backup(settings: dict) -> bool:
+            with lock:
+                state["active"] += settings["workers"]
+                state["peak"] = max(state["peak"], state["active"])
+                state["workers"].append(settings["workers"])
+            time.sleep(0.05)
+            with lock:
+                state["active"] -= settings["workers"]
+            return settings["container"] != "broken"
+
+        worlds = [
+            orchestrator.world_settings({"container": name, "codec": "gzip", "workers": 2}, {"save_dir": "backups"})
+            for name in ("one", "two", "three", "broken")
+        ]
+        with mock.patch.object(orchestrator.dwb, "backup_world", fake_backup):
+            results = asyncio.run(orchestrator.orchestrate(worlds, max_workers=3))
+        self.assertLessEqual(state["peak"], 3)
+        self.assertEqual(state["workers"], [2, 2, 2, 2])
+        self.assertEqual([each["succeeded"] for each in results], [True, True, True, False])
+        self.assertTrue(worlds[0]["save_dir"].endswith("one"))
+
+    def test_token_bucket_limits_rate(self):
+        bucket = TokenBucket(rate=100000, capacity=10000)
+        start = time.monotonic()
+        for _ in range(5):
+            bucket.consume(10000)
+        # the first 10000 come from the full bucket, the other 40000 at 100000 per second
+        self.assertGreaterEqual(time.monotonic() - start, 0.35)
+
+
+if __name__ == '__main__':
+    unittest.main()
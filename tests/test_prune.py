@@ -0,0 +1,143 @@
+import gzip
+import os
+import struct
+import tempfile
+import unittest
+import zlib
+
+from app.core import anvil, archive, nbt, prune, restore
+
+
+def tag(kind: int, name: str, payload: bytes) -> bytes:
+    encoded = name.encode()
+    return bytes([kind]) + struct.pack(">H", len(encoded)) + encoded + payload
+
+
+def compound(*tags: bytes) -> bytes:
+    return b"".join(tags) + bytes([nbt.TAG_END])
+
+
+def chunk_nbt(inhabited: int, nested: bool = False) -> bytes:
+    # enough of a chunk to have to skip over every kind of tag before InhabitedTime
+    section = compound(
+        tag(nbt.TAG_BYTE, "Y", b"\x00"),
+        tag(nbt.TAG_LONG_ARRAY, "data", struct.pack(">i", 3) + b"\x01" * 24),
+        tag(nbt.TAG_LIST, "palette", bytes([nbt.TAG_STRING]) + struct.pack(">i", 2) + b"\x00\x05stone\x00\x03air"),
+    )
+    body = [
+        tag(nbt.TAG_INT, "DataVersion", struct.pack(">i", 3700)),
+        tag(nbt.TAG_STRING, "Status", b"\x00\x0eminecraft:full"),
+        tag(nbt.TAG_LIST, "sections", bytes([nbt.TAG_COMPOUND]) + struct.pack(">i", 2) + section * 2),
+        tag(nbt.TAG_INT_ARRAY, "Heightmap", struct.pack(">i", 2) + b"\x00" * 8),
+        tag(nbt.TAG_DOUBLE, "x", b"\x00" * 8),
+        tag(nbt.TAG_LONG, "InhabitedTime", struct.pack(">q", inhabited)),
+        tag(nbt.TAG_BYTE_ARRAY, "Biomes", struct.pack(">i", 4) + os.urandom(4)),
+    ]
+    if nested:
+        # before 1.18 everything sat under Level
+        body = [tag(nbt.TAG_COMPOUND, "Level", compound(*body))]
+    return tag(nbt.TAG_COMPOUND, "", compound(*body))
+
+
+def record(data: bytes, kind: int = anvil.ZLIB) -> bytes:
+    payload = zlib.compress(data) if kind == anvil.ZLIB else gzip.compress(data) if kind == anvil.GZIP else data
+    return struct.pack(">IB", len(payload) + 1, kind) + payload
+
+
+class NBTTestCase(unittest.TestCase):
+    def test_find_values_skips_everything_else(self):
+        self.assertEqual(nbt.find_values(chunk_nbt(1234), {"InhabitedTime", "Status"}), {
+            "InhabitedTime": 1234, "Status": "minecraft:full"
+        })
+        self.assertEqual(nbt.find_values(chunk_nbt(7, nested=True), {"InhabitedTime"}, within={"Level"}), {
+            "InhabitedTime": 7
+        })
+        self.assertEqual(nbt.find_values(chunk_nbt(7, nested=True), {"InhabitedTime"}), {})
+        with self.assertRaises(nbt.NBTError):
+            nbt.find_values(chunk_nbt(1)[:-20], {"InhabitedTime"})
+
+
+class ChunkPrunerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.world = os.path.join(self.temp_dir.name, "world")
+        for each in ("region", "entities", "DIM-1/region"):
+            os.makedirs(os.path.join(self.world, *each.split("/")))
+        timestamps = [0] * anvil.SLOTS
+        self.terrain = {
+            0: record(chunk_nbt(0) + os.urandom(20000)),
+            1: record(chunk_nbt(0, nested=True) + os.urandom(20000), anvil.GZIP),
+            2: record(chunk_nbt(50) + os.urandom(20000), anvil.UNCOMPRESSED),
+            3: record(chunk_nbt(10 ** 6) + os.urandom(20000)),
+            # can't be read, so it stays
+            4: struct.pack(">IB", 101, anvil.ZLIB) + os.urandom(100),
+        }
+        for slot in self.terrain:
+            timestamps[slot] = 1000 + slot
+        anvil.write_region(os.path.join(self.world, "region", "r.0.0.mca"), self.terrain, timestamps)
+        self.entities = {slot: record(os.urandom(3000)) for slot in (0, 3)}
+        anvil.write_region(os.path.join(self.world, "entities", "r.0.0.mca"), self.entities, timestamps)
+        anvil.write_region(
+            os.path.join(self.world, "DIM-1", "region", "r.0.0.mca"), {7: self.terrain[3]}, timestamps
+        )
+        with open(os.path.join(self.world, "level.dat"), "wb") as f:
+            f.write(gzip.compress(b"level"))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def slots(self, path: str) -> dict:
+        with anvil.RegionFile(path) as region:
+            found = {}
+            for slot in range(anvil.SLOTS):
+                view = region.chunk_record(slot)
+                if view is not None:
+                    found[slot] = bytes(view)
+                    view.release()
+            return found
+
+    def test_unvisited_chunks_are_left_out_of_the_archive(self):
+        pruner = prune.ChunkPruner(threshold=100, workers=2)
+        result = archive.write_archive(
+            os.path.join(self.temp_dir.name, "world.tar.gz"), "w", self.world, codec="gzip", workers=1,
+            arcname="world", pruner=pruner
+        )
+        self.assertEqual(archive.verify(result), [])
+        pruned = result["pruned"]
+        self.assertEqual((pruned["regions"], pruned["chunks"], pruned["pruned"], pruned["unreadable"]), (2, 6, 3, 1))
+        self.assertEqual(set(pruned["per_region"]), {"region/r.0.0.mca", "entities/r.0.0.mca"})
+        self.assertEqual(pruned["per_region"]["entities/r.0.0.mca"]["pruned"], 1)
+        self.assertGreater(pruned["bytes_saved"], 3 * 20000)
+
+        target = os.path.join(self.temp_dir.name, "restored")
+        restore.extract(result["name"], target)
+        self.assertEqual(self.slots(os.path.join(target, "region", "r.0.0.mca")), {
+            slot: self.terrain[slot] for slot in (3, 4)
+        })
+        self.assertEqual(self.slots(os.path.join(target, "entities", "r.0.0.mca")), {3: self.entities[3]})
+        with anvil.RegionFile(os.path.join(target, "region", "r.0.0.mca")) as region:
+            self.assertEqual(region.timestamps[0], 0)
+            self.assertEqual(region.timestamps[3], 1003)
+        self.assertEqual(
+            os.path.getsize(os.path.join(target, "DIM-1", "region", "r.0.0.mca")),
+            os.path.getsize(os.path.join(self.world, "DIM-1", "region", "r.0.0.mca"))
+        )
+
+    def test_chunks_saved_again_since_the_plan_are_kept(self):
+        pruner = prune.ChunkPruner(threshold=1, workers=1)
+        pruner.prepare(self.world)
+        path = os.path.join(self.world, "region", "r.0.0.mca")
+        self.assertEqual(set(pruner.plan[os.path.abspath(path)]), {0, 1})
+        timestamps = [0] * anvil.SLOTS
+        for slot in self.terrain:
+            timestamps[slot] = 2000
+        anvil.write_region(path, self.terrain, timestamps)
+        rebuilt = pruner.prune(path)
+        self.assertEqual(len(rebuilt), os.path.getsize(path))
+        self.assertEqual(pruner.report["region/r.0.0.mca"]["pruned"], 0)
+        with self.assertRaises(ValueError):
+            prune.ChunkPruner(threshold=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
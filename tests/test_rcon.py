@@ -0,0 +1,114 @@
+import socketserver
+import struct
+import threading
+import time
+import unittest
+from unittest import mock
+
+from app.core import rcon
+from app.core import server_control
+from app.core.Custom_Errors import RconAuthenticationException
+
+PASSWORD = "hunter2"
+
+
+class FakeRconHandler(socketserver.BaseRequestHandler):
+    # just enough of the minecraft server's rcon side: auth, commands, long responses split over packets
+    def read_packet(self):
+        # like the real server, one packet per read, anything sent along with it is a protocol error
+        data = b""
+        while len(data) < 4 or len(data) < 4 + struct.unpack_from("<i", data)[0]:
+            received = self.request.recv(8192)
+            if not received:
+                return None
+            data += received
+        length = struct.unpack_from("<i", data)[0]
+        if len(data) > 4 + length:
+            self.server.batched += 1
+            return None
+        request_id, packet_type = struct.unpack_from("<ii", data, 4)
+        return request_id, packet_type, data[12:4 + length - 2].decode()
+
+    def handle(self):
+        self.server.connections += 1
+        while True:
+            packet = self.read_packet()
+            if packet is None:
+                return
+            request_id, packet_type, body = packet
+            if packet_type == rcon.SERVERDATA_AUTH:
+                accepted = body == PASSWORD
+                self.request.sendall(rcon.encode_packet(request_id if accepted else -1, 2, ""))
+            elif packet_type == rcon.SERVERDATA_EXECCOMMAND:
+                self.server.received.append(body)
+                if body == "save-all flush":
+                    # a large world takes a while to save
+                    time.sleep(self.server.flush_delay)
+                    self.request.sendall(rcon.encode_packet(request_id, 0, "Saved the game"))
+                elif body == "long":
+                    for _ in range(3):
+                        self.request.sendall(rcon.encode_packet(request_id, 0, "x" * 4096))
+                else:
+                    self.request.sendall(rcon.encode_packet(request_id, 0, f"ran {body}"))
+            else:
+                self.request.sendall(rcon.encode_packet(request_id, 0, f"Unknown request {packet_type:x}"))
+
+
+class RconTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FakeRconHandler)
+        self.server.daemon_threads = True
+        self.server.connections = 0
+        self.server.batched = 0
+        self.server.flush_delay = 0
+        self.server.received = []
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        rcon.pool.close_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_batch_reads_every_response(self):
+        with rcon.RconClient("127.0.0.1", self.port, PASSWORD) as client:
+            responses = client.commands(["save-off", "long", "say hi"])
+        self.assertEqual(responses[0], "ran save-off")
+        self.assertEqual(len(responses[1]), 3 * 4096)
+        self.assertEqual(responses[2], "ran say hi")
+        self.assertEqual(self.server.batched, 0)
+
+    def test_bad_password(self):
+        client = rcon.RconClient("127.0.0.1", self.port, "wrong")
+        with self.assertRaises(RconAuthenticationException):
+            client.command("list")
+
+    def test_control_reuses_one_connection_and_batches_lines(self):
+        server_control.configure("mc", f"127.0.0.1:{self.port}", PASSWORD)
+        control = server_control.get_control("mc")
+        control.say("line one\nline two")
+        self.assertGreaterEqual(control.save_flush(5), 0)
+        self.assertEqual(self.server.received, ["say line one", "say line two", "save-all flush"])
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(self.server.batched, 0)
+
+    def test_flush_waits_past_the_socket_timeout_and_never_runs_twice(self):
+        # the pool's 5 second timeout scaled down, the flush answers after it
+        self.server.flush_delay = 0.5
+        with mock.patch.object(rcon.pool, "timeout", 0.2):
+            server_control.configure("mc", f"127.0.0.1:{self.port}", PASSWORD)
+            control = server_control.get_control("mc")
+            control.say("backup starting")
+            self.assertGreaterEqual(control.save_flush(5), 0.5)
+            with self.assertRaises(TimeoutError):
+                control.save_flush(0.3)
+        self.assertEqual(self.server.received, ["say backup starting", "save-all flush", "save-all flush"])
+
+    def test_parse_address(self):
+        self.assertEqual(rcon.parse_address("mc.example.com"), ("mc.example.com", rcon.DEFAULT_PORT))
+        self.assertEqual(rcon.parse_address("10.0.0.2:25576"), ("10.0.0.2", 25576))
+        self.assertEqual(rcon.parse_address("[::1]:25577"), ("::1", 25577))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+import os
+import tarfile
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from app.core import archive, catalog, recompact, restore, retention
+from app.core.chunk_store import ChunkStore
+
+DAY = 24 * 60 * 60
+
+
+class RecompactTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.world = os.path.join(self.temp_dir.name, "world")
+        self.save_dir = os.path.join(self.temp_dir.name, "backups")
+        os.makedirs(os.path.join(self.world, "region"))
+        os.makedirs(self.save_dir)
+        for x in range(3):
+            with open(os.path.join(self.world, "region", f"r.{x}.0.mca"), "wb") as f:
+                f.write(b" ".join(b"block %d" % (each % (x + 97)) for each in range(100000)))
+        with open(os.path.join(self.world, "level.dat"), "wb") as f:
+            f.write(os.urandom(2000))
+        self.old = time.time() - 30 * DAY
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def backup(self, name: str, codec: str, level: int, created: float = None) -> str:
+        # an aged archive, as a backup weeks ago would have left it
+        created = self.old if created is None else created
+        result = archive.write_archive(
+            os.path.join(self.save_dir, name), "x", self.world, codec=codec, level=level, workers=1, arcname="world"
+        )
+        os.utime(result["name"], (created, created))
+        with catalog.Catalog(catalog.catalog_file(self.save_dir)) as backup_catalog:
+            backup_catalog.record_archive(result, source=self.world, created=created)
+        return result["name"]
+
+    def assert_restores(self, archive_name: str):
+        target = os.path.join(self.temp_dir.name, "restored")
+        stats = restore.extract(archive_name, target, ["region/*"])
+        self.assertTrue(stats["random_access"])
+        for x in range(3):
+            with open(os.path.join(target, "region", f"r.{x}.0.mca"), "rb") as f, \
+                    open(os.path.join(self.world, "region", f"r.{x}.0.mca"), "rb") as original:
+                self.assertEqual(f.read(), original.read())
+
+    def test_reencode_in_place_and_under_a_new_name(self):
+        fast = self.backup("2024-Jan-01-00.00.00.tar.gz", "gzip", 1)
+        plain = self.backup("2024-Jan-02-00.00.00.tar", "none", 0, created=self.old + DAY)
+        self.backup("fresh.tar.gz", "gzip", 1)
+        os.utime(os.path.join(self.save_dir, "fresh.tar.gz"))
+        with open(archive.manifest_name(fast)) as f:
+            manifest = f.read()
+
+        recompactor = recompact.Recompactor(self.save_dir, codec="gzip", level=9, workers=1)
+        self.assertEqual(recompactor.candidates(), [os.path.basename(fast), os.path.basename(plain)])
+        report = recompactor.run()
+        self.assertEqual(len(report["archives"]), 2)
+        self.assertTrue(all(each["shrunk"] for each in report["archives"]))
+        self.assertEqual(report["reclaimed"], sum(each["before"] - each["after"] for each in report["archives"]))
+
+        # same name, smaller, still randomly accessible, checksums of the files untouched
+        self.assertEqual(os.path.getsize(fast), report["archives"][0]["after"])
+        self.assertAlmostEqual(os.path.getmtime(fast), self.old, places=3)
+        with open(archive.manifest_name(fast)) as f:
+            self.assertEqual(f.read(), manifest)
+        self.assert_restores(fast)
+
+        renamed = plain + ".gz"
+        self.assertFalse(os.path.exists(plain))
+        self.assertFalse(os.path.exists(archive.member_index_name(plain)))
+        self.assertTrue(os.path.exists(archive.manifest_name(renamed)))
+        self.assert_restores(renamed)
+
+        with catalog.Catalog(catalog.catalog_file(self.save_dir)) as backup_catalog:
+            self.assertIsNone(backup_catalog.get(os.path.basename(plain)))
+            row = backup_catalog.get(os.path.basename(renamed))
+        self.assertEqual(
+            (row["codec"], row["size"], row["created"]), ("gzip", os.path.getsize(renamed), self.old + DAY)
+        )
+        index = retention.ArchiveIndex(self.save_dir).archives
+        self.assertEqual(index[os.path.basename(fast)]["size"], os.path.getsize(fast))
+        self.assertEqual(sorted(each for each in os.listdir(self.save_dir) if each.endswith(recompact.TEMP_SUFFIX)), [])
+        # done once per codec and level
+        self.assertEqual(recompactor.candidates(), [])
+
+    def test_a_copy_that_doesnt_read_back_leaves_the_original(self):
+        fast = self.backup("2024-Jan-01-00.00.00.tar.gz", "gzip", 1)
+        size = os.path.getsize(fast)
+        with mock.patch.object(recompact, "stream_sha256", return_value="0" * 64):
+            with self.assertRaises(ValueError):
+                recompact.Recompactor(self.save_dir, codec="gzip", level=9, workers=1).run(merge=False)
+        self.assertEqual(os.path.getsize(fast), size)
+        self.assertEqual(os.listdir(self.save_dir).count(os.path.basename(fast) + recompact.TEMP_SUFFIX), 0)
+        self.assert_restores(fast)
+
+    def test_aged_incrementals_merge_into_a_synthetic_full(self):
+        store = ChunkStore(os.path.join(self.save_dir, "chunk_store"))
+        store.backup(self.world, name="2024-01-01-00.00.00")
+        with open(os.path.join(self.world, "region", "r.0.0.mca"), "wb") as f:
+            f.write(os.urandom(50000))
+        store.backup(self.world, name="2024-01-01-06.00.00")
+        store.backup(self.world, name="2024-01-02-00.00.00")
+        newest = store.backup(self.world)["name"]
+
+        recompactor = recompact.Recompactor(self.save_dir, codec="gzip", level=9, workers=1, chunk_store=store)
+        self.assertEqual(recompactor.incremental_runs(), [
+            ["2024-01-01-00.00.00", "2024-01-01-06.00.00"], ["2024-01-02-00.00.00"]
+        ])
+        report = recompactor.run()
+        self.assertEqual(store.snapshot_names(), [newest])
+        # the chunks of the first r.0.0.mca were only in the first snapshot
+        self.assertGreater(report["chunks_freed"], 0)
+        self.assertEqual(
+            report["reclaimed"],
+            report["chunks_freed"] + sum(each["manifests"] - each["after"] for each in report["merged"])
+        )
+
+        synthetic = report["merged"][0]["name"]
+        self.assertTrue(synthetic.endswith("2024-Jan-01-06.00.00.synthetic.tar.gz"))
+        with tarfile.open(synthetic) as tar:
+            names = tar.getnames()
+        root = archive.normalize_arcname(self.world)
+        self.assertEqual(names[0], root)
+        self.assertIn(f"{root}/region/r.1.0.mca", names)
+        self.assert_restores(synthetic)
+        with catalog.Catalog(catalog.catalog_file(self.save_dir)) as backup_catalog:
+            row = backup_catalog.get(os.path.basename(synthetic))
+        self.assertEqual(row["created"], recompact.snapshot_created("2024-01-01-06.00.00"))
+        self.assertEqual(recompactor.run()["merged"], [])
+
+    def test_synthesize_never_roots_an_archive_at_a_scratch_copy(self):
+        store = ChunkStore(os.path.join(self.save_dir, "chunk_store"))
+        # as --snapshot-dir incrementals recorded their source before the world was
+        scratch = os.path.join(self.temp_dir.name, "scratch", "backup.snapshot")
+        store.backup(self.world, name="2024-01-01-00.00.00", root=scratch)
+        archive_name = os.path.join(self.save_dir, "synthetic.tar.gz")
+        with self.assertRaises(ValueError):
+            recompact.synthesize(store, "2024-01-01-00.00.00", archive_name, "gzip", 1, 1)
+        self.assertFalse(os.path.exists(archive_name))
+
+        result = recompact.synthesize(store, "2024-01-01-00.00.00", archive_name, "gzip", 1, 1, source=self.world)
+        self.assertEqual(result["source"], os.path.abspath(self.world))
+        with tarfile.open(archive_name) as tar:
+            self.assertEqual(tar.getnames()[0], archive.normalize_arcname(self.world))
+        self.assert_restores(archive_name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+from unittest import mock
+
+from app.core import archive
+from app.core import compression
+from app.core import restore
+
+
+class RestoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.temp_dir.name, "minecraft_data")
+        self.files = {}
+        names = ["world/level.dat", "world/playerdata/a.dat", "world/playerdata/b.dat", "world/region/r.0.0.mca"]
+        for relative in names:
+            path = os.path.join(self.source, *relative.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.files[relative] = os.urandom(50000)
+            with open(path, "wb") as f:
+                f.write(self.files[relative])
+        self.target = os.path.join(self.temp_dir.name, "restored")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def restored(self) -> dict:
+        found = {}
+        for directory, dir_names, file_names in os.walk(self.target):
+            for file_name in file_names:
+                path = os.path.join(directory, file_name)
+                with open(path, "rb") as f:
+                    found[os.path.relpath(path, self.target).replace(os.sep, "/")] = f.read()
+        return found
+
+    def test_glob_reads_only_the_blocks_holding_it(self):
+        name = os.path.join(self.temp_dir.name, "world.tar.gz")
+        archive.write_archive(name, "x", self.source, codec="gzip", workers=1, block_size=16384)
+        index = restore.load_member_index(name)
+        self.assertGreater(len(index["blocks"]), 10)
+        decompressed = []
+        original = compression.decompress_block
+
+        def counting(codec, data):
+            decompressed.append(len(data))
+            return original(codec, data)
+
+        with mock.patch.object(compression, "decompress_block", counting):
+            stats = restore.extract(name, self.target, ["world/playerdata/a.*"])
+        self.assertTrue(stats["random_access"])
+        self.assertEqual(self.restored(), {"world/playerdata/a.dat": self.files["world/playerdata/a.dat"]})
+        # ~50 KB of a ~200 KB archive, a few 16 KiB blocks rather than all of them
+        self.assertLessEqual(len(decompressed), 5)
+
+    def test_directory_pattern_and_full_restore(self):
+        name = os.path.join(self.temp_dir.name, "world.tar.gz")
+        archive.write_archive(name, "x", self.source, codec="gzip", workers=1, block_size=16384)
+        restore.extract(name, self.target, ["world/playerdata"])
+        self.assertEqual(set(self.restored()), {"world/playerdata/a.dat", "world/playerdata/b.dat"})
+        restore.extract(name, self.target)
+        self.assertEqual(self.restored(), self.files)
+
+    def test_single_stream_archive_reads_sequentially(self):
+        name = os.path.join(self.temp_dir.name, "world.tar.gz")
+        archive.write_archive(name, "x:gz", self.source)
+        stats = restore.extract(name, self.target, ["world/level.dat"])
+        self.assertFalse(stats["random_access"])
+        self.assertEqual(self.restored(), {"world/level.dat": self.files["world/level.dat"]})
+        # without the sidecar the first member is taken as the archived source directory
+        os.remove(archive.member_index_name(name))
+        restore.extract(name, self.target, ["world/region/*"])
+        self.assertIn("world/region/r.0.0.mca", self.restored())
+
+    def test_refuses_paths_outside_target(self):
+        with self.assertRaises(ValueError):
+            restore.target_path(self.target, "../escape")
+
+    def test_hard_links_come_back_with_their_data(self):
+        os.link(
+            os.path.join(self.source, "world", "playerdata", "a.dat"), os.path.join(self.source, "world", "z.dat")
+        )
+        for codec, mode in (("gzip", "x"), (None, "x:gz")):
+            name = os.path.join(self.temp_dir.name, f"world.{mode}.tar.gz")
+            archive.write_archive(name, mode, self.source, codec=codec, workers=1)
+            with tarfile.open(name) as written:
+                self.assertTrue(written.getmember(f"{archive.normalize_arcname(self.source)}/world/z.dat").islnk())
+            expected = self.files["world/playerdata/a.dat"]
+            restore.extract(name, self.target)
+            self.assertEqual(self.restored()["world/z.dat"], expected)
+            # only the link, the file it links to wasn't selected
+            os.remove(os.path.join(self.target, "world", "z.dat"))
+            restore.extract(name, os.path.join(self.target, "link only"), ["world/z.dat"])
+            with open(os.path.join(self.target, "link only", "world", "z.dat"), "rb") as f:
+                self.assertEqual(f.read(), expected)
+
+    def test_refuses_to_write_through_a_restored_symlink(self):
+        outside = os.path.join(self.temp_dir.name, "outside")
+        os.makedirs(outside)
+        name = os.path.join(self.temp_dir.name, "crafted.tar.gz")
+        with tarfile.open(name, "w:gz") as crafted:
+            crafted.addfile(self.member("world", tarfile.DIRTYPE))
+            crafted.addfile(self.member("world/escape", tarfile.SYMTYPE, linkname=outside))
+            crafted.addfile(self.member("world/escape/planted", tarfile.REGTYPE, size=4), io.BytesIO(b"evil"))
+        with self.assertRaises(ValueError):
+            restore.extract(name, self.target)
+        self.assertEqual(os.listdir(outside), [])
+
+    @staticmethod
+    def member(name: str, kind: bytes, linkname: str = "", size: int = 0) -> tarfile.TarInfo:
+        info = tarfile.TarInfo(name)
+        info.type, info.linkname, info.size, info.mode = kind, linkname, size, 0o755
+        return info
+
+
+if __name__ == '__main__':
+    unittest.main()
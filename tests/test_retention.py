@@ -0,0 +1,100 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+from app import docker_world_backup as dwb
+from app.core import retention
+from app.core.chunk_store import ChunkStore
+
+
+def epoch(*args) -> float:
+    return datetime.datetime(*args).timestamp()
+
+
+class SelectKeepTestCase(unittest.TestCase):
+    def test_grandfather_father_son(self):
+        created = {f"h{hour}": epoch(2026, 10, 18, hour) for hour in range(24)}
+        created.update({f"d{day}": epoch(2026, 10, day, 12) for day in range(1, 18)})
+        keep = retention.select_keep(created, {"hourly": 3, "daily": 3})
+        # the 3 newest hours, plus the newest of today, yesterday and the day before
+        self.assertEqual(keep, {"h23", "h22", "h21", "d17", "d16"})
+
+
+class PruneTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.save_dir = self.temp_dir.name
+        for day in range(1, 6):
+            name = os.path.join(self.save_dir, f"2026-Oct-0{day}.tar.gz")
+            with open(name, "wb") as f:
+                f.write(b"x" * 1000)
+            with open(f"{name}.sha256", "w") as f:
+                f.write("manifest")
+            os.utime(name, (epoch(2026, 10, day), epoch(2026, 10, day)))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_daily_policy_deletes_archive_and_sidecar(self):
+        index = retention.ArchiveIndex(self.save_dir)
+        result = retention.prune(index, {"daily": 2})
+        self.assertEqual(result["deleted"], ["2026-Oct-01.tar.gz", "2026-Oct-02.tar.gz", "2026-Oct-03.tar.gz"])
+        self.assertFalse(os.path.exists(os.path.join(self.save_dir, "2026-Oct-01.tar.gz.sha256")))
+        remaining = set(retention.ArchiveIndex(self.save_dir).archives)
+        self.assertEqual(remaining, {"2026-Oct-04.tar.gz", "2026-Oct-05.tar.gz"})
+
+    def test_size_budget_keeps_newest(self):
+        index = retention.ArchiveIndex(self.save_dir)
+        result = retention.prune(index, {"max_bytes": 2500}, dry_run=True)
+        self.assertEqual(len(result["deleted"]), 3)
+        self.assertNotIn("2026-Oct-05.tar.gz", result["deleted"])
+        self.assertEqual(len(index.archives), 5)
+
+    def test_last_counts_and_store_bytes_share_the_budget(self):
+        index = retention.ArchiveIndex(self.save_dir)
+        self.assertTrue(retention.has_policy({"last": 2}))
+        self.assertEqual(len(retention.prune(index, {"last": 2}, dry_run=True)["deleted"]), 3)
+        result = retention.prune(index, {"max_bytes": 2500}, dry_run=True, other_bytes=1000)
+        self.assertEqual(len(result["deleted"]), 4)
+        self.assertEqual(retention.prune_snapshots(["2026-10-01-00.00.00", "2026-10-02-00.00.00"], lambda name: None, {
+            "last": 1
+        }), ["2026-10-01-00.00.00"])
+
+    def test_store_bytes_counts_the_hot_packs(self):
+        world = os.path.join(self.save_dir, "world")
+        with open(dwb.hot_pack_file(self.save_dir, world), "wb") as f:
+            f.write(b"h" * 700)
+        with open(os.path.join(self.save_dir, "notes.pack.txt"), "wb") as f:
+            f.write(b"n" * 300)
+        self.assertEqual(dwb.store_bytes(self.save_dir), 700)
+
+    def test_make_room_deletes_oldest_first(self):
+        index = retention.ArchiveIndex(self.save_dir)
+        result = retention.make_room(index, 1500)
+        self.assertEqual(result["deleted"], ["2026-Oct-01.tar.gz", "2026-Oct-02.tar.gz"])
+        self.assertGreaterEqual(result["freed"], 1500)
+        # never the newest, however much is needed
+        self.assertEqual(len(retention.make_room(index, 10 ** 9)["deleted"]), 2)
+        self.assertEqual(set(index.archives), {"2026-Oct-05.tar.gz"})
+
+    def test_snapshot_prune_frees_unreferenced_chunks_only(self):
+        source = os.path.join(self.save_dir, "world")
+        os.makedirs(source)
+        store = ChunkStore(os.path.join(self.save_dir, "chunk_store"))
+        with open(os.path.join(source, "shared.dat"), "wb") as f:
+            f.write(os.urandom(5000))
+        with open(os.path.join(source, "old.dat"), "wb") as f:
+            f.write(os.urandom(5000))
+        store.backup(source, name="2026-10-01-00.00.00")
+        os.remove(os.path.join(source, "old.dat"))
+        store.backup(source, name="2026-10-02-00.00.00")
+
+        deleted = retention.prune_snapshots(store.snapshot_names(), store.delete_snapshot, {"daily": 1})
+        self.assertEqual(deleted, ["2026-10-01-00.00.00"])
+        self.assertGreater(store.collect_garbage(), 0)
+        self.assertEqual(store.restore("latest", os.path.join(self.save_dir, "restored")), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
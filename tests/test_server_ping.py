@@ -0,0 +1,94 @@
+import asyncio
+import json
+import struct
+import unittest
+
+from app.core import server_ping
+
+
+INFO = {
+    "version": {"name": "1.20.4", "protocol": 765},
+    "players": {"online": 2, "max": 20, "sample": [{"name": "Steve", "id": "0"}, {"name": "Alex", "id": "1"}]},
+    "description": {"text": "§aA ", "extra": [{"text": "Minecraft Server\nsecond line"}]},
+}
+
+
+def serving(info):
+    # a 1.7+ server: handshake, status request answered with info, then echo the ping
+    async def handler(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        packet_id, handshake = await server_ping.read_packet(reader)
+        protocol, position = server_ping.decode_varint(handshake)
+        assert packet_id == 0 and protocol == -1
+        await server_ping.read_packet(reader)
+        writer.write(server_ping.encode_packet(0, server_ping.encode_string(json.dumps(info))))
+        packet_id, token = await server_ping.read_packet(reader)
+        writer.write(server_ping.encode_packet(1, token))
+        await writer.drain()
+        writer.close()
+    return handler
+
+
+modern_handler = serving(INFO)
+
+
+async def legacy_handler(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    # a 1.6 server doesn't understand the handshake, it answers anything with its legacy kick packet
+    await reader.read(2)
+    text = "§1\x0078\x001.6.4\x00§cOld Server\x005\x0010"
+    writer.write(b"\xff" + struct.pack(">H", len(text)) + text.encode("utf-16-be"))
+    await writer.drain()
+    writer.close()
+
+
+async def silent_handler(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    await asyncio.sleep(5)
+    writer.close()
+
+
+class ServerPingTestCase(unittest.TestCase):
+    def run_against(self, handler, addresses=None, timeout: float = 2.0) -> dict:
+        async def scenario():
+            server = await asyncio.start_server(handler, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                return await server_ping.ping_many(addresses or [f"127.0.0.1:{port}"], timeout)
+        return list(asyncio.run(scenario()).values())
+
+    def test_varint_round_trip(self):
+        for value in [0, 1, 127, 128, 25565, 2147483647, -1]:
+            self.assertEqual(server_ping.decode_varint(server_ping.encode_varint(value))[0], value)
+        self.assertEqual(server_ping.encode_varint(-1), b"\xff\xff\xff\xff\x0f")
+
+    def test_modern_status_has_the_mcsrvstat_shape(self):
+        status = self.run_against(modern_handler)[0]
+        self.assertTrue(status["online"])
+        self.assertFalse(status["debug"]["legacy"])
+        self.assertEqual(status["version"], "1.20.4")
+        self.assertEqual(status["protocol"], 765)
+        self.assertEqual(status["players"], {"online": 2, "max": 20, "list": ["Steve", "Alex"]})
+        self.assertEqual(status["motd"]["clean"], ["A Minecraft Server", "second line"])
+        self.assertEqual(status["ip"], "127.0.0.1")
+
+    def test_legacy_fallback(self):
+        status = self.run_against(legacy_handler)[0]
+        self.assertTrue(status["debug"]["legacy"])
+        self.assertEqual(status["version"], "1.6.4")
+        self.assertEqual(status["players"], {"online": 5, "max": 10})
+        self.assertEqual(status["motd"]["clean"], ["Old Server"])
+
+    def test_malformed_status_reports_offline(self):
+        for info in ([1, 2], {"players": "many"}, {"version": "1.20"}, {"players": {"online": None}}):
+            status = self.run_against(serving(info))[0]
+            self.assertFalse(status["online"])
+            self.assertIn("Error", status["debug"]["error"])
+
+    def test_timeout_and_refused_report_offline(self):
+        status = self.run_against(silent_handler, timeout=0.2)[0]
+        self.assertFalse(status["online"])
+        self.assertIn("TimeoutError", status["debug"]["error"])
+        # nothing listens on port 1
+        self.assertFalse(self.run_against(modern_handler, ["127.0.0.1:1"])[0]["online"])
+
+
+if __name__ == '__main__':
+    unittest.main()
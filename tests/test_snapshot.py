@@ -0,0 +1,92 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from app import docker_world_backup as dwb
+from app.core import snapshot
+
+
+class CopyTreeTestCase(unittest.TestCase):
+    def test_copy_is_point_in_time(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source = os.path.join(temp_dir, "world")
+            os.makedirs(os.path.join(source, "region"))
+            region = os.path.join(source, "region", "r.0.0.mca")
+            with open(region, "wb") as f:
+                f.write(b"before")
+            os.utime(region, ns=(10 ** 18, 10 ** 18))
+            target = os.path.join(temp_dir, "scratch", "copy")
+            stats = snapshot.copy_tree(source, target, "auto")
+            with open(region, "wb") as f:
+                f.write(b"after")
+            copied = os.path.join(target, "region", "r.0.0.mca")
+            with open(copied, "rb") as f:
+                self.assertEqual(f.read(), b"before")
+            self.assertEqual(os.stat(copied).st_mtime_ns, 10 ** 18)
+            self.assertEqual(stats["files"], 1)
+
+
+class TwoPhaseBackupTestCase(unittest.TestCase):
+    def test_saving_resumes_before_compression(self):
+        events = []
+
+        class FakeControl:
+            def command(self, command: str) -> str:
+                events.append(command)
+                return ""
+
+            def say(self, message: str):
+                pass
+
+            def save_flush(self, timeout: float) -> float:
+                events.append("flush")
+                return 0.0
+
+        def fake_archive(*args, **kwargs):
+            events.append("archive")
+            return True
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source = os.path.join(temp_dir, "world")
+            os.makedirs(source)
+            with mock.patch.object(dwb.server_control, "get_control", lambda container: FakeControl()), \
+                    mock.patch.object(dwb, "archive_validation", fake_archive), \
+                    mock.patch.object(dwb, "DEBUG", False):
+                dwb.do_backup(
+                    "mc", "backup.tar.gz", "w:gz", source, temp_dir,
+                    snapshot_dir=os.path.join(temp_dir, "scratch"), flush_timeout=1
+                )
+            self.assertEqual(events, ["/save-off", "flush", "/save-on", "archive"])
+            self.assertEqual(os.listdir(os.path.join(temp_dir, "scratch")), [])
+
+    def test_incremental_records_the_world_not_the_copy(self):
+        class FakeControl:
+            def command(self, command: str) -> str:
+                return ""
+
+            def say(self, message: str):
+                pass
+
+            def save_flush(self, timeout: float) -> float:
+                return 0.0
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source = os.path.join(temp_dir, "world")
+            os.makedirs(source)
+            with open(os.path.join(source, "level.dat"), "wb") as f:
+                f.write(b"level")
+            store = dwb.ChunkStore(os.path.join(temp_dir, "chunks"))
+            with mock.patch.object(dwb.server_control, "get_control", lambda container: FakeControl()), \
+                    mock.patch.object(dwb, "DEBUG", False):
+                dwb.do_backup(
+                    "mc", "backup", "w:gz", source, temp_dir, chunk_store=store.root,
+                    snapshot_dir=os.path.join(temp_dir, "scratch"), flush_timeout=1
+                )
+            recorded = store.load_snapshot(store.snapshot_names()[-1])
+            self.assertEqual(recorded["source"], os.path.abspath(source))
+            self.assertEqual(list(recorded["files"]), ["level.dat"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import asyncio
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from app.core.cache import TTLCache
+
+try:
+    import requests
+    from app import get_status
+except ImportError:
+    requests = None
+
+
+class TTLCacheTestCase(unittest.TestCase):
+    def test_expiry_and_lru_eviction(self):
+        cache = TTLCache(ttl=60, max_entries=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        # b was the least recently used
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+        cache.put("short", 4, ttl=0.01)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("short"))
+
+    def test_max_age_reloads_an_older_entry(self):
+        cache = TTLCache(ttl=60)
+        cache.put("mc", "old")
+        self.assertEqual(cache.get_or_load("mc", lambda: "new", max_age=10), "old")
+        time.sleep(0.02)
+        self.assertEqual(cache.get_or_load("mc", lambda: "new", max_age=0.01), "new")
+        self.assertEqual(cache.get_or_load("mc", lambda: "newer", max_age=10), "new")
+
+    def test_concurrent_misses_share_one_load(self):
+        cache = TTLCache(ttl=60)
+        calls = []
+        release = threading.Event()
+
+        def loader():
+            calls.append(1)
+            release.wait(5)
+            return "status"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_load("mc", loader))) for _ in range(8)]
+        for each in threads:
+            each.start()
+        while cache.coalesced < 7:
+            time.sleep(0.001)
+        release.set()
+        for each in threads:
+            each.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["status"] * 8)
+
+    def test_exceptions_are_not_cached(self):
+        cache = TTLCache(ttl=60)
+        with self.assertRaises(ValueError):
+            cache.get_or_load("mc", mock.Mock(side_effect=ValueError))
+        self.assertEqual(cache.get_or_load("mc", lambda: "ok"), "ok")
+
+
+class StubStatusHandler(BaseHTTPRequestHandler):
+    requests_seen = []
+
+    def do_GET(self):
+        self.requests_seen.append(self.path)
+        if self.path.startswith("/ip"):
+            body = b"203.0.113.7\n"
+        else:
+            server = self.path.rsplit("/", 1)[-1]
+            body = json.dumps({"online": server != "down", "hostname": server, "players": {"online": 3}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@unittest.skipIf(requests is None, "requests is not installed")
+class GetStatusTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubStatusHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        StubStatusHandler.requests_seen = []
+        get_status.status_cache.invalidate()
+        get_status.public_ip_cache.invalidate()
+        self.patches = [
+            mock.patch.object(get_status, "STATUS_API", base + "/2/{}"),
+            mock.patch.dict(get_status.PUBLIC_IP_API, {4: base + "/ip"}),
+        ]
+        for each in self.patches:
+            each.start()
+
+    def tearDown(self):
+        for each in self.patches:
+            each.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_status_is_cached(self):
+        self.assertEqual(get_status.get_status("mc.example")["hostname"], "mc.example")
+        get_status.get_status("mc.example")
+        self.assertEqual(len(StubStatusHandler.requests_seen), 1)
+        get_status.get_status("mc.example", max_age=0)
+        self.assertEqual(len(StubStatusHandler.requests_seen), 2)
+
+    def test_public_ip(self):
+        self.assertEqual(get_status.get_public_ip(), {"type": 4, "address": "203.0.113.7"})
+
+    def test_poller_refreshes_many_servers(self):
+        servers = [f"mc{each}.example" for each in range(20)] + ["down"]
+        statuses = asyncio.run(get_status.poll_once(servers))
+        self.assertEqual(len(statuses), 21)
+        self.assertFalse(statuses["down"]["online"])
+        self.assertTrue(statuses["mc7.example"]["online"])
+
+
+if __name__ == '__main__':
+    unittest.main()
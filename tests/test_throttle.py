@@ -0,0 +1,64 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from app.core import archive, throttle
+
+
+class ThrottleTestCase(unittest.TestCase):
+    def test_parse_tps(self):
+        self.assertEqual(throttle.parse_tps("§6TPS from last 1m, 5m, 15m: §a*20.0, §a19.8, 19.9"), 20.0)
+        self.assertEqual(throttle.parse_tps("TPS from last 1m, 5m, 15m: 14.2, 18.0, 19.1"), 14.2)
+        self.assertEqual(throttle.parse_tps("Target tick rate: 20.0 per second.\nAverage time per tick: 80.0ms"), 12.5)
+        self.assertEqual(throttle.parse_tps("Average time per tick: 3.1ms"), 20.0)
+        self.assertIsNone(throttle.parse_tps(""))
+
+    def test_governor_backs_off_while_lagging_and_recovers(self):
+        readings = iter([12.0, 12.0, 12.0, 20.0])
+        governor = throttle.Governor(read_rate=1000, write_rate=500, min_tps=18, tps_probe=lambda: next(readings))
+        scales = [governor.adjust(governor.lagging()) for _ in range(4)]
+        self.assertEqual(scales, [0.5, 0.25, 0.125, 0.15625])
+        self.assertEqual(governor.backoffs, 3)
+        self.assertAlmostEqual(governor.read_limiter.rate, 156.25)
+        self.assertAlmostEqual(governor.write_limiter.rate, 78.125)
+        self.assertEqual(governor.adjust(True), 0.1)
+        governor.stop()
+        self.assertEqual((governor.read_limiter.rate, governor.write_limiter.rate), (1000, 500))
+        with self.assertRaises(ValueError):
+            throttle.Governor(max_load=1.0)
+
+    def test_archive_writes_are_rate_limited(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source = os.path.join(temp_dir, "world")
+            os.mkdir(source)
+            with open(os.path.join(source, "r.0.0.mca"), "wb") as f:
+                f.write(os.urandom(200000))
+            governor = throttle.Governor(write_rate=400000, burst=0.1)
+            started = time.monotonic()
+            result = archive.write_archive(
+                os.path.join(temp_dir, "world.tar.gz"), "x:gz", source, write_limiter=governor.write_limiter
+            )
+            # roughly 200 KB of incompressible archive at 400 KB/s, less the 40 KB burst
+            self.assertGreater(result["archive_bytes"], 200000)
+            self.assertGreaterEqual(time.monotonic() - started, 0.35)
+
+    def test_nice_does_not_stack(self):
+        # niceness can't be undone, so this runs in a child process
+        script = (
+            "from app.core import throttle\n"
+            "throttle.lower_priority(5)\n"
+            "print(throttle.lower_priority(5)['nice'], throttle.lower_priority(3)['nice'])\n"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", script], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        ).stdout.split()
+        base = os.nice(0)
+        self.assertEqual(output, [str(max(5, base)), str(max(5, base))])
+
+
+if __name__ == '__main__':
+    unittest.main()